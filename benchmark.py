@@ -0,0 +1,339 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+"""
+Synthetic throughput benchmark of resnetv3 training and inference.
+
+No dataset or checkpoint is needed: random images with a pasted "tampered"
+rectangle (its mask and gt box) are written to a temporary directory and
+fed through the real data layer, and the network starts from random
+weights. Each mode builds its own graph, runs warmup iterations and then
+timed ones, and the results go to stdout and optionally a JSON file:
+
+  python benchmark.py --mode both --sizes 512x384,1024x768 --iters 20 --cpu --output bench.json
+  python benchmark.py --baseline bench.json          # compare, exit 1 on a regression
+
+--mode scaling runs data-parallel training (lib/utils/data_parallel.py)
+with each worker count of --workers and reports images/s, the speedup over
+the smallest count and the all-reduce time per step:
+
+  python benchmark.py --mode scaling --workers 1,2,4,8 --cpu
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import tensorflow as tf
+
+from lib.config import config as cfg
+from lib.layer_utils.roi_data_layer import RoIDataLayer
+from lib.nets.b1_fuse_1cbam_mask_1 import resnetv3
+from lib.utils import instrument
+from lib.utils.data_parallel import GradientAllReduce, accumulate_gradients, apply_mean, launch
+from lib.utils.test_mask import im_detect
+
+NUM_CLASSES = 2
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(description='Synthetic training/inference benchmark')
+  parser.add_argument('--mode', default='both', choices=['train', 'test', 'both', 'scaling'],
+                      help='which graph(s) to benchmark; scaling: data-parallel training with --workers')
+  parser.add_argument('--workers', default='1,2,4,8',
+                      help='comma separated worker counts of --mode scaling')
+  parser.add_argument('--sizes', default='512x384',
+                      help='comma separated WIDTHxHEIGHT of the synthetic images (cycled)')
+  parser.add_argument('--num_images', default=8, type=int,
+                      help='number of distinct synthetic images')
+  parser.add_argument('--warmup', default=3, type=int, help='untimed iterations per mode')
+  parser.add_argument('--iters', default=10, type=int, help='timed iterations per mode')
+  parser.add_argument('--intra_threads', default=0, type=int,
+                      help='intra_op_parallelism_threads (0: TensorFlow default)')
+  parser.add_argument('--inter_threads', default=0, type=int,
+                      help='inter_op_parallelism_threads (0: TensorFlow default)')
+  parser.add_argument('--cpu', action='store_true', help='hide the GPUs from TensorFlow')
+  parser.add_argument('--output', default=None, help='write the results as JSON to this file')
+  parser.add_argument('--baseline', default=None, help='JSON results of an earlier run to compare against')
+  parser.add_argument('--tolerance', default=0.1, type=float,
+                      help='relative throughput drop against the baseline reported as a regression')
+  parser.add_argument('--seed', default=3, type=int)
+  args, _ = parser.parse_known_args()
+  return args
+
+
+def parse_sizes(sizes):
+  return [tuple(int(v) for v in size.lower().split('x')) for size in sizes.split(',') if size.strip()]
+
+
+def synthetic_image(width, height, rng):
+  """BGR noise image with one rectangle of different texture, its binary mask and gt box."""
+  im = rng.randint(0, 256, size=(height, width, 3)).astype(np.uint8)
+  im = cv2.GaussianBlur(im, (5, 5), 0)
+  w = rng.randint(width // 8, width // 3)
+  h = rng.randint(height // 8, height // 3)
+  x1 = rng.randint(0, width - w)
+  y1 = rng.randint(0, height - h)
+  im[y1:y1 + h, x1:x1 + w] = rng.randint(0, 256, size=(h, w, 3))
+  mask = np.zeros((height, width), dtype=np.uint8)
+  mask[y1:y1 + h, x1:x1 + w] = 255
+  return im, mask, np.array([x1, y1, x1 + w - 1, y1 + h - 1], dtype=np.uint16)
+
+
+def synthetic_roidb(sizes, num_images, root, rng):
+  """Write synthetic images/masks under `root` and return (roidb, images)."""
+  roidb = []
+  images = []
+  for i in range(num_images):
+    width, height = sizes[i % len(sizes)]
+    im, mask, box = synthetic_image(width, height, rng)
+    im_path = os.path.join(root, 'im_{:d}.png'.format(i))
+    mask_path = os.path.join(root, 'mask_{:d}.png'.format(i))
+    cv2.imwrite(im_path, im)
+    cv2.imwrite(mask_path, mask)
+    overlaps = np.zeros((1, NUM_CLASSES), dtype=np.float32)
+    overlaps[0, 1] = 1.0
+    roidb.append({'image': im_path,
+                  'mask': mask_path,
+                  'width': width,
+                  'height': height,
+                  'flipped': False,
+                  'boxes': box[np.newaxis, :],
+                  'gt_classes': np.array([1], dtype=np.int32),
+                  'gt_overlaps': overlaps,
+                  'seg_areas': np.array([float(box[2] - box[0] + 1) * (box[3] - box[1] + 1)], dtype=np.float32),
+                  'max_classes': np.array([1]),
+                  'max_overlaps': np.array([1.0], dtype=np.float32)})
+    images.append(im)
+  return roidb, images
+
+
+def session_config(args):
+  tfconfig = tf.ConfigProto(allow_soft_placement=True,
+                            intra_op_parallelism_threads=args.intra_threads,
+                            inter_op_parallelism_threads=args.inter_threads)
+  tfconfig.gpu_options.allow_growth = True
+  if args.cpu:
+    tfconfig.device_count['GPU'] = 0
+  return tfconfig
+
+
+def peak_rss_mb():
+  # ru_maxrss is in kilobytes on Linux
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def latency_summary(seconds):
+  ms = np.array(seconds) * 1000.
+  return {'mean': float(ms.mean()), 'p50': float(np.percentile(ms, 50)), 'p90': float(np.percentile(ms, 90)),
+          'p95': float(np.percentile(ms, 95)), 'p99': float(np.percentile(ms, 99)), 'max': float(ms.max())}
+
+
+def bench_train(args, roidb):
+  """Data layer + train_step_with_mask (momentum optimizer as in train_mask.py)."""
+  graph = tf.Graph()
+  with graph.as_default():
+    tf.set_random_seed(args.seed)
+    sess = tf.Session(config=session_config(args))
+    net = resnetv3(batch_size=1, num_layers=101)
+    layers = net.create_architecture(sess, 'TRAIN', NUM_CLASSES, tag='default')
+    lr = tf.Variable(cfg.FLAGS.learning_rate, trainable=False)
+    optimizer = tf.train.MomentumOptimizer(lr, cfg.FLAGS.momentum)
+    gvs = [(tf.clip_by_norm(g, 10), v) for g, v in optimizer.compute_gradients(layers['total_loss'])
+           if g is not None]
+    train_op = optimizer.apply_gradients(gvs)
+    sess.run(tf.global_variables_initializer())
+  data_layer = RoIDataLayer(roidb, NUM_CLASSES)
+
+  step_times, data_times = [], []
+  for it in range(args.warmup + args.iters):
+    start = time.perf_counter()
+    blobs = data_layer.forward()
+    loaded = time.perf_counter()
+    net.train_step_with_mask(sess, blobs, train_op)
+    if it >= args.warmup:
+      data_times.append(loaded - start)
+      step_times.append(time.perf_counter() - start)
+  sess.close()
+  total = sum(step_times)
+  return {'iters': args.iters,
+          'steps_per_sec': args.iters / total,
+          # the data layer feeds one image per step
+          'images_per_sec': args.iters / total,
+          'latency_ms': latency_summary(step_times),
+          'data_ms': latency_summary(data_times),
+          'peak_rss_mb': peak_rss_mb()}
+
+
+def bench_train_worker(rank, num_workers, comm, args, roidb, result_path):
+  """One data-parallel training process; rank 0 writes its timings to `result_path`."""
+  np.random.seed(args.seed + rank)
+  if num_workers > 1 and not args.intra_threads:
+    # As train_mask.py: the cores are shared between the workers
+    args.intra_threads = args.inter_threads = max(1, multiprocessing.cpu_count() // num_workers)
+  graph = tf.Graph()
+  with graph.as_default():
+    tf.set_random_seed(args.seed)
+    sess = tf.Session(config=session_config(args))
+    net = resnetv3(batch_size=1, num_layers=101)
+    layers = net.create_architecture(sess, 'TRAIN', NUM_CLASSES, tag='default')
+    lr = tf.Variable(cfg.FLAGS.learning_rate, trainable=False)
+    optimizer = tf.train.MomentumOptimizer(lr, cfg.FLAGS.momentum)
+    gvs = [(tf.clip_by_norm(g, 10), v) for g, v in optimizer.compute_gradients(layers['total_loss'])
+           if g is not None]
+    train_op, apply_op, mean_gvs, accumulators = accumulate_gradients(optimizer, gvs, 1)
+    sess.run(tf.variables_initializer(tf.global_variables() + accumulators))
+  # The six losses of train_step_with_mask are averaged along with the gradients
+  size = sum(int(np.prod(v.get_shape().as_list())) for _, v in mean_gvs) + 6
+  allreduce = GradientAllReduce(rank, num_workers, size, comm)
+  data_layer = RoIDataLayer(roidb, NUM_CLASSES, shard=(rank, num_workers), seed=args.seed)
+
+  step_times, reduce_times = [], []
+  for it in range(args.warmup + args.iters):
+    start = time.perf_counter()
+    losses = net.train_step_with_mask(sess, data_layer.forward(), train_op)
+    computed = time.perf_counter()
+    apply_mean(sess, allreduce, apply_op, mean_gvs, losses)
+    if it >= args.warmup:
+      step_times.append(time.perf_counter() - start)
+      reduce_times.append(time.perf_counter() - computed)
+  sess.close()
+  allreduce.close()
+  if rank == 0:
+    with open(result_path, 'w') as f:
+      json.dump({'step_times': step_times, 'reduce_times': reduce_times, 'peak_rss_mb': peak_rss_mb()}, f)
+
+
+def bench_scaling(args, roidb):
+  """Data-parallel training throughput for each worker count of --workers."""
+  counts = [int(v) for v in args.workers.split(',') if v.strip()]
+  results = {}
+  for count in counts:
+    fd, result_path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+      launch(bench_train_worker, count, (args, roidb, result_path))
+      with open(result_path) as f:
+        worker = json.load(f)
+    finally:
+      os.remove(result_path)
+    total = sum(worker['step_times'])
+    results[str(count)] = {'workers': count,
+                           'steps_per_sec': args.iters / total,
+                           # every worker trains on one image per step
+                           'images_per_sec': count * args.iters / total,
+                           'latency_ms': latency_summary(worker['step_times']),
+                           'allreduce_ms': latency_summary(worker['reduce_times']),
+                           'peak_rss_mb_per_worker': worker['peak_rss_mb']}
+  base = results[str(min(counts))]
+  for r in results.values():
+    r['speedup'] = r['images_per_sec'] / base['images_per_sec']
+    r['efficiency'] = r['speedup'] * base['workers'] / r['workers']
+  return results
+
+
+def bench_test(args, images):
+  """im_detect on in-memory images (no decode)."""
+  graph = tf.Graph()
+  with graph.as_default():
+    sess = tf.Session(config=session_config(args))
+    net = resnetv3(batch_size=1, num_layers=101)
+    net.create_architecture(sess, 'TEST', NUM_CLASSES, tag='default')
+    sess.run(tf.global_variables_initializer())
+
+  times = []
+  for it in range(args.warmup + args.iters):
+    im = images[it % len(images)]
+    start = time.perf_counter()
+    im_detect(sess, net, im)
+    if it >= args.warmup:
+      times.append(time.perf_counter() - start)
+  sess.close()
+  return {'iters': args.iters,
+          'images_per_sec': args.iters / sum(times),
+          'latency_ms': latency_summary(times),
+          'peak_rss_mb': peak_rss_mb()}
+
+
+def compare(results, baseline, tolerance):
+  """Print throughput against `baseline`; returns the modes that regressed."""
+  regressions = []
+  for mode in ('train', 'test'):
+    if mode not in results or mode not in baseline:
+      continue
+    new = results[mode]['images_per_sec']
+    old = baseline[mode]['images_per_sec']
+    change = new / old - 1.
+    print('{:5s} {:8.3f} img/s vs {:8.3f} baseline ({:+.1%}), p95 {:.1f}ms vs {:.1f}ms'.format(
+      mode, new, old, change, results[mode]['latency_ms']['p95'], baseline[mode]['latency_ms']['p95']))
+    if change < -tolerance:
+      regressions.append(mode)
+  return regressions
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  rng = np.random.RandomState(args.seed)
+  np.random.seed(args.seed)
+  sizes = parse_sizes(args.sizes)
+
+  results = {'config': {'sizes': ['{:d}x{:d}'.format(w, h) for w, h in sizes],
+                        'num_images': args.num_images,
+                        'warmup': args.warmup,
+                        'scales': list(cfg.FLAGS2['scales']),
+                        'test_scales': list(cfg.FLAGS2['test_scales']),
+                        'max_size': cfg.FLAGS.max_size,
+                        'train_crop': cfg.FLAGS.train_crop,
+                        'intra_op_parallelism_threads': args.intra_threads,
+                        'inter_op_parallelism_threads': args.inter_threads,
+                        'cpu_count': multiprocessing.cpu_count(),
+                        'gpu': not args.cpu and tf.test.is_gpu_available(),
+                        'tensorflow': tf.__version__}}
+
+  root = tempfile.mkdtemp(prefix='emunet_bench_')
+  try:
+    roidb, images = synthetic_roidb(sizes, args.num_images, root, rng)
+    if args.mode in ('train', 'both'):
+      results['train'] = bench_train(args, roidb)
+    if args.mode in ('test', 'both'):
+      results['test'] = bench_test(args, images)
+    if args.mode == 'scaling':
+      results['scaling'] = bench_scaling(args, roidb)
+  finally:
+    shutil.rmtree(root)
+  results['peak_rss_mb'] = peak_rss_mb()
+  results['instrument'] = instrument.snapshot()
+
+  for mode in ('train', 'test'):
+    if mode in results:
+      r = results[mode]
+      print('{:5s} {:8.3f} img/s  latency mean {:.1f}ms p50 {:.1f}ms p95 {:.1f}ms p99 {:.1f}ms'.format(
+        mode, r['images_per_sec'], r['latency_ms']['mean'], r['latency_ms']['p50'],
+        r['latency_ms']['p95'], r['latency_ms']['p99']))
+  for r in sorted(results.get('scaling', {}).values(), key=lambda r: r['workers']):
+    print('{:2d} workers {:8.3f} img/s  speedup {:.2f}x  efficiency {:.0%}  step p50 {:.1f}ms  '
+          'all-reduce p50 {:.1f}ms'.format(r['workers'], r['images_per_sec'], r['speedup'], r['efficiency'],
+                                           r['latency_ms']['p50'], r['allreduce_ms']['p50']))
+  print('peak RSS {:.0f} MB'.format(results['peak_rss_mb']))
+  if args.output:
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=2, sort_keys=True)
+    print('wrote {:s}'.format(args.output))
+
+  if args.baseline:
+    with open(args.baseline) as f:
+      baseline = json.load(f)
+    if compare(results, baseline, args.tolerance):
+      sys.exit(1)
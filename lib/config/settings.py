@@ -0,0 +1,363 @@
+"""Plain-Python settings, importable without TensorFlow.
+
+Every hyperparameter is declared once below: FLAG_SETTINGS are the former
+tf.app.flags and EXTRA_SETTINGS the former FLAGS2 dict. Both live in one
+Settings object that answers attribute access (FLAGS.x) and item access
+(FLAGS2["x"]). Values are resolved on first use from, in order, the
+defaults, a YAML/JSON file given by --config or $EMUNET_CONFIG, and
+--name=value command line arguments.
+
+lib/config/config.py mirrors FLAG_SETTINGS into tf.app.flags for graph
+code. Data loading, datasets and evaluation import this module (or
+config.py's FLAGS/FLAGS2, which are the same object) and never pay for the
+TensorFlow import.
+"""
+import json
+import os
+import os.path as osp
+import sys
+
+import numpy as np
+
+# (name, type, default, help)
+FLAG_SETTINGS = [
+    ######################
+    # General Parameters #
+    ######################
+    ('rng_seed', int, 3, "Tensorflow seed for reproducibility"),
+    ('pooling_mode', str, "crop", "Default pooling mode, only 'crop' is available"),
+
+    ######################
+    # Network Parameters #
+    ######################
+    ('network', str, "resnet_v1", "The network to be used as backbone"),
+
+    #######################
+    # Training Parameters #
+    #######################
+    ('weight_decay', float, 0.0005, "Weight decay, for regularization"),
+    ('learning_rate', float, 0.001, "Learning rate"),
+    ('momentum', float, 0.9, "Momentum"),
+    ('gamma', float, 0.1, "Factor for reducing the learning rate"),
+    ('USE_MASK', bool, True, "resized to a square of POOLING_SIZE"),
+    ('MASK_BATCH', int, 8, "Network batch size during training"),
+    ('batch_size', int, 256, "Network batch size during training"),
+    ('max_iters', int, 110000, "Max iteration"),
+    ('display', int, 10, "Iteration intervals for showing the loss during training, on command line interface"),
+    ('fixed_blocks', int, 1, "Number of fixed blocks during training, by default the first of all 4 blocks is fixed"),
+    ('initializer', str, "truncated", "Network initialization parameters"),
+    ('pretrained_model', str, "/data/cxm/code/Image_manipulation_detection-master/data/imagenet_weights/resnet_v1_101.ckpt",
+     "Pretrained network weights"),
+    ('bias_decay', bool, False, "Whether to have weight decay on bias as well"),
+    ('double_bias', bool, True, "Whether to double the learning rate for bias"),
+    ('use_all_gt', bool, True, "Whether to use all ground truth bounding boxes for training, "
+                               "For COCO, setting USE_ALL_GT to False will exclude boxes that are flagged as ''iscrowd''"),
+    ('max_pool', bool, False, "resized to a square of POOLING_SIZE"),
+    ('columnar_roidb', bool, False, "Convert list-of-dicts roidbs to lib/datasets/columnar_roidb.py "
+                                    "(datasets using imdb.cached_gt_roidb are always columnar)"),
+    ('roidb_workers', int, 0, "Processes parsing the annotations when a gt roidb is not cached (0: one per "
+                              "CPU, 1: in this process; always in this process without fork, e.g. on Windows)"),
+    ('max_size', int, 1000, "Max pixel size of the longest side of a scaled input image"),
+    ('test_max_size', int, 1000, "Max pixel size of the longest side of a scaled input image"),
+    ('ims_per_batch', int, 1, "Images to use per minibatch"),
+    ('snapshot_iterations', int, 5000, "Iteration to take snapshot"),
+    ('snapshot_async', bool, True, "Write snapshots from a background thread (lib/utils/checkpoint.py)"),
+    ('snapshot_keep_last', int, 5, "Number of most recent snapshots to keep (0: off)"),
+    ('snapshot_keep_every', int, 0, "Also keep every snapshot whose iteration is a multiple of this (0: off)"),
+    ('snapshot_keep_best', int, 1, "Also keep the snapshots with the lowest mean total loss (0: off)"),
+    ('instrument', bool, True, "Record lib/utils/instrument.py timers and counters and report them at exit"),
+    ('profile_every', int, 0, "Trace every N-th training step into <output_dir>/profile and print a "
+                              "per-phase breakdown with the loss (lib/utils/profiler.py, 0: off)"),
+    ('iter_size', int, 1, "Images whose gradients are accumulated into one update; iterations, the LR "
+                          "schedule, snapshots and the loss display count updates"),
+    ('augment', str, "", "Comma separated robustness augmentations of the training images: resize, blur, "
+                         "noise, jpeg (lib/utils/augment.py, empty: off)"),
+    ('augment_prob', float, 0.5, "Probability of applying each augmentation to an image"),
+    ('augment_region_prob', float, 0.5, "Probability that an applied augmentation only covers the gt boxes "
+                                        "(the tampered regions) instead of the whole image"),
+    ('train_crop', int, 0, "Train on random train_crop x train_crop crops of the scaled images, with a static "
+                           "input shape and a single anchor grid (0: off, whole images)"),
+    ('train_crop_fg', float, 0.7, "Probability that a training crop is placed around a gt box rather than "
+                                  "anywhere in the image"),
+    ('train_crop_min_visible', float, 0.3, "Fraction of a gt box that must fall inside a training crop for the "
+                                           "box to be kept; a box larger than the crop counts as whole when "
+                                           "it fills the crop"),
+    ('workers', int, 1, "Data-parallel training processes on this machine; gradients are averaged through "
+                        "shared memory (lib/utils/data_parallel.py) and every worker reads its own shard"),
+    ('head_only', bool, False, "Freeze both backbone streams and the CBAM fusion and train the RPN, RCNN and "
+                               "mask heads from net_conv4 maps cached under <data_dir>/cache/features"),
+
+    ######################
+    # Testing Parameters #
+    ######################
+    ('test_mode', str, "top", "Test mode for bbox proposal"),  # nms, top
+    ('test_tile', int, 0, "Tile images whose longest side exceeds this many pixels into overlapping "
+                          "test_tile x test_tile windows (0: off, resize to test_scales as usual)"),
+    ('test_tile_overlap', int, 128, "Overlap in pixels between neighbouring tiles"),
+    ('test_tile_scale', float, 1.0, "Scale the tiles are fed to the network at (1.0: native resolution)"),
+    ('test_tile_nms', float, 0.3, "IoU threshold of the NMS merging mask RoIs across tiles"),
+    ('cascade_thresh', float, 0.0, "Run the mask branch and paste-back only for images with a RoI whose tamper "
+                                   "probability exceeds this, an empty mask otherwise (0: off, always run)"),
+    ('cascade_report_thresh', str, "0.05,0.1,0.2,0.3,0.5", "Thresholds the cascade sink simulates on a "
+                                                           "labeled set (comma separated)"),
+    ('sweep_cache_mb', int, 2048, "Memory for the decoded test images a --sweep keeps between checkpoints, split "
+                                  "between its workers; images past it are decoded for every checkpoint"),
+    ('pixel_metric_bits', int, 0, "Pixel F1/AUC from histograms of the mask quantized to this many bits, an "
+                                  "estimate that is much faster on large images (0: exact curves over every "
+                                  "pixel score, comparable with earlier results)"),
+    ('dump_mask_format', str, "soft", "Mask encoding of the dump sink (lib/utils/mask_codec.py): soft (8-bit "
+                                      "packed), rle (binarized at 0.5) or npz (float32 inside the .npz)"),
+
+    ##################
+    # RPN Parameters #
+    ##################
+    ('rpn_negative_overlap', float, 0.3, "IOU < thresh: negative example"),
+    ('rpn_positive_overlap', float, 0.7, "IOU >= thresh: positive example"),
+    ('rpn_fg_fraction', float, 0.5, "Max number of foreground examples"),
+    ('rpn_train_nms_thresh', float, 0.7, "NMS threshold used on RPN proposals"),
+    ('rpn_test_nms_thresh', float, 0.7, "NMS threshold used on RPN proposals"),
+    ('rpn_train_pre_nms_top_n', int, 12000, "Number of top scoring boxes to keep before apply NMS to RPN proposals"),
+    ('rpn_train_post_nms_top_n', int, 2000, "Number of top scoring boxes to keep before apply NMS to RPN proposals"),
+    ('rpn_test_pre_nms_top_n', int, 6000, "Number of top scoring boxes to keep before apply NMS to RPN proposals"),
+    ('rpn_test_post_nms_top_n', int, 300, "Number of top scoring boxes to keep before apply NMS to RPN proposals"),
+    ('rpn_batchsize', int, 256, "Total number of examples"),
+    ('rpn_positive_weight', int, -1,
+     'Give the positive RPN examples weight of p * 1 / {num positives} and give negatives a weight of (1 - p).'
+     'Set to -1.0 to use uniform example weighting'),
+    ('rpn_top_n', int, 300, "Only useful when TEST.MODE is 'top', specifies the number of top proposals to select"),
+    ('K', int, 3, 'RFCN grid size'),
+    ('CLASSES', int, 2, 'RFCN grid size'),
+    ('rpn_clobber_positives', bool, False, "If an anchor satisfied by positive and negative conditions set to negative"),
+
+    #######################
+    # Proposal Parameters #
+    #######################
+    ('proposal_fg_fraction', float, 0.25, "Fraction of minibatch that is labeled foreground (i.e. class > 0)"),
+    ('proposal_use_gt', bool, False, "Whether to add ground truth boxes to the pool when sampling regions"),
+
+    ###########################
+    # Bounding Box Parameters #
+    ###########################
+    ('roi_fg_threshold', float, 0.5, "Overlap threshold for a ROI to be considered foreground (if >= FG_THRESH)"),
+    ('roi_bg_threshold_high', float, 0.5,
+     "Overlap threshold for a ROI to be considered background (class = 0 if overlap in [LO, HI))"),
+    ('roi_bg_threshold_low', float, 0.1,
+     "Overlap threshold for a ROI to be considered background (class = 0 if overlap in [LO, HI))"),
+    ('bbox_normalize_targets_precomputed', bool, True,
+     "# Normalize the targets using 'precomputed' (or made up) means and stdevs (BBOX_NORMALIZE_TARGETS must also be True)"),
+    ('test_bbox_reg', bool, True, "Test using bounding-box regressors"),
+
+    ##################
+    # ROI Parameters #
+    ##################
+    ('roi_pooling_size', int, 7, "Size of the pooled region after RoI pooling"),
+]
+
+_ROOT_DIR = osp.abspath(osp.join(osp.dirname(__file__), '..', '..'))
+
+# The former FLAGS2 entries. They are not tf.app.flags.
+EXTRA_SETTINGS = [
+    ('pixel_means', np.ndarray, [[[102.9801, 115.9465, 122.7717]]], "BGR pixel means subtracted from the input"),
+    ('scales', tuple, (600,), "Shorter side of the training images (one picked at random)"),
+    ('test_scales', tuple, (600,), "Shorter side of the test images"),
+    ('bbox_inside_weights', tuple, (1.0, 1.0, 1.0, 1.0), "Weights of the bbox regression targets"),
+    ('bbox_normalize_means', tuple, (0.0, 0.0, 0.0, 0.0), "Means used to normalize the bbox targets"),
+    ('bbox_normalize_stds', tuple, (0.1, 0.1, 0.1, 0.1), "Stdevs used to normalize the bbox targets"),
+    ('augment_jpeg_quality', tuple, (60, 95), "Range of the JPEG recompression quality"),
+    ('augment_noise_sigma', tuple, (1.0, 5.0), "Range of the standard deviation of the Gaussian noise"),
+    ('augment_resize_scale', tuple, (0.5, 0.9), "Range of the factor images are resized down by (and back up)"),
+    ('augment_blur_sigma', tuple, (0.5, 1.5), "Range of the sigma of the Gaussian blur"),
+    ('root_dir', str, _ROOT_DIR, "Root of the repository"),
+    ('data_dir', str, osp.join(_ROOT_DIR, 'data'), "Data directory"),
+    # e.g. {'casia': '/data/CASIA'}
+    ('dataset_roots', dict, {}, "Overrides of the dataset roots in lib/datasets/factory.py"),
+]
+
+
+def _parse_bool(value):
+    if isinstance(value, str):
+        lowered = value.lower()
+        if lowered in ('true', 't', '1', 'yes'):
+            return True
+        if lowered in ('false', 'f', '0', 'no'):
+            return False
+        raise ValueError('Not a boolean: {}'.format(value))
+    return bool(value)
+
+
+def coerce(spec, value):
+    """Convert `value` (possibly a command line string) to the type of a setting."""
+    name, type_, default, _ = spec
+    if type_ is bool:
+        return _parse_bool(value)
+    if type_ in (int, float, str):
+        return type_(value)
+    if type_ is tuple:
+        if isinstance(value, str):
+            value = [v for v in value.split(',') if v]
+        element = type(default[0]) if default else str
+        return tuple(element(v) for v in value)
+    if type_ is np.ndarray:
+        if isinstance(value, str):
+            value = json.loads(value)
+        return np.array(value, dtype=np.float64)
+    if type_ is dict:
+        if isinstance(value, str):
+            value = json.loads(value)
+        return dict(value)
+    raise TypeError('Unsupported type for {}'.format(name))
+
+
+def load_file(path):
+    """Read a YAML or JSON settings file into a dict."""
+    with open(path) as f:
+        text = f.read()
+    if osp.splitext(path)[1].lower() in ('.yaml', '.yml'):
+        import yaml
+        return yaml.safe_load(text) or {}
+    return json.loads(text)
+
+
+class Settings(object):
+    """Typed settings with attribute (FLAGS.x) and item (FLAGS2["x"]) access."""
+
+    def __init__(self, specs, values=None, frozen=False):
+        object.__setattr__(self, '_specs', dict((spec[0], spec) for spec in specs))
+        object.__setattr__(self, '_order', [spec[0] for spec in specs])
+        object.__setattr__(self, '_values', dict((spec[0], coerce(spec, spec[2])) for spec in specs))
+        object.__setattr__(self, '_parsed', values is not None)
+        object.__setattr__(self, '_frozen', frozen)
+        if values is not None:
+            self._values.update(values)
+
+    def _ensure_parsed(self):
+        if not self._parsed:
+            object.__setattr__(self, '_parsed', True)
+            self.parse(sys.argv[1:])
+
+    def parse(self, argv):
+        """Apply --config/$EMUNET_CONFIG and the known --name=value arguments.
+
+        Unknown arguments are left alone (the scripts parse their own with
+        argparse); returns them.
+        """
+        object.__setattr__(self, '_parsed', True)
+        config = os.environ.get('EMUNET_CONFIG')
+        overrides = []
+        rest = []
+        i = 0
+        while i < len(argv):
+            arg = argv[i]
+            i += 1
+            if not arg.startswith('--'):
+                rest.append(arg)
+                continue
+            name, value = arg[2:], None
+            if '=' in name:
+                name, value = name.split('=', 1)
+            if name != 'config' and name not in self._specs:
+                if value is None and name.startswith('no') and self._specs.get(name[2:], (None, None))[1] is bool:
+                    name, value = name[2:], 'false'
+                else:
+                    rest.append(arg)
+                    continue
+            if value is None:
+                if self._specs.get(name, (None, None))[1] is bool:
+                    value = 'true'
+                elif i < len(argv):
+                    value = argv[i]
+                    i += 1
+                else:
+                    raise ValueError('Missing value for --{}'.format(name))
+            if name == 'config':
+                config = value
+            else:
+                overrides.append((name, value))
+        if config:
+            self.update(load_file(config))
+        for name, value in overrides:
+            self[name] = value
+        return rest
+
+    def update(self, mapping):
+        for name, value in mapping.items():
+            self[name] = value
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        self._ensure_parsed()
+        try:
+            return self._values[name]
+        except KeyError:
+            raise AttributeError('Unknown setting: {}'.format(name))
+
+    def __setattr__(self, name, value):
+        if self._frozen:
+            raise AttributeError('Settings are frozen')
+        if name not in self._specs:
+            raise AttributeError('Unknown setting: {}'.format(name))
+        self._ensure_parsed()
+        self._values[name] = coerce(self._specs[name], value)
+
+    def __getitem__(self, name):
+        self._ensure_parsed()
+        return self._values[name]
+
+    def __setitem__(self, name, value):
+        if name not in self._specs:
+            raise KeyError('Unknown setting: {}'.format(name))
+        setattr(self, name, value)
+
+    def __contains__(self, name):
+        return name in self._specs
+
+    def get(self, name, default=None):
+        return self[name] if name in self._specs else default
+
+    def snapshot(self):
+        """All values as plain JSON/YAML-serializable Python objects."""
+        self._ensure_parsed()
+        out = {}
+        for name in self._order:
+            value = self._values[name]
+            if isinstance(value, np.ndarray):
+                value = value.tolist()
+            elif isinstance(value, tuple):
+                value = list(value)
+            out[name] = value
+        return out
+
+    def freeze(self):
+        """A read-only copy of the current values."""
+        self._ensure_parsed()
+        return Settings([self._specs[name] for name in self._order], dict(self._values), frozen=True)
+
+    def save(self, path):
+        """Write the current values as JSON (also valid YAML), e.g. next to the checkpoints."""
+        with open(path, 'w') as f:
+            json.dump(self.snapshot(), f, indent=2, sort_keys=True)
+        return path
+
+
+settings = Settings(FLAG_SETTINGS + EXTRA_SETTINGS)
+
+# The names the rest of the code uses.
+FLAGS = settings
+FLAGS2 = settings
+
+
+def get_output_dir(imdb, weights_filename):
+    """Return the directory where experimental artifacts are placed.
+    If the directory does not exist, it is created.
+
+    A canonical path is built using the name from an imdb and a network
+    (if not None).
+    """
+    outdir = osp.abspath(osp.join(FLAGS2["root_dir"], FLAGS2["root_dir"], 'default', imdb.name))
+    if weights_filename is None:
+        weights_filename = 'default'
+    outdir = osp.join(outdir, weights_filename)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    return outdir
@@ -17,7 +17,7 @@ import xml.etree.ElementTree as ET
 import numpy as np
 import scipy.sparse
 
-from lib.config import config as cfg
+from lib.config import settings as cfg
 from lib.datasets.imdb import imdb
 from .voc_eval import voc_eval
 
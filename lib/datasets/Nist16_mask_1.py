@@ -20,10 +20,7 @@ import pickle
 import subprocess
 import uuid
 from lib.datasets.voc_eval import voc_eval
-from lib.config import config as cfg
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+from lib.config import settings as cfg
 
 class Nist16(imdb):
   def __init__(self, image_set, year, dist_path=None):
@@ -130,23 +127,7 @@ class Nist16(imdb):
 
     This function loads/saves from/to a cache file to speed up future calls.
     """
-    cache_file = os.path.join(self.cache_path, self.name + '_gt_roidb.pkl')
-    if os.path.exists(cache_file):
-      with open(cache_file, 'rb') as fid:
-        try:
-          roidb = pickle.load(fid)
-        except:
-          roidb = pickle.load(fid, encoding='bytes')
-      print('{} gt roidb loaded from {}'.format(self.name, cache_file))
-      return roidb
-
-    gt_roidb = [self.roidb_gt(index)
-                for index in self.image_index]
-    with open(cache_file, 'wb') as fid:
-      pickle.dump(gt_roidb, fid, pickle.HIGHEST_PROTOCOL)
-    print('wrote gt roidb to {}'.format(cache_file))
-
-    return gt_roidb
+    return self.cached_gt_roidb(self.roidb_gt)
 
   def rpn_roidb(self): #读取并返回ROI的db
     if int(self._year) == 2007 or self._image_set != 'test':
@@ -300,6 +281,9 @@ class Nist16(imdb):
                            dets[k, 2] + 1, dets[k, 3] + 1))
 
   def _do_python_eval(self, output_dir='output'):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
     annopath = os.path.join(
       self._dist_path,
       'coco_multi' ,
@@ -0,0 +1,366 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Struct-of-arrays roidb.
+
+The boxes of all images are concatenated into a few flat arrays indexed by
+per-image offsets, gt_overlaps is kept dense (it only has num_classes
+columns), image/mask paths are interned, and a horizontally flipped copy is
+a mirror bit on an entry rather than a second set of arrays. Indexing
+returns a dict-like view, so code written against the list-of-dicts roidb
+keeps working.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+try:
+  from collections.abc import MutableMapping
+except ImportError:
+  from collections import MutableMapping
+
+import os
+import shutil
+
+import numpy as np
+import scipy.sparse
+
+# Columns holding one row per gt box.
+BOX_KEYS = ('boxes', 'gt_classes', 'gt_overlaps', 'seg_areas', 'max_classes', 'max_overlaps')
+
+
+def _dense(overlaps):
+  return overlaps.toarray() if scipy.sparse.issparse(overlaps) else np.asarray(overlaps)
+
+
+def flip_boxes(boxes, width):
+  """Mirror uint16 boxes horizontally the way imdb.append_flipped_images does."""
+  boxes = boxes.copy()
+  oldx1 = boxes[:, 0].astype(np.int64)
+  oldx2 = boxes[:, 2].astype(np.int64)
+  boxes[:, 0] = (width - oldx2 - 1).astype(boxes.dtype)
+  boxes[:, 2] = (width - oldx1 - 1).astype(boxes.dtype)
+  boxes[boxes[:, 2] < boxes[:, 0], 0] = 0
+  return boxes
+
+
+class RoidbEntry(MutableMapping):
+  """Dict-like view of one roidb entry.
+
+  Reads come from the columns of the parent ColumnarRoidb and writes to the
+  known keys go back into them. Any other key is kept in a small per-entry
+  dict, so consumers can still attach their own fields.
+  """
+
+  def __init__(self, roidb, index):
+    self._roidb = roidb
+    self._index = index
+
+  def __getitem__(self, key):
+    return self._roidb._get(self._index, key)
+
+  def __setitem__(self, key, value):
+    self._roidb._set(self._index, key, value)
+
+  def __delitem__(self, key):
+    extras = self._roidb._extras.get(self._index, {})
+    if key not in extras:
+      raise KeyError(key)
+    del extras[key]
+
+  def __iter__(self):
+    return iter(self._roidb._keys(self._index))
+
+  def __len__(self):
+    return len(self._roidb._keys(self._index))
+
+  def __repr__(self):
+    return 'RoidbEntry({:d}, {})'.format(self._index, dict(self))
+
+
+class ColumnarRoidb(object):
+  """A roidb stored as concatenated numpy columns."""
+
+  def __init__(self, num_classes):
+    self.num_classes = num_classes
+    # one row per gt box
+    self._boxes = np.zeros((0, 4), dtype=np.uint16)
+    self._gt_classes = np.zeros((0,), dtype=np.int32)
+    self._gt_overlaps = np.zeros((0, num_classes), dtype=np.float32)
+    self._seg_areas = np.zeros((0,), dtype=np.float32)
+    self._max_classes = None
+    self._max_overlaps = None
+    # one row per image, boxes of image j are [offsets[j], offsets[j + 1])
+    self._offsets = np.zeros((1,), dtype=np.int64)
+    self._image_flipped = np.zeros((0,), dtype=bool)
+    self._width = np.zeros((0,), dtype=np.int32)
+    self._height = np.zeros((0,), dtype=np.int32)
+    self._image = np.zeros((0,), dtype=np.int32)
+    self._mask = np.zeros((0,), dtype=np.int32)
+    # one row per roidb entry
+    self._base = np.zeros((0,), dtype=np.int32)
+    self._mirrored = np.zeros((0,), dtype=bool)
+    # interned image and mask paths
+    self._paths = []
+    self._path_ids = {}
+    # keys set by consumers that have no column
+    self._extras = {}
+
+  @classmethod
+  def from_list(cls, roidb, num_classes):
+    """Convert a list-of-dicts roidb; every dict becomes one image."""
+    self = cls(num_classes)
+    num_images = len(roidb)
+    counts = np.array([entry['boxes'].shape[0] for entry in roidb], dtype=np.int64)
+    self._offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+    if num_images > 0:
+      self._boxes = np.concatenate([entry['boxes'].reshape(-1, 4) for entry in roidb]).astype(np.uint16)
+      self._gt_classes = np.concatenate([entry['gt_classes'] for entry in roidb]).astype(np.int32)
+      self._gt_overlaps = np.concatenate(
+        [_dense(entry['gt_overlaps']).reshape(-1, num_classes) for entry in roidb]).astype(np.float32)
+      self._seg_areas = np.concatenate(
+        [entry.get('seg_areas', np.zeros((entry['boxes'].shape[0],), dtype=np.float32)) for entry in roidb]
+      ).astype(np.float32)
+    self._image_flipped = np.array([bool(entry.get('flipped', False)) for entry in roidb], dtype=bool)
+    self._width = np.array([entry.get('width', -1) for entry in roidb], dtype=np.int32)
+    self._height = np.array([entry.get('height', -1) for entry in roidb], dtype=np.int32)
+    self._image = np.array([self._intern(entry.get('image')) for entry in roidb], dtype=np.int32)
+    self._mask = np.array([self._intern(entry.get('mask')) for entry in roidb], dtype=np.int32)
+    self._base = np.arange(num_images, dtype=np.int32)
+    self._mirrored = np.zeros((num_images,), dtype=bool)
+    if num_images > 0 and all('max_overlaps' in entry for entry in roidb):
+      self._max_classes = np.concatenate([entry['max_classes'] for entry in roidb])
+      self._max_overlaps = np.concatenate([entry['max_overlaps'] for entry in roidb])
+    return self
+
+  def _intern(self, path):
+    if path is None:
+      return -1
+    ind = self._path_ids.get(path)
+    if ind is None:
+      ind = len(self._paths)
+      self._paths.append(path)
+      self._path_ids[path] = ind
+    return ind
+
+  def __len__(self):
+    return self._base.shape[0]
+
+  def __getitem__(self, i):
+    if i < 0:
+      i += len(self)
+    if not 0 <= i < len(self):
+      raise IndexError('roidb index out of range')
+    return RoidbEntry(self, int(i))
+
+  def __iter__(self):
+    for i in range(len(self)):
+      yield RoidbEntry(self, i)
+
+  @property
+  def num_boxes(self):
+    return self._boxes.shape[0]
+
+  def _box_slice(self, i):
+    j = self._base[i]
+    return slice(self._offsets[j], self._offsets[j + 1])
+
+  def _keys(self, i):
+    keys = ['boxes', 'gt_classes', 'gt_overlaps', 'seg_areas', 'flipped']
+    if self._max_overlaps is not None:
+      keys += ['max_classes', 'max_overlaps']
+    j = self._base[i]
+    if self._image[j] >= 0:
+      keys.append('image')
+    if self._mask[j] >= 0:
+      keys.append('mask')
+    if self._width[j] >= 0:
+      keys += ['width', 'height']
+    extras = self._extras.get(i, {})
+    return keys + [key for key in extras if key not in keys]
+
+  def _get(self, i, key):
+    extras = self._extras.get(i)
+    if extras and key in extras:
+      return extras[key]
+    j = self._base[i]
+    if key == 'flipped':
+      return bool(self._image_flipped[j] != self._mirrored[i])
+    if key in BOX_KEYS:
+      column = getattr(self, '_' + key)
+      if column is None:
+        raise KeyError(key)
+      values = column[self._box_slice(i)]
+      if key == 'boxes' and self._mirrored[i]:
+        values = flip_boxes(values, self._width[j])
+      return values
+    if key in ('image', 'mask'):
+      ind = getattr(self, '_' + key)[j]
+      if ind < 0:
+        raise KeyError(key)
+      return self._paths[ind]
+    if key in ('width', 'height'):
+      value = getattr(self, '_' + key)[j]
+      if value < 0:
+        raise KeyError(key)
+      return int(value)
+    raise KeyError(key)
+
+  def _set(self, i, key, value):
+    j = self._base[i]
+    if key in ('image', 'mask'):
+      getattr(self, '_' + key)[j] = self._intern(value)
+    elif key in ('width', 'height'):
+      getattr(self, '_' + key)[j] = value
+    elif key in BOX_KEYS and not (key == 'boxes' and self._mirrored[i]):
+      if getattr(self, '_' + key) is None:
+        self._allocate(key, value)
+      column = getattr(self, '_' + key)
+      s = self._box_slice(i)
+      value = _dense(value) if key == 'gt_overlaps' else np.asarray(value)
+      if value.shape != column[s].shape:
+        self._extras.setdefault(i, {})[key] = value
+      else:
+        column[s] = value
+    else:
+      self._extras.setdefault(i, {})[key] = value
+
+  def _allocate(self, key, value):
+    value = np.asarray(value)
+    setattr(self, '_' + key, np.zeros((self.num_boxes,) + value.shape[1:], dtype=value.dtype))
+
+  def compute_max_overlaps(self):
+    """Vectorized roidb.prepare_roidb: max overlap and its class for every box."""
+    if self.num_boxes == 0:
+      self._max_overlaps = np.zeros((0,), dtype=np.float32)
+      self._max_classes = np.zeros((0,), dtype=np.int64)
+      return
+    # max overlap with gt over classes (columns)
+    self._max_overlaps = self._gt_overlaps.max(axis=1)
+    # gt class that had the max overlap
+    self._max_classes = self._gt_overlaps.argmax(axis=1)
+    # max overlap of 0 => class should be zero (background)
+    assert np.all(self._max_classes[self._max_overlaps == 0] == 0)
+    # max overlap > 0 => class should not be zero (must be a fg class)
+    assert np.all(self._max_classes[self._max_overlaps > 0] != 0)
+
+  def append_flipped(self, widths):
+    """Add a horizontally mirrored entry for every current entry.
+
+    widths[i] is the image width of entry i. Only a base index and a mirror
+    bit are stored; the flipped boxes are computed on access.
+    """
+    num_entries = len(self)
+    for i in range(num_entries):
+      self._width[self._base[i]] = widths[i]
+      s = self._box_slice(i)
+      boxes = self._boxes[s]
+      if not self._mirrored[i]:
+        boxes = flip_boxes(boxes, widths[i])
+      assert (boxes[:, 2] >= boxes[:, 0]).all()
+    self._base = np.concatenate((self._base, self._base))
+    self._mirrored = np.concatenate((self._mirrored, ~self._mirrored))
+
+  def extend(self, other):
+    """Append the entries of another ColumnarRoidb (like list.extend)."""
+    assert other.num_classes == self.num_classes
+    if (self._max_overlaps is None) != (other._max_overlaps is None):
+      self._max_overlaps = self._max_classes = None
+    elif self._max_overlaps is not None:
+      self._max_overlaps = np.concatenate((self._max_overlaps, other._max_overlaps))
+      self._max_classes = np.concatenate((self._max_classes, other._max_classes))
+    remap = np.array([self._intern(p) for p in other._paths] + [-1], dtype=np.int32)
+    num_entries = len(self)
+    num_images = self._image.shape[0]
+    self._offsets = np.concatenate((self._offsets, other._offsets[1:] + self._offsets[-1]))
+    for key in ('boxes', 'gt_classes', 'gt_overlaps', 'seg_areas'):
+      setattr(self, '_' + key, np.concatenate((getattr(self, '_' + key), getattr(other, '_' + key))))
+    for key in ('image_flipped', 'width', 'height'):
+      setattr(self, '_' + key, np.concatenate((getattr(self, '_' + key), getattr(other, '_' + key))))
+    self._image = np.concatenate((self._image, remap[other._image]))
+    self._mask = np.concatenate((self._mask, remap[other._mask]))
+    self._base = np.concatenate((self._base, other._base + num_images))
+    self._mirrored = np.concatenate((self._mirrored, other._mirrored))
+    for i, extras in other._extras.items():
+      self._extras[i + num_entries] = dict(extras)
+
+  def _columns(self):
+    columns = dict(num_classes=np.array(self.num_classes),
+                   boxes=self._boxes, gt_classes=self._gt_classes,
+                   gt_overlaps=self._gt_overlaps, seg_areas=self._seg_areas,
+                   offsets=self._offsets, image_flipped=self._image_flipped,
+                   width=self._width, height=self._height,
+                   image=self._image, mask=self._mask,
+                   base=self._base, mirrored=self._mirrored,
+                   paths=np.array(self._paths, dtype=str))
+    if self._max_overlaps is not None:
+      columns['max_classes'] = self._max_classes
+      columns['max_overlaps'] = self._max_overlaps
+    return columns
+
+  @classmethod
+  def _from_columns(cls, columns):
+    self = cls(int(columns['num_classes']))
+    for key in ('boxes', 'gt_classes', 'gt_overlaps', 'seg_areas', 'offsets', 'image_flipped',
+                'width', 'height', 'image', 'mask', 'base', 'mirrored'):
+      setattr(self, '_' + key, columns[key])
+    if 'max_overlaps' in columns:
+      self._max_classes = columns['max_classes']
+      self._max_overlaps = columns['max_overlaps']
+    self._paths = [str(p) for p in columns['paths']]
+    self._path_ids = dict((p, i) for i, p in enumerate(self._paths))
+    return self
+
+  def save(self, path):
+    """Write the columns to one .npz file (keys without a column are not saved)."""
+    np.savez(path, **self._columns())
+
+  @classmethod
+  def load(cls, path):
+    with np.load(path) as data:
+      return cls._from_columns(dict((key, data[key]) for key in data.files))
+
+  def save_dir(self, path):
+    """Write every column to its own .npy file under `path`.
+
+    The directory is filled under a temporary name and renamed into place,
+    so a reader never sees a half-written cache. When another process (a
+    data-parallel worker) has put the same cache in place first, its copy
+    is kept and this one is dropped.
+    """
+    tmp_path = '{}.tmp{:d}'.format(path, os.getpid())
+    if not os.path.isdir(tmp_path):
+      os.makedirs(tmp_path)
+    for key, column in self._columns().items():
+      np.save(os.path.join(tmp_path, key + '.npy'), column)
+    try:
+      os.rename(tmp_path, path)
+    except OSError:
+      if not os.path.isdir(path):
+        raise
+      shutil.rmtree(tmp_path, ignore_errors=True)
+
+  @classmethod
+  def load_dir(cls, path, mmap_mode='c'):
+    """Memory-map the columns written by save_dir.
+
+    The default copy-on-write mode lets the roidb be modified (flipping,
+    prepare_roidb) without touching the files.
+    """
+    columns = {}
+    for name in os.listdir(path):
+      key, ext = os.path.splitext(name)
+      if ext == '.npy':
+        columns[key] = np.load(os.path.join(path, name), mmap_mode=None if key == 'paths' else mmap_mode)
+    return cls._from_columns(columns)
+
+  def to_list(self):
+    """Materialize the classic list-of-dicts roidb."""
+    roidb = []
+    for entry in self:
+      entry = dict(entry)
+      entry['gt_overlaps'] = scipy.sparse.csr_matrix(entry['gt_overlaps'])
+      roidb.append(entry)
+    return roidb
@@ -8,16 +8,32 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import hashlib
+import multiprocessing
 import os
 import os.path as osp
 
 import PIL
 import numpy as np
 import scipy.sparse
-from lib.config import config as cfg
+from lib.config import settings as cfg
+from lib.datasets.columnar_roidb import ColumnarRoidb
 # from lib.utils.cython_bbox import bbox_overlaps
 
 
+# Parse function of the processes in imdb._parse_all (inherited, not pickled)
+_parse_fn = None
+
+
+def _init_parser(parse_fn):
+    global _parse_fn
+    _parse_fn = parse_fn
+
+
+def _parse(index):
+    return _parse_fn(index)
+
+
 class imdb(object):
     """Image database."""
 
@@ -70,9 +86,13 @@ class imdb(object):
         #   gt_overlaps
         #   gt_classes
         #   flipped
+        # With FLAGS.columnar_roidb it is a ColumnarRoidb, which is indexed
+        # the same way.
         if self._roidb is not None:
             return self._roidb
         self._roidb = self.roidb_handler()
+        if cfg.FLAGS.columnar_roidb and not isinstance(self._roidb, ColumnarRoidb):
+            self._roidb = ColumnarRoidb.from_list(self._roidb, self.num_classes)
         return self._roidb
 
     @property
@@ -82,6 +102,62 @@ class imdb(object):
             os.makedirs(cache_path)
         return cache_path
 
+    # Bump in a dataset class when its annotation parser changes, so the
+    # cached gt roidb built by the old parser is not reused.
+    gt_roidb_version = 1
+
+    def image_set_file(self):
+        """Path to the text file listing this image set."""
+        return os.path.join(self._data_path, self._image_set + '.txt')
+
+    def gt_roidb_key(self):
+        """Hash of the image-set file contents, class list and parser version."""
+        sha = hashlib.sha1()
+        sha.update(repr((type(self).__module__, type(self).__name__,
+                         self.gt_roidb_version, tuple(self.classes))).encode('utf-8'))
+        with open(self.image_set_file(), 'rb') as f:
+            sha.update(f.read())
+        return sha.hexdigest()[:16]
+
+    def cached_gt_roidb(self, parse_fn):
+        """Return the gt roidb, parsing `parse_fn(index)` for every image on a cache miss.
+
+        The roidb is cached as a directory of .npy columns (see
+        ColumnarRoidb.save_dir) named after gt_roidb_key(), so an edited image
+        set or a new parser version gets a fresh cache and a hit is a few
+        memory-mapped loads instead of unpickling one dict per image. The
+        result is a ColumnarRoidb whatever FLAGS.columnar_roidb says.
+        """
+        cache_dir = os.path.join(self.cache_path,
+                                 '{}_gt_roidb_{}'.format(self.name, self.gt_roidb_key()))
+        if os.path.isdir(cache_dir):
+            roidb = ColumnarRoidb.load_dir(cache_dir)
+            print('{} gt roidb loaded from {}'.format(self.name, cache_dir))
+        else:
+            roidb = ColumnarRoidb.from_list(self._parse_all(parse_fn), self.num_classes)
+            roidb.save_dir(cache_dir)
+            print('wrote gt roidb to {}'.format(cache_dir))
+            # Memory-mapped as on a hit; data-parallel workers that parsed the
+            # image set at the same time all read the copy that won the rename
+            roidb = ColumnarRoidb.load_dir(cache_dir)
+        return roidb
+
+    def _parse_all(self, parse_fn, min_per_worker=500):
+        """[parse_fn(index) for index in self.image_index], over FLAGS.roidb_workers processes."""
+        workers = cfg.FLAGS.roidb_workers or multiprocessing.cpu_count()
+        # Small image sets are not worth the process start-up
+        workers = min(workers, len(self.image_index) // min_per_worker)
+        # Spawned workers would need a picklable dataset object; without fork (Windows) parse here
+        if workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods():
+            return [parse_fn(index) for index in self.image_index]
+        # Forked, so the dataset object reaches the workers without being pickled
+        pool = multiprocessing.get_context('fork').Pool(workers, initializer=_init_parser, initargs=(parse_fn,))
+        try:
+            return pool.map(_parse, self.image_index, chunksize=max(1, len(self.image_index) // (workers * 4)))
+        finally:
+            pool.close()
+            pool.join()
+
     @property
     def num_images(self):
         return len(self.image_index)
@@ -110,6 +186,10 @@ class imdb(object):
     def append_flipped_images(self):
         num_images = self.num_images
         widths = self._get_widths()
+        if isinstance(self.roidb, ColumnarRoidb):
+            self.roidb.append_flipped(widths)
+            self._image_index = self._image_index * 2
+            return
         for i in range(num_images):
             boxes = self.roidb[i]['boxes'].copy()
             # print(77,widths[i])
@@ -262,6 +342,8 @@ class imdb(object):
     @staticmethod
     def merge_roidbs(a, b):
         assert len(a) == len(b)
+        if isinstance(a, ColumnarRoidb):
+            a = a.to_list()
         for i in range(len(a)):
             a[i]['boxes'] = np.vstack((a[i]['boxes'], b[i]['boxes']))
             a[i]['gt_classes'] = np.hstack((a[i]['gt_classes'],
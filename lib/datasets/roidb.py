@@ -12,7 +12,8 @@ from __future__ import print_function
 
 import numpy as np
 import PIL
-from lib.config import config as cfg
+from lib.config import settings as cfg
+from lib.datasets.columnar_roidb import ColumnarRoidb
 def prepare_roidb(imdb):
   """Enrich the imdb's roidb by adding some derived quantities that
   are useful for training. This function precomputes the maximum
@@ -31,6 +32,8 @@ def prepare_roidb(imdb):
     if not (imdb.name.startswith('coco')):
       roidb[i]['width'] = sizes[i][0]
       roidb[i]['height'] = sizes[i][1]
+    if isinstance(roidb, ColumnarRoidb):
+      continue
     # need gt_overlaps as a dense array for argmax
     gt_overlaps = roidb[i]['gt_overlaps'].toarray()
     # max overlap with gt over classes (columns)
@@ -46,3 +49,5 @@ def prepare_roidb(imdb):
     # max overlap > 0 => class should not be zero (must be a fg class)
     nonzero_inds = np.where(max_overlaps > 0)[0]
     assert all(max_classes[nonzero_inds] != 0)
+  if isinstance(roidb, ColumnarRoidb):
+    roidb.compute_max_overlaps()
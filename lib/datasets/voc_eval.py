@@ -8,11 +8,21 @@ from __future__ import division
 from __future__ import print_function
 
 import xml.etree.ElementTree as ET
+import hashlib
 import os
 import pickle
 import numpy as np
 import pdb
 
+# Bump when the layout of the cached annotations changes.
+ANNOT_CACHE_VERSION = 2
+
+CLASSES = ('authentic', 'tamper')
+# CLASSES = ('__background__', 'tamper','authentic')
+# CLASSES = ('authentic', 'copymove')
+# CLASSES = ('authentic', 'removal')
+# CLASSES = ('authentic', 'splice')
+
 def parse_rec(filename):
   """ Parse a PASCAL VOC xml file """
   tree = ET.parse(filename)
@@ -66,45 +76,131 @@ def voc_ap(rec, prec, use_07_metric=False):
     ap = np.sum((mrec[i + 1] - mrec[i]) * mpre[i + 1])
   return ap
 
-def parse_txt(fileline,classname):
-  #classes=('__background__','person_au','person_tp','airplane_tp','airplane_au','dog_tp','dog_au',
-      #'train_tp','train_au','bed_tp','bed_au','refrigerator_tp','refrigerator_au')
-  #classes=('__background__','person_au','person_tp','tv_tp','tv_au','airplane_tp','airplane_au','dog_tp','dog_au',
-      #'bench_tp','bench_au','train_tp','train_au','broccoli_tp','broccoli_au','kite_tp','kite_au','bed_tp','bed_au','refrigerator_tp','refrigerator_au','bowl_tp','bowl_au')
-  classes=('__background__', 'tamper','authentic')
-  classes=('authentic', 'tamper')
-  # classes=('authentic', 'copymove')
-  # classes=('authentic', 'removal')
-  # classes=('authentic', 'splice')
-  #classes=('__background__',  # always index 0
-                     #'splicing','removal','manipulation')
-  #classes=('__background__','person_au','tv_au','airplane_au','dog_au',
-      #'bench_au','train_au','broccoli_au','kite_au','bed_au','refrigerator_au','bowl_au')
-  class_to_ind = dict(list(zip(classes, list(range(len(classes))))))
-  num_objs = int(len(fileline.split(' ')[1:])/5)
+def parse_txt(fileline,classname=None):
+  """Parse one image-set line "name x1 y1 x2 y2 cls [x1 y1 x2 y2 cls ...]"."""
+  class_to_ind = dict(list(zip(CLASSES, list(range(len(CLASSES))))))
+  fields = fileline.split(' ')
+  num_objs = int(len(fields[1:])/5)
   objects=[]
-  obj={}
-  #print(fileline.split())
-  #pdb.set_trace()
-  #object['name']=fileline.split(" ")[0]
   for i in range(num_objs):
-    obj['bbox']=[float(fileline.split(' ')[5*i+1]),
-                  float(fileline.split(' ')[5*i+2]),
-                  float(fileline.split(' ')[5*i+3]),
-                  float(fileline.split(' ')[5*i+4])]
-    try:
-      obj['cls']=class_to_ind[fileline.split(' ')[5*i+5]]
-    except:
-      #pdb.set_trace()
-      obj['cls']=int(fileline.split(' ')[5*i+5])
-    #obj['bbox']=[int(fileline.split(' ')[(classname-1)*5+1]),
-                    #int(fileline.split(' ')[(classname-1)*5+2]),
-                    #int(fileline.split(' ')[(classname-1)*5+3]),
-                    #int(fileline.split(' ')[(classname-1)*5+4])]
-    #obj['cls']=int(fileline.split(' ')[(classname-1)*5+5])
-    objects.append(obj.copy())
+    obj = fields[5*i+1:5*i+6]
+    cls = class_to_ind.get(obj[4])
+    objects.append({'bbox': [float(x) for x in obj[:4]],
+                    'cls': int(obj[4]) if cls is None else cls})
   return objects
 
+def _parse_imageset(lines):
+  """Image names (one per line, duplicates kept) and per-image GT arrays."""
+  names = []
+  recs = {}
+  for line in lines:
+    line = line.strip()
+    name = line.split(' ')[0]
+    objects = parse_txt(line)
+    names.append(name)
+    recs[name] = {'bbox': np.array([obj['bbox'] for obj in objects], dtype=np.float64).reshape(-1, 4),
+                  'cls': np.array([obj['cls'] for obj in objects], dtype=np.int64)}
+  return names, recs
+
+def load_annotations(imagesetfile, cachedir, verbose=False):
+  """Parse the image-set file once, cached under a key of its contents.
+
+  The cache file name carries ANNOT_CACHE_VERSION and a hash of the image-set
+  file and class list, so an edited split or a new cache layout never picks
+  up stale annotations.
+  """
+  if not os.path.isdir(cachedir):
+    os.makedirs(cachedir)
+  with open(imagesetfile, 'r') as f:
+    text = f.read()
+  key = hashlib.sha1((repr((ANNOT_CACHE_VERSION, CLASSES)) + text).encode('utf-8')).hexdigest()[:16]
+  cachefile = os.path.join(cachedir, 'annots_v{:d}_{:s}.pkl'.format(ANNOT_CACHE_VERSION, key))
+  if os.path.isfile(cachefile):
+    with open(cachefile, 'rb') as f:
+      cache = pickle.load(f)
+    return cache['names'], cache['recs']
+
+  names, recs = _parse_imageset(text.splitlines())
+  if verbose:
+    print('Saving cached annotations for {:d} images to {:s}'.format(len(names), cachefile))
+  tmpfile = cachefile + '.tmp{:d}'.format(os.getpid())
+  with open(tmpfile, 'wb') as f:
+    pickle.dump({'names': names, 'recs': recs}, f, pickle.HIGHEST_PROTOCOL)
+  os.rename(tmpfile, cachefile)
+  return names, recs
+
+def _read_dets(detfile):
+  """Image ids, confidences and boxes of a "name score x1 y1 x2 y2" results file."""
+  with open(detfile, 'r') as f:
+    splitlines = [x.strip().split(' ') for x in f]
+  image_ids = [x[0] for x in splitlines]
+  confidence = np.array([float(x[1]) for x in splitlines], dtype=np.float64)
+  BB = np.array([[float(z) for z in x[2:]] for x in splitlines], dtype=np.float64).reshape(len(splitlines), -1)
+  if BB.shape[0] == 0:
+    BB = np.zeros((0, 4), dtype=np.float64)
+  return image_ids, confidence, BB
+
+def _index_by_image(image_ids):
+  """Map each image id to the array of row indices it owns, in file order."""
+  index = {}
+  for i, name in enumerate(image_ids):
+    index.setdefault(name, []).append(i)
+  return dict((name, np.array(rows)) for name, rows in index.items())
+
+def _overlaps(boxes, bb):
+  """IoU of one box against the rows of `boxes` (VOC +1 pixel convention)."""
+  ixmin = np.maximum(boxes[:, 0], bb[0])
+  iymin = np.maximum(boxes[:, 1], bb[1])
+  ixmax = np.minimum(boxes[:, 2], bb[2])
+  iymax = np.minimum(boxes[:, 3], bb[3])
+  iw = np.maximum(ixmax - ixmin + 1., 0.)
+  ih = np.maximum(iymax - iymin + 1., 0.)
+  inters = iw * ih
+
+  # union
+  uni = ((bb[2] - bb[0] + 1.) * (bb[3] - bb[1] + 1.) +
+         (boxes[:, 2] - boxes[:, 0] + 1.) *
+         (boxes[:, 3] - boxes[:, 1] + 1.) - inters)
+  return inters / uni
+
+def _fuse_noise_dets(image_ids, confidence, BB, image_n, confidence_n, BB_n, verbose=False):
+  """Merge the RGB detections with the noise-stream detections of the same image.
+
+  Modifies `confidence` and `BB` in place and returns the mask of RGB
+  detections that are kept.
+  """
+  noise_index = _index_by_image(image_n)
+  count = np.zeros(10)
+  select_final = np.ones(len(image_ids), dtype=bool)
+  image_select = set()
+  for k in range(len(image_ids)):
+    if image_ids[k] in image_select:
+      select_final[k] = False
+      continue
+    index = noise_index.get(image_ids[k])
+    if index is None:
+      continue
+    bb1 = BB_n[index, :]
+    c_n = confidence_n[index]
+    overlaps = _overlaps(bb1, BB[k, :])
+    ov_max = np.max(overlaps)
+    jmax = np.argmax(overlaps)
+    count[min(int(ov_max*10), 9)] += 1
+    if ov_max >= 0.5:
+      confidence[k] = (confidence[k]+c_n[jmax])/2
+      BB[k,:] = (confidence[k]*BB[k,:]+c_n[jmax]*bb1[jmax,:])/np.maximum(confidence[k]+c_n[jmax], np.finfo(np.float64).eps)
+      image_select.add(image_ids[k])
+    elif ov_max > 0.1:
+      image_select.add(image_ids[k])
+    else:
+      select_final[k] = False
+  if verbose:
+    rgb_ids = set(image_ids)
+    noise_ct = sum(1 for name in image_n if name not in rgb_ids)
+    print('rgb no overlap: {}'.format(count))
+    print('noise no overlap: {:d}'.format(noise_ct))
+  return select_final
+
 def voc_eval(detpath,
             detpath2,
              annopath,
@@ -113,274 +209,108 @@ def voc_eval(detpath,
              cachedir,
              ovthresh=0.5,
              use_07_metric=False,
-             fuse=False):
+             fuse=False,
+             verbose=False):
   """rec, prec, ap = voc_eval(detpath,
+                              detpath2,
                               annopath,
                               imagesetfile,
                               classname,
+                              cachedir,
                               [ovthresh],
-                              [use_07_metric])
+                              [use_07_metric],
+                              [fuse],
+                              [verbose])
 
   Top level function that does the PASCAL VOC evaluation.
 
   detpath: Path to detections
       detpath.format(classname) should produce the detection results file.
-  annopath: Path to annotations
-      annopath.format(imagename) should be the xml annotations file.
-  imagesetfile: Text file containing the list of images, one image per line.
-  classname: Category name (duh)
+  detpath2: Path to the noise-stream detections, used when fuse is True
+  annopath: Path to annotations (unused, the GT boxes are in the image-set file)
+  imagesetfile: Text file containing the list of images, one image per line,
+      followed by its GT boxes "x1 y1 x2 y2 cls".
+  classname: Category index
   cachedir: Directory for caching the annotations
   [ovthresh]: Overlap threshold (default = 0.5)
   [use_07_metric]: Whether to use VOC07's 11 point AP computation
       (default False)
+  [fuse]: Merge the RGB detections with the noise-stream detections
+  [verbose]: Print the overlaps of every detection and the false positives
   """
-  # assumes detections are in detpath.format(classname)
-  # assumes annotations are in annopath.format(imagename)
-  # assumes imagesetfile is a text file with each line an image name
-  # cachedir caches the annotations in a pickle file
-
-  # first load gt 加载ground truth。
-  if not os.path.isdir(cachedir):
-    os.mkdir(cachedir)
-  cachefile = os.path.join(cachedir, 'annots.pkl') #只读文件名称
-
-  # read list of images
-  with open(imagesetfile, 'r') as f:
-    lines = f.readlines() #读取所有待检测图片名
-  imagenames = [x.strip() for x in lines] #待检测图像文件名字存于数组imagenames
+  imagenames, recs = load_annotations(imagesetfile, cachedir, verbose)
 
-  if not os.path.isfile(cachefile): #如果只读文件不存在，则只好从原始数据集中重新加载数据
-    # load annots
-    recs = {}
-    for i, imagename in enumerate(imagenames):
-      name=imagename.split(' ')[0]
-      recs[name] = parse_txt(imagename,classname)
-      #recs[imagename] = parse_rec(annopath.format(imagename))
-      if i % 100 == 0:
-        print('Reading annotation for {:d}/{:d}'.format(
-          i + 1, len(imagenames)))
-    # save
-    print('Saving cached annotations to {:s}'.format(cachefile))
-    #with open(cachefile, 'w') as f:
-      #pickle.dump(recs, f)
-  else:
-    # load
-    with open(cachefile, 'rb') as f:
-      try:
-        recs = pickle.load(f)  #如果已经有了只读文件，加载到recs
-      except:
-        recs = pickle.load(f, encoding='bytes')
-
-  # extract gt objects for this class #按类别获取标注文件，recall和precision都是针对不同类别而言的，AP也是对各个类别分别算的
-  class_recs = {}  #当前类别的标注
+  # extract gt objects for this class
+  class_recs = {}
   npos = 0
-  #pdb.set_trace()
-  for imagename in imagenames:
-    name=imagename.split(' ')[0]
-    R = [obj for obj in recs[name] if obj['cls'] == classname] #过滤，只保留recs中指定类别的项，存为R。
-    npos=npos+len(R)
-    bbox = np.array([x['bbox'] for x in R])  #抽取bbox
-    #difficult = np.array([x['difficult'] for x in R]).astype(np.bool)
-    det = [False] * len(R)  #len(R)就是当前类别的gt目标个数，det表示是否检测到，初始化为false
+  for name in imagenames:
+    rec = recs[name]
+    bbox = rec['bbox'][rec['cls'] == classname]
+    npos = npos + bbox.shape[0]
     class_recs[name] = {'bbox': bbox,
-                             #'difficult': difficult,
-                             'det': det}
+                        'det': np.zeros(bbox.shape[0], dtype=bool)}
+
+  # read dets
+  image_ids, confidence, BB = _read_dets(detpath.format(classname))
+  noise_index = {}
+  if fuse:
+    detfile_n = detpath2.format(classname)
+    if os.path.isfile(detfile_n):
+      image_n, confidence_n, BB_n = _read_dets(detfile_n)
+    else:
+      image_n, confidence_n, BB_n = [], np.zeros(0), np.zeros((0, 4))
+    noise_index = _index_by_image(image_n)
+    if BB.shape[0] > 0:
+      select_final = _fuse_noise_dets(image_ids, confidence, BB,
+                                      image_n, confidence_n, BB_n, verbose)
+      image_ids = [name for name, keep in zip(image_ids, select_final) if keep]
+      confidence = confidence[select_final]
+      BB = BB[select_final, :]
 
-  # read dets  读取检测结果
-  detfile = detpath.format(classname)
-  detfile_n = detpath2.format(classname)
-  #print(detfile)
-  with open(detfile, 'r') as f:
-    lines = f.readlines()
-  if os.path.isfile(detfile_n):
-    with open(detfile_n, 'r') as f_n:
-      n_lines = f_n.readlines()
-    n_splitlines = [x.strip().split(' ') for x in n_lines]  #假设检测结果有20000个，则splitlines长度20000
-    #print(n_splitlines)
-    image_n = [x[0] for x in n_splitlines]  #检测结果中的图像名，image_ids长度20000，但实际图像只有1000张，因为一张图像上可以有多个目标检测结果
-    confidence_n = np.array([float(x[1]) for x in n_splitlines])  #检测结果置信度
-    BB_n = np.array([[float(z) for z in x[2:]] for x in n_splitlines]) #变为浮点型的bbox。
-  splitlines = [x.strip().split(' ') for x in lines]
-  image_ids = [x[0] for x in splitlines]
-  confidence = np.array([float(x[1]) for x in splitlines])
-  BB = np.array([[float(z) for z in x[2:]] for x in splitlines])
-  count=np.zeros(10)
-  noise_ct=0
-  select_final=np.array([True]*len(image_ids))
-  image_select=[]
-  if BB.shape[0] > 0 and fuse:
-    for k in range(len(image_ids)):
-      if image_ids[k] in image_select:
-        select_final[k]=False
-        continue
-      if image_ids[k] in image_n:
-        bb = BB[k, :].astype(float)
-        index=[i for i,ex in enumerate(image_n) if ex==image_ids[k]]
-        bb1 = BB_n[index, :].astype(float)
-        #print(index,bb1)
-        #pdb.set_trace()
-        c_n=confidence_n[index]
-        
-
-        ix_min = np.maximum(bb1[:, 0], bb[0])
-        iy_min = np.maximum(bb1[:, 1], bb[1])
-        ix_max = np.minimum(bb1[:, 2], bb[2])
-        iy_max = np.minimum(bb1[:, 3], bb[3])
-        iw = np.maximum(ix_max - ix_min + 1., 0.)
-        ih = np.maximum(iy_max - iy_min + 1., 0.)
-        inters = iw * ih
-
-        # union
-        uni = ((bb[2] - bb[0] + 1.) * (bb[3] - bb[1] + 1.) +
-               (bb1[:, 2] - bb1[:, 0] + 1.) *
-               (bb1[:, 3] - bb1[:, 1] + 1.) - inters)
-
-        overlaps = inters / uni
-        ov_max = np.max(overlaps)#最大重合率
-        jmax = np.argmax(overlaps)#最大重合率对应的gt
-        if ov_max>=0.5: #如果当前检测结果与真实标注最大重合率满足阈值
-          count[int(ov_max*10)]=count[int(ov_max*10)]+1
-          #print(confidence[k],c_n)
-          #confidence[k]=np.maximum(confidence[k],c_n[jmax])
-          confidence[k]=(confidence[k]+c_n[jmax])/2
-          #pdb.set_trace()
-          BB[k,:]=(confidence[k]*BB[k,:]+c_n[jmax]*bb1[jmax,:])/np.maximum(confidence[k]+c_n[jmax], np.finfo(np.float64).eps)
-          image_select.append(image_ids[k])
-          #if confidence[k]<c_n[jmax]-0.5:
-            #BB[k,:]=bb1[jmax,:]
-          #print(image_ids[k],confidence[k],c_n[jmax])
-        elif ov_max<0.5 and ov_max>0.1:
-          count[int(ov_max*10)]=count[int(ov_max*10)]+1
-          image_select.append(image_ids[k])
-          #select_final[k]=False
-          #BB[k,:]=(confidence[k]*BB[k,:]+c_n[jmax]*bb1[jmax,:])/(confidence[k]+c_n[jmax])
-          #pass
-          #select_final[k]=False
-          #confidence[k]=0.7*confidence[k]+0.3*c_n[jmax]
-          #if confidence[k]<c_n[jmax]:
-            #BB[k,:]=bb1[jmax,:]
-          #print(image_ids[k],confidence[k],c_n[jmax])
-          #confidence[k]=confidence[k]*max(ov_max+0.2,0.6)
-        else:
-          count[int(ov_max*10)]=count[int(ov_max*10)]+1
-          select_final[k]=False
-          #confidence[k]=confidence[k]*0.9
-          #if confidence[k]<c_n[jmax]:
-            #BB[k,:]=bb1[jmax,:]
-            #confidence[k]=c_n[jmax]*0.9
-    for nk in range(len(image_n)):
-      if image_n[nk] not in image_ids:
-        noise_ct=noise_ct+1
-        #image_ids.append(image_n[nk])
-        #select_final.append(select_final,True)
-        #confidence=np.append(confidence,confidence_n[nk])
-        #BB=np.vstack((BB,BB_n[nk,:]))
-    print('rgb no overlap: {:s}'.format(count))
-    print('noise no overlap: {:d}'.format(noise_ct))
-  image_ids=np.extract(select_final,image_ids) #extract函数是返回满足条件的元素
-  confidence=np.extract(select_final,confidence)
-  BB=BB[select_final,:]
   nd = len(image_ids)
-  #print(image_ids)
   tp = np.zeros(nd)
   fp = np.zeros(nd)
-  bb=[]
-  bb1=[]
-  #pdb.set_trace()
   if BB.shape[0] > 0:
     # sort by confidence
     sorted_ind = np.argsort(-confidence)
-    sorted_scores = np.sort(-confidence)
+    sorted_scores = confidence[sorted_ind]
     BB = BB[sorted_ind, :]
     image_ids = [image_ids[x] for x in sorted_ind]
-    #print(class_recs)
-    #print(sorted_ind)
+
     # go down dets and mark TPs and FPs
     for d in range(nd):
-
-      
-
-
-      #print(bb1)
       R = class_recs[image_ids[d]]
-      bb = BB[d, :].astype(float)
-      if fuse:
-        if image_ids[d] in image_n:
-          index=[i for i,ex in enumerate(image_n) if ex==image_ids[d]]
-          bb1 = BB_n[index, :].astype(float)
-        ix_min = np.maximum(bb1[:, 0], bb[0])
-        iy_min = np.maximum(bb1[:, 1], bb[1])
-        ix_max = np.minimum(bb1[:, 2], bb[2])
-        iy_max = np.minimum(bb1[:, 3], bb[3])
-        iw_n = np.maximum(ix_max - ix_min + 1., 0.)
-        ih_n = np.maximum(iy_max - iy_min + 1., 0.)
-        inters_n = iw_n * ih_n
-
-        # union
-        un = ((bb[2] - bb[0] + 1.) * (bb[3] - bb[1] + 1.) +
-               (bb1[:, 2] - bb1[:, 0] + 1.) *
-               (bb1[:, 3] - bb1[:, 1] + 1.) - inters_n)
-
-        overlaps_n = inters_n / un
-        ov_max_n = np.max(overlaps_n)
-
-
+      bb = BB[d, :]
       ovmax = -np.inf
-      BBGT = R['bbox'].astype(float)
-      #print(BBGT)
-      #pdb.set_trace()
+      BBGT = R['bbox']
       if BBGT.size > 0:
-        # compute overlaps
-        # intersection
-        #print(BBGT)
-        #print(bb)
-        ixmin = np.maximum(BBGT[:, 0], bb[0])
-        iymin = np.maximum(BBGT[:, 1], bb[1])
-        ixmax = np.minimum(BBGT[:, 2], bb[2])
-        iymax = np.minimum(BBGT[:, 3], bb[3])
-        iw = np.maximum(ixmax - ixmin + 1., 0.)
-        ih = np.maximum(iymax - iymin + 1., 0.)
-        inters = iw * ih
-
-        # union
-        uni = ((bb[2] - bb[0] + 1.) * (bb[3] - bb[1] + 1.) +
-               (BBGT[:, 2] - BBGT[:, 0] + 1.) *
-               (BBGT[:, 3] - BBGT[:, 1] + 1.) - inters)
-
-        overlaps = inters / uni
+        overlaps = _overlaps(BBGT, bb)
         ovmax = np.max(overlaps)
         jmax = np.argmax(overlaps)
-        print("overlap:")
-        print(overlaps)
+        if verbose:
+          print("overlap:")
+          print(overlaps)
 
       if ovmax > ovthresh:
-        #print(R['det'][jmax])
-        #if not R['difficult'][jmax]:
         if not R['det'][jmax]:
-          #print(R['det'][jmax])
           tp[d] = 1.
-          R['det'][jmax] = 1
+          R['det'][jmax] = True
         else:
           fp[d] = 1.
-          fp[d] = 1.
       else:
-        print('fp:{:s}'.format(image_ids[d]))
-        if fuse:
-          print('score:{:f}, ovmax:{:f}'.format(-sorted_scores[d],ov_max_n))
-
         fp[d] = 1.
+        if verbose:
+          print('fp:{:s}'.format(image_ids[d]))
+          if image_ids[d] in noise_index:
+            ov_max_n = np.max(_overlaps(BB_n[noise_index[image_ids[d]], :], bb))
+            print('score:{:f}, ovmax:{:f}'.format(sorted_scores[d], ov_max_n))
 
   # compute precision recall
-  # print(fp)
-  # print(tp)
   fp = np.cumsum(fp)
   tp = np.cumsum(tp)
   rec = tp / float(npos)
-  # print(fp)
-  # print(tp)
-  # print(la)
   # avoid divide by zero in case the first detection matches a difficult
   # ground truth
   prec = tp / np.maximum(tp + fp, np.finfo(np.float64).eps)
   ap = voc_ap(rec, prec, use_07_metric)
-  return rec, prec, ap
\ No newline at end of file
+  return rec, prec, ap
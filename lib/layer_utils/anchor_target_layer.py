@@ -14,8 +14,10 @@ from lib.utils.cython_bbox import bbox_overlaps
 
 from lib.config import config as cfg
 from lib.utils.bbox_transform import bbox_transform
+from lib.utils import instrument
 import tensorflow as tf
 
+@instrument.timed('py_func/anchor_target_layer')
 def anchor_target_layer(rpn_cls_score, gt_boxes, im_info, _feat_stride, all_anchors, num_anchors):
     """Same as the anchor target layer in original Fast/er RCNN """
     A = num_anchors
@@ -9,10 +9,12 @@ from __future__ import print_function
 
 import numpy as np
 from lib.utils.bbox_transform import bbox_transform_inv, clip_boxes
-from lib.config import config as cfg
+from lib.config import settings as cfg
 from lib.utils.nms_wrapper import nms
+from lib.utils import instrument
 
 
+@instrument.timed('py_func/proposal_layer')
 def proposal_layer(rpn_cls_prob, rpn_bbox_pred, im_info, cfg_key, _feat_stride, anchors, num_anchors):
     """A simplified version compared to fast/er RCNN
        For details please see the technical report
@@ -29,7 +31,19 @@ def proposal_layer(rpn_cls_prob, rpn_bbox_pred, im_info, cfg_key, _feat_stride,
         post_nms_topN = cfg.FLAGS.rpn_test_post_nms_top_n  #300
         nms_thresh = cfg.FLAGS.rpn_test_nms_thresh  #0.7
 
-    im_info = im_info[0]
+    # One set of proposals per image of the batch, the first column of the rois is the batch index
+    blobs, scores = [], []
+    for b in range(rpn_cls_prob.shape[0]):
+        blob, score = _image_proposals(rpn_cls_prob[b:b + 1], rpn_bbox_pred[b:b + 1], im_info[b], anchors,
+                                       num_anchors, pre_nms_topN, post_nms_topN, nms_thresh)
+        blob[:, 0] = b
+        blobs.append(blob)
+        scores.append(score)
+    return np.concatenate(blobs), np.concatenate(scores)
+
+
+def _image_proposals(rpn_cls_prob, rpn_bbox_pred, im_info, anchors, num_anchors, pre_nms_topN, post_nms_topN,
+                     nms_thresh):
     # Get the scores and bounding boxes
     scores = rpn_cls_prob[:, :, :, num_anchors:]
     rpn_bbox_pred = rpn_bbox_pred.reshape((-1, 4))
@@ -53,7 +67,7 @@ def proposal_layer(rpn_cls_prob, rpn_bbox_pred, im_info, cfg_key, _feat_stride,
     proposals = proposals[keep, :]
     scores = scores[keep]
 
-    # Only support single image as input
+    # The batch index is filled in by proposal_layer
     batch_inds = np.zeros((proposals.shape[0], 1), dtype=np.float32)
     blob = np.hstack((batch_inds, proposals.astype(np.float32, copy=False)))
     # print('rpn_bbox_pred',rpn_bbox_pred)
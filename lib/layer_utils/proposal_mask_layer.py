@@ -8,15 +8,29 @@ from __future__ import division
 from __future__ import print_function
 
 import numpy as np
-from lib.config import config as cfg
+from lib.config import settings as cfg
 from lib.utils.bbox_transform import bbox_transform_inv, clip_boxes
 from lib.utils.nms_wrapper import nms
+from lib.utils import instrument
 # import cv2
 
 
+@instrument.timed('py_func/proposal_mask_layer')
 def proposal_mask_layer(rois, cls_prob, bbox_pred, im_info,num_classes,training,testing):
-
-  image_info=im_info[0]
+  # Up to MASK_BATCH mask RoIs per image of the batch; rois[:, 0] is the batch index
+  mask_data_list = []
+  for b in range(im_info.shape[0]):
+    rows = rois[:, 0] == b
+    mask_data = _image_mask_rois(rois[rows], cls_prob[rows], bbox_pred[rows], im_info[b], num_classes, training, testing)
+    if mask_data is not None:
+      mask_data[:, 0] = b
+      mask_data_list.append(mask_data)
+  if not mask_data_list:
+    return None
+  return np.concatenate(mask_data_list)
+
+
+def _image_mask_rois(rois, cls_prob, bbox_pred, image_info, num_classes, training, testing):
   # print(1111111111111111111111111111111111111111111,im_info)
   # print(1111111111111111111111111111111111111111111,image_info)
   # print(aaa)
@@ -12,10 +12,12 @@ import numpy as np
 import numpy.random as npr
 from lib.utils.cython_bbox import bbox_overlaps
 
-from lib.config import config as cfg
+from lib.config import settings as cfg
 from lib.utils.bbox_transform import bbox_transform
+from lib.utils import instrument
 
 
+@instrument.timed('py_func/proposal_target_layer')
 def proposal_target_layer(rpn_rois, rpn_scores, gt_boxes, _num_classes):
     """
     Assign object detection proposals to ground-truth targets. Produces proposal
@@ -10,17 +10,31 @@ from __future__ import print_function
 import numpy as np
 import numpy.random as npr
 
-from lib.config import config as cfg
+from lib.config import settings as cfg
 from lib.utils.bbox_transform import bbox_transform_inv, clip_boxes
+from lib.utils import instrument
 
 
+@instrument.timed('py_func/proposal_top_layer')
 def proposal_top_layer(rpn_cls_prob, rpn_bbox_pred, im_info, _feat_stride, anchors, num_anchors):
     """A layer that just selects the top region proposals
        without using non-maximal suppression,
        For details please see the technical report
+
+       rpn_top_n proposals per image of the batch; the first column of the
+       rois is the batch index.
     """
+    blobs, scores = [], []
+    for b in range(rpn_cls_prob.shape[0]):
+        blob, score = _top_proposals(rpn_cls_prob[b:b + 1], rpn_bbox_pred[b:b + 1], im_info[b], anchors, num_anchors)
+        blob[:, 0] = b
+        blobs.append(blob)
+        scores.append(score)
+    return np.concatenate(blobs), np.concatenate(scores)
+
+
+def _top_proposals(rpn_cls_prob, rpn_bbox_pred, im_info, anchors, num_anchors):
     rpn_top_n = cfg.FLAGS.rpn_top_n#300
-    im_info = im_info[0]
 
     scores = rpn_cls_prob[:, :, :, num_anchors:]
 
@@ -54,8 +68,7 @@ def proposal_top_layer(rpn_cls_prob, rpn_bbox_pred, im_info, _feat_stride, ancho
     proposals = clip_boxes(proposals, im_info[:2])
 
     # Output rois blob
-    # Our RPN implementation only supports a single input image, so all
-    # batch inds are 0
+    # The batch index is filled in by proposal_top_layer
     # 和 proposal_layer 一样，多出来一列0，然后拼接
     batch_inds = np.zeros((proposals.shape[0], 1), dtype=np.float32)
     blob = np.hstack((batch_inds, proposals.astype(np.float32, copy=False)))
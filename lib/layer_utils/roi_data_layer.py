@@ -17,18 +17,29 @@ import time
 
 import numpy as np
 
-from lib.config import config as cfg
+from lib.config import settings as cfg
 from lib.utils.minibatch import get_minibatch
-from lib.layer_utils.noise_stream_SRM_layer import SRM
+from lib.utils import instrument
 
 
 class RoIDataLayer(object):
     """Fast R-CNN data layer used for training."""
 
-    def __init__(self, roidb, num_classes, random=False):
-        """Set the roidb to be used by this layer during training."""
+    def __init__(self, roidb, num_classes, random=False, feature_cache=None, shard=None, seed=0):
+        """Set the roidb to be used by this layer during training.
+
+        With shard=(i, n), the i-th of n data-parallel workers only reads
+        every n-th image of each epoch's permutation. All n workers draw the
+        permutation from a RandomState(seed) of their own, so the shards of an
+        epoch never overlap.
+        """
         self._roidb = roidb
         self._num_classes = num_classes
+        # lib/utils/feature_cache.py, for head-only training
+        self._feature_cache = feature_cache
+        assert shard is None or len(roidb) >= shard[1], 'fewer images than data-parallel workers'
+        self._shard = shard
+        self._shard_rng = np.random.RandomState(seed) if shard is not None else None
         # Also set a random flag
         self._random = random
         self._shuffle_roidb_inds()
@@ -43,7 +54,11 @@ class RoIDataLayer(object):
             millis = int(round(time.time() * 1000)) % 4294967295
             np.random.seed(millis)
 
-        self._perm = np.random.permutation(np.arange(len(self._roidb)))
+        if self._shard is not None:
+            index, count = self._shard
+            self._perm = self._shard_rng.permutation(np.arange(len(self._roidb)))[index::count]
+        else:
+            self._perm = np.random.permutation(np.arange(len(self._roidb)))
         # Restore the random state
         if self._random:
             np.random.set_state(st0)
@@ -54,8 +69,9 @@ class RoIDataLayer(object):
         """Return the roidb indices for the next minibatch."""
 
         # if self._cur + cfg.FLAGS.ims_per_batch >= len(self._roidb):
-        if self._cur + 1 >= len(self._roidb):
+        if self._cur + 1 >= len(self._perm):
             self._shuffle_roidb_inds()
+            instrument.count('data_layer/epochs')
 
         # db_inds = self._perm[self._cur:self._cur + cfg.FLAGS.ims_per_batch]
         # self._cur += cfg.FLAGS.ims_per_batch
@@ -72,10 +88,12 @@ class RoIDataLayer(object):
         """
         db_inds = self._get_next_minibatch_inds()
         minibatch_db = [self._roidb[i] for i in db_inds]
-        return get_minibatch(minibatch_db, self._num_classes)
+        return get_minibatch(minibatch_db, self._num_classes, self._feature_cache)
 
+    @instrument.timed('data_layer')
     def forward(self):
         """Get blobs and copy them into this layer's top blob vector."""
         blobs = self._get_next_minibatch()
+        instrument.count('data_layer/images')
         # blobs['noise'] = SRM(blobs['data'])
         return blobs
@@ -9,8 +9,10 @@ from __future__ import print_function
 
 import numpy as np
 from lib.layer_utils.generate_anchors import generate_anchors
+from lib.utils import instrument
 
 #这个函数的意思大概就是将特征图上的锚返回到原图上
+@instrument.timed('py_func/generate_anchors_pre')
 def generate_anchors_pre(height, width, feat_stride, anchor_scales=(8, 16, 32), anchor_ratios=(0.5, 1, 2)):
     """ A wrapper function to generate anchors given different scales
       Also return the number of anchors in variable 'length'给定不同比例生成锚点的包装函数也返回可变“长度”的锚点数量
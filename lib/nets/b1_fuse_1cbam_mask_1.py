@@ -468,6 +468,10 @@ class resnetv3(Network):
 
         feature_fuse = slim.conv2d(mask_fuse, 1024, [1, 1], padding='VALID', trainable=is_training,
                                    weights_initializer=initializer, scope='mask_fuse')
+    # Everything the mask branch reads from the detection graph, fed back by test_image_cascade;
+    # feature_fuse is mask-only, so it is left to the second run
+    self._mask_inputs = {'cls_prob': cls_prob, 'bbox_pred': bbox_pred, 'rois': rois,
+                         'net_conv4': net_conv4, 'rpn': rpn}
     mask_box, indices = self._proposal_mask_layer(cls_prob, bbox_pred, rois, 'mask_proposal')
     mask_pool5 = self._crop_pool_layer(feature_fuse, mask_box, "mask_pool5")
 
@@ -549,6 +553,19 @@ class resnetv3(Network):
         sess.run(tf.assign(self._variables_to_fix[self._resnet_scope + '/conv1/weights:0'],
                            tf.reverse(conv1_rgb, [2])))
 
+  def restore_rules(self):
+    # get_variables_to_restore + fix_variables as a single restore plan
+    return {'exclude': [r'^[^/]+/(cls_score|bbox_pred)(/|$)'],
+            'transforms': {self._resnet_scope + '/conv1/weights': 'reverse_channels'}}
+
+  def backbone_patterns(self):
+    # Both streams up to conv4 (the noise stream's conv1 is top-level) and the CBAM fusion into net_conv4;
+    # block4 on the pooled RoIs is part of the RCNN head
+    return [r'^%s/(conv1|block1|block2|block3)/' % self._resnet_scope,
+            r'^(noise|conv1)/',
+            r'^(rgb|noise)_(spatial|channel)_attention/',
+            r'^(conv4_pam|conv4_cam|net_conv4)/']
+
   def _normalize_bbox(self, bottom, bbox, name):  #bottom=noise_conv4, bbox=rois
       with tf.variable_scope(name_or_scope=name):
           bottom_shape = tf.shape(bottom)
@@ -36,6 +36,8 @@ class Network(object):
         self._train_summaries = []
         self._event_summaries = {}
         self._variables_to_fix = {}
+        # Inputs of the mask branch (cls_prob, bbox_pred, rois, features), set by build_network
+        self._mask_inputs = {}
 
     # Summaries #
     def _add_image_summary(self, image, boxes):
@@ -78,7 +80,7 @@ class Network(object):
             # change the channel to the caffe format
             to_caffe = tf.transpose(bottom, [0, 3, 1, 2])
             # then force it to have channel 2
-            reshaped = tf.reshape(to_caffe, tf.concat(axis=0, values=[[self._batch_size], [num_dim, -1], [input_shape[2]]]))
+            reshaped = tf.reshape(to_caffe, tf.concat(axis=0, values=[[input_shape[0]], [num_dim, -1], [input_shape[2]]]))
             # then swap the channel back
             to_tf = tf.transpose(reshaped, [0, 2, 3, 1])
             return to_tf
@@ -97,8 +99,9 @@ class Network(object):
                                           [rpn_cls_prob, rpn_bbox_pred, self._im_info,
                                            self._feat_stride, self._anchors, self._num_anchors],
                                           [tf.float32, tf.float32])
-            rois.set_shape([cfg.FLAGS.rpn_top_n, 5])
-            rpn_scores.set_shape([cfg.FLAGS.rpn_top_n, 1])
+            # rpn_top_n per image of the batch
+            rois.set_shape([None, 5])
+            rpn_scores.set_shape([None, 1])
 
         return rois, rpn_scores
 
@@ -230,9 +233,19 @@ class Network(object):
 
     def _anchor_component(self):
         with tf.variable_scope('ANCHOR_' + 'default'):
-            # just to get the shape right
-            height = tf.to_int32(tf.ceil(self._im_info[0, 0] / np.float32(self._feat_stride[0])))
-            width = tf.to_int32(tf.ceil(self._im_info[0, 1] / np.float32(self._feat_stride[0])))
+            if self._image.get_shape()[1:3].is_fully_defined():
+                # A static input shape has a single anchor grid, computed once instead of every step
+                height, width = [int(np.ceil(dim / float(self._feat_stride[0])))
+                                 for dim in self._image.get_shape().as_list()[1:3]]
+                anchors, anchor_length = generate_anchors_pre(height, width, self._feat_stride[0],
+                                                              self._anchor_scales, self._anchor_ratios)
+                self._anchors = tf.constant(anchors, name='anchors')
+                self._anchor_length = tf.constant(anchor_length, name='anchor_length')
+                return
+            # just to get the shape right; the blob shape, which covers every (padded) image of a batch
+            image_shape = tf.to_float(tf.shape(self._image))
+            height = tf.to_int32(tf.ceil(image_shape[1] / np.float32(self._feat_stride[0])))
+            width = tf.to_int32(tf.ceil(image_shape[2] / np.float32(self._feat_stride[0])))
             anchors, anchor_length = tf.py_func(generate_anchors_pre,
                                                 [height, width,
                                                  self._feat_stride, self._anchor_scales, self._anchor_ratios],
@@ -318,9 +331,12 @@ class Network(object):
         return loss
 
     def create_architecture(self, sess, mode, num_classes, tag=None, anchor_scales=(8, 16, 32, 64), anchor_ratios=(0.5, 1, 2)):
-        self._image = tf.placeholder(tf.float32, shape=[self._batch_size, None, None, 3])
+        # Training on fixed-size crops (FLAGS.train_crop) gives the inputs a static shape
+        crop_size = cfg.FLAGS.train_crop if mode == 'TRAIN' else 0
+        size = [crop_size, crop_size] if crop_size else [None, None]
+        self._image = tf.placeholder(tf.float32, shape=[self._batch_size] + size + [3])
         if cfg.FLAGS.USE_MASK is True:
-            self._mask = tf.placeholder(tf.float32, shape=[self._batch_size, None, None, 1])
+            self._mask = tf.placeholder(tf.float32, shape=[self._batch_size] + size + [1])
         # for noise
         self._im_info = tf.placeholder(tf.float32, shape=[self._batch_size, 5])
         self._gt_boxes = tf.placeholder(tf.float32, shape=[None, 5])
@@ -398,6 +414,16 @@ class Network(object):
     def fix_variables(self, sess, pretrained_model):
         raise NotImplementedError
 
+    # Rules of lib/utils/restore_plan.py: excluded variables, renames and transforms
+    def restore_rules(self):
+        return {}
+
+    # Regexes on the names of the backbone variables, which head-only training
+    # leaves out of the optimizer; everything past predictions['net_conv4']
+    # is a head
+    def backbone_patterns(self):
+        raise NotImplementedError
+
     # Extract the head feature maps, for example for vgg16 it is conv5_3
     # only useful during testing mode
     def extract_head(self, sess, image):
@@ -405,6 +431,17 @@ class Network(object):
         feat = sess.run(self._layers["head"], feed_dict=feed_dict)
         return feat
 
+    # The fused feature map the RPN, RCNN and mask heads are built on
+    def extract_features(self, sess, image):
+        return sess.run(self._predictions['net_conv4'], feed_dict={self._image: image})
+
+    def _feed_features(self, feed_dict, blobs):
+        # A cached net_conv4 map (lib/utils/feature_cache.py) cuts the backbone out of the run;
+        # the image is then zeros, only read for the anchors
+        if 'net_conv4' in blobs:
+            feed_dict[self._predictions['net_conv4']] = blobs['net_conv4']
+        return feed_dict
+
     # only useful during testing mode
     def test_image(self, sess, image, im_info):
         feed_dict = {self._image: image,
@@ -418,6 +455,34 @@ class Network(object):
                                                         feed_dict=feed_dict)
         return cls_score, cls_prob, bbox_pred, rois,mask_sigmoid,mask_data
 
+    def test_image_cascade(self, sess, image, im_info, thresh):
+        """test_image in two runs, the mask branch only for likely tampered images.
+
+        The first run stops at the classification head and also fetches what
+        the mask branch reads from it (the RoIs, their scores and the shared
+        conv4 and RPN maps), but runs none of the mask-only layers. If no RoI
+        has a tamper (non-background) probability above `thresh`, the mask
+        outputs are None; otherwise the second run feeds those inputs back,
+        so only the feature fusion, mask proposal and mask head are computed.
+        """
+        assert self._mask_inputs, 'build_network does not expose the mask branch inputs'
+        feed_dict = {self._image: image,
+                     self._im_info: im_info}
+        names = sorted(self._mask_inputs)
+        outputs = sess.run([self._predictions["cls_score"],
+                            self._predictions['cls_prob'],
+                            self._predictions['bbox_pred'],
+                            self._predictions['rois']] + [self._mask_inputs[name] for name in names],
+                           feed_dict=feed_dict)
+        cls_score, cls_prob, bbox_pred, rois = outputs[:4]
+        if cls_prob.shape[0] == 0 or np.max(cls_prob[:, 1:]) <= thresh:
+            return cls_score, cls_prob, bbox_pred, rois, None, None
+        feed_dict.update((self._mask_inputs[name], value) for name, value in zip(names, outputs[4:]))
+        mask_sigmoid, mask_data = sess.run([self._predictions['mask_softmaxfg'],
+                                            self._proposal_targets['mask_data']],
+                                           feed_dict=feed_dict)
+        return cls_score, cls_prob, bbox_pred, rois, mask_sigmoid, mask_data
+
     def test_image_1(self, sess, image, im_info):
         feed_dict = {self._image: image,
                      self._im_info: im_info}
@@ -438,23 +503,27 @@ class Network(object):
 
         return summary
 
-    def train_step(self, sess, blobs, train_op):
+    def train_step(self, sess, blobs, train_op, options=None, run_metadata=None):
         feed_dict = {self._image: blobs['data'], self._im_info: blobs['im_info'],
                      self._gt_boxes: blobs['gt_boxes']}
+        self._feed_features(feed_dict, blobs)
         rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss, _ = sess.run([self._losses["rpn_cross_entropy"],
                                                                             self._losses['rpn_loss_box'],
                                                                             self._losses['cross_entropy'],
                                                                             self._losses['loss_box'],
                                                                             self._losses['total_loss'],
                                                                             train_op],
-                                                                           feed_dict=feed_dict)
+                                                                           feed_dict=feed_dict,
+                                                                           options=options,
+                                                                           run_metadata=run_metadata)
         return rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss
 
 
-    def train_step_with_mask(self, sess, blobs, train_op):
+    def train_step_with_mask(self, sess, blobs, train_op, options=None, run_metadata=None):
 
         feed_dict = {self._image: blobs['data'], self._im_info: blobs['im_info'],
                      self._gt_boxes: blobs['gt_boxes'],self._mask: blobs['mask']}
+        self._feed_features(feed_dict, blobs)
         rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss_mask, loss, _ = sess.run(
             [self._losses["rpn_cross_entropy"],
              self._losses['rpn_loss_box'],
@@ -464,7 +533,7 @@ class Network(object):
              self._losses['total_loss'],
              train_op,
              ],
-            feed_dict=feed_dict)
+            feed_dict=feed_dict, options=options, run_metadata=run_metadata)
 
         return rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss_mask, loss
 
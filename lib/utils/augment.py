@@ -0,0 +1,137 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Robustness augmentations of training images, in memory.
+
+Post-processing that hides tampering traces, applied to the decoded BGR
+image before it is scaled into the blob:
+
+    resize  down by a random factor and back up (resampling traces)
+    blur    Gaussian blur
+    noise   additive Gaussian noise
+    jpeg    recompression at a random quality, cv2.imencode/imdecode
+
+Each op in the configured list is applied with probability `prob`, in the
+order above, either to the whole image or, with probability
+`region_prob`, to each gt box (the tampered regions) only. Masks and boxes
+are left as they are.
+
+Every sample draws from its own generator seeded by the caller, so a
+sample is reproduced from its seed, and nothing is shared between threads
+or processes: Augmenter is safe in prefetch workers.
+
+    augmenter = Augmenter(['jpeg', 'noise'], prob=0.5, region_prob=0.5)
+    im = augmenter(im, roidb_entry['boxes'], seed)
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import cv2
+import numpy as np
+
+from lib.config import settings as cfg
+
+OPS = ('resize', 'blur', 'noise', 'jpeg')
+
+
+def jpeg(im, quality):
+    """`im` after a JPEG round trip at `quality` (0-100)."""
+    ok, buf = cv2.imencode('.jpg', im, [cv2.IMWRITE_JPEG_QUALITY, int(quality)])
+    if not ok:
+        return im
+    return cv2.imdecode(buf, cv2.IMREAD_UNCHANGED).reshape(im.shape)
+
+
+def gaussian_noise(im, sigma, rng):
+    """`im` plus N(0, sigma) noise, rounded and saturated to uint8."""
+    noise = rng.standard_normal(im.shape, dtype=np.float32)
+    noise *= sigma
+    return cv2.add(im, noise, dtype=cv2.CV_8U)
+
+
+def resample(im, scale):
+    """`im` scaled down by `scale` and back up to its size."""
+    height, width = im.shape[:2]
+    small = cv2.resize(im, (max(1, int(round(width * scale))), max(1, int(round(height * scale)))),
+                       interpolation=cv2.INTER_AREA)
+    return cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR).reshape(im.shape)
+
+
+def blur(im, sigma):
+    return cv2.GaussianBlur(im, (0, 0), sigma)
+
+
+def parse_ops(spec):
+    """['jpeg', 'noise', ...] of a comma separated string, in application order."""
+    names = [name.strip() for name in spec.split(',') if name.strip()]
+    unknown = [name for name in names if name not in OPS]
+    if unknown:
+        raise ValueError('Unknown augmentations {}, expected some of {}'.format(unknown, OPS))
+    return [op for op in OPS if op in names]
+
+
+def _regions(boxes, height, width):
+    regions = []
+    for x1, y1, x2, y2 in np.asarray(boxes, dtype=np.float64).reshape(-1, 4):
+        x1, y1 = max(0, int(x1)), max(0, int(y1))
+        x2, y2 = min(width, int(x2) + 1), min(height, int(y2) + 1)
+        if x2 > x1 and y2 > y1:
+            regions.append((slice(y1, y2), slice(x1, x2)))
+    return regions
+
+
+class Augmenter(object):
+    """Apply the configured ops to a uint8 image, reproducibly from a per-sample seed."""
+
+    def __init__(self, ops, prob=0.5, region_prob=0.5, jpeg_quality=(60, 95), noise_sigma=(1., 5.),
+                 resize_scale=(0.5, 0.9), blur_sigma=(0.5, 1.5)):
+        self.ops = [op for op in OPS if op in ops]
+        self.prob = prob
+        self.region_prob = region_prob
+        self.jpeg_quality = jpeg_quality
+        self.noise_sigma = noise_sigma
+        self.resize_scale = resize_scale
+        self.blur_sigma = blur_sigma
+
+    def _apply(self, op, im, rng):
+        if op == 'jpeg':
+            return jpeg(im, rng.integers(self.jpeg_quality[0], self.jpeg_quality[1] + 1))
+        if op == 'noise':
+            return gaussian_noise(im, rng.uniform(*self.noise_sigma), rng)
+        if op == 'resize':
+            return resample(im, rng.uniform(*self.resize_scale))
+        return blur(im, rng.uniform(*self.blur_sigma))
+
+    def __call__(self, im, boxes, seed):
+        """Augmented `im` (HxWx3 uint8, not modified in place); `boxes` are its gt boxes."""
+        rng = np.random.default_rng(seed)
+        # Flipped images are views with a negative stride
+        out = np.ascontiguousarray(im)
+        for op in self.ops:
+            apply, region = rng.random(2)
+            if apply >= self.prob:
+                continue
+            if region < self.region_prob:
+                regions = _regions(boxes, im.shape[0], im.shape[1])
+                if not regions:
+                    continue
+                if out is im:
+                    out = im.copy()
+                for rows, cols in regions:
+                    out[rows, cols] = self._apply(op, np.ascontiguousarray(out[rows, cols]), rng)
+            else:
+                out = self._apply(op, out, rng)
+        return out
+
+
+def from_settings():
+    """The Augmenter of the augment* settings, None when FLAGS.augment is empty."""
+    ops = parse_ops(cfg.FLAGS.augment)
+    if not ops:
+        return None
+    return Augmenter(ops, prob=cfg.FLAGS.augment_prob, region_prob=cfg.FLAGS.augment_region_prob,
+                     jpeg_quality=cfg.FLAGS2["augment_jpeg_quality"], noise_sigma=cfg.FLAGS2["augment_noise_sigma"],
+                     resize_scale=cfg.FLAGS2["augment_resize_scale"], blur_sigma=cfg.FLAGS2["augment_blur_sigma"])
@@ -0,0 +1,157 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Dynamic micro-batching of concurrent requests.
+
+Callers submit() items from any thread and wait() on the returned request.
+A single worker thread takes the oldest request, then keeps collecting
+until it has `max_batch` requests or `max_wait` seconds have passed since
+that request arrived, and hands the whole batch to `predict_fn` (a list of
+items in, a list of results out, in order). Only the worker thread calls
+`predict_fn`, so it may own a tf.Session.
+
+The queue is bounded: submit() raises queue.Full instead of blocking once
+`max_queue` requests are waiting, so a server can answer 503 right away.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import threading
+import time
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from lib.utils.instrument import Stat
+
+
+class Request(object):
+    """One submitted item; wait() returns its result or re-raises the batch error."""
+
+    __slots__ = ('item', 'enqueued', 'result', 'error', '_done')
+
+    def __init__(self, item):
+        self.item = item
+        self.enqueued = time.perf_counter()
+        self.result = None
+        self.error = None
+        self._done = threading.Event()
+
+    def wait(self, timeout=None):
+        if not self._done.wait(timeout):
+            raise RuntimeError('request not served within {:.1f}s'.format(timeout))
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class MicroBatcher(object):
+    """Group submitted items into batches for `predict_fn` on a worker thread."""
+
+    def __init__(self, predict_fn, max_batch=8, max_wait=0.01, max_queue=64):
+        self.predict_fn = predict_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_queue = max_queue
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._batch_sizes = collections.Counter()
+        self._latency = Stat()
+        self._queue_wait = Stat()
+        self._batch_time = Stat()
+        self._rejected = 0
+        self._errors = 0
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name='MicroBatcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, item):
+        """Queue `item`; raises queue.Full when `max_queue` requests are waiting."""
+        if self._closed:
+            raise RuntimeError('MicroBatcher is closed')
+        request = Request(item)
+        try:
+            self._queue.put_nowait(request)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise
+        return request
+
+    def _collect(self, first):
+        """`first` plus whatever arrives before its deadline, up to max_batch."""
+        batch = [first]
+        deadline = first.enqueued + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                # Past the deadline only take what is already queued
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, True
+            batch.append(request)
+        return batch, False
+
+    def _run(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch, stop = self._collect(first)
+            self._process(batch)
+            if stop:
+                return
+
+    def _process(self, batch):
+        start = time.perf_counter()
+        try:
+            results = self.predict_fn([request.item for request in batch])
+            if len(results) != len(batch):
+                raise ValueError('predict_fn returned {:d} results for {:d} items'.format(len(results), len(batch)))
+        except Exception as e:  # pylint: disable=broad-except
+            results = [None] * len(batch)
+            for request in batch:
+                request.error = e
+        end = time.perf_counter()
+        with self._lock:
+            self._batch_sizes[len(batch)] += 1
+            self._batch_time.add(int((end - start) * 1e9))
+            for request in batch:
+                self._queue_wait.add(int((start - request.enqueued) * 1e9))
+                self._latency.add(int((end - request.enqueued) * 1e9))
+                if request.error is not None:
+                    self._errors += 1
+        for request, result in zip(batch, results):
+            request.result = result
+            request._done.set()
+
+    def metrics(self):
+        """Queue depth, batch size histogram and latency percentiles (ms)."""
+        with self._lock:
+            return {'queue_depth': self._queue.qsize(),
+                    'max_queue': self.max_queue,
+                    'max_batch': self.max_batch,
+                    'max_wait_ms': self.max_wait * 1000.,
+                    'requests': self._latency.count,
+                    'rejected': self._rejected,
+                    'errors': self._errors,
+                    'batches': self._batch_time.count,
+                    'batch_sizes': dict((str(size), n) for size, n in sorted(self._batch_sizes.items())),
+                    'latency_ms': self._latency.as_dict(),
+                    'queue_wait_ms': self._queue_wait.as_dict(),
+                    'batch_ms': self._batch_time.as_dict()}
+
+    def close(self):
+        """Serve everything already queued, then stop the worker."""
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
@@ -12,7 +12,7 @@ from __future__ import print_function
 
 import cv2
 import numpy as np
-from lib.config import config as cfg
+from lib.config import settings as cfg
 
 def im_list_to_blob(ims):#这个函数是转成统一长宽的图片格式，选择最大长和最大宽，最后用图片填充不够的地方用0补充。
     """Convert a list of images into a network input.
@@ -29,6 +29,13 @@ def im_list_to_blob(ims):#这个函数是转成统一长宽的图片格式，选
 
     return blob
 
+def crop_blob(blob, y0, x0, size):
+    """The size x size window of a blob at (y0, x0), zero-padded where it runs past the blob."""
+    crop = np.zeros((blob.shape[0], size, size, blob.shape[3]), dtype=blob.dtype)
+    window = blob[:, y0:y0 + size, x0:x0 + size]
+    crop[:, :window.shape[1], :window.shape[2]] = window
+    return crop
+
 def mask_list_to_blob(ims):
   """Convert a list of images into a network input.
 
@@ -0,0 +1,191 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Background checkpoint writer with a retention policy.
+
+save() only copies the variables to host memory (one sess.run) and queues
+them; a writer thread feeds the copy into a CPU-only graph of its own and
+writes it with a separate Saver, so the training loop keeps running while
+the files go to disk. Each checkpoint is written into a temporary directory
+and renamed into place data files first and .index last, so a checkpoint is
+only visible (to the `checkpoint` state file, tf.train.latest_checkpoint or
+lib/utils/sweep.py) once it is complete.
+
+Retention keeps the last `keep_last` checkpoints, every iteration that is a
+multiple of `keep_every` and the `keep_best` checkpoints with the lowest (or
+highest) tracked metric; everything else written by the checkpointer is
+deleted. A value of 0 disables that rule.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import glob
+import os
+import shutil
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+import tensorflow as tf
+
+
+def retained(history, keep_last=0, keep_every=0, keep_best=0, mode='min'):
+    """Iterations to keep out of `history`, a list of (iter, metric) in save order."""
+    iters = [it for it, _ in history]
+    keep = set(iters[-keep_last:]) if keep_last > 0 else set()
+    if keep_every > 0:
+        keep.update(it for it in iters if it % keep_every == 0)
+    if keep_best > 0:
+        scored = [(metric, it) for it, metric in history if metric is not None]
+        scored.sort(reverse=(mode == 'max'))
+        keep.update(it for _, it in scored[:keep_best])
+    # Never delete the newest checkpoint, it is the one `checkpoint` points to
+    if iters:
+        keep.add(iters[-1])
+    return keep
+
+
+class AsyncCheckpointer(object):
+    """Write checkpoints of `var_list` and their meta pickle from a background thread."""
+
+    def __init__(self, var_list, output_dir, prefix='resnet101_faster_rcnn',
+                 keep_last=5, keep_every=0, keep_best=1, mode='min', max_pending=1):
+        self.output_dir = output_dir
+        self.prefix = prefix
+        self.keep_last = keep_last
+        self.keep_every = keep_every
+        self.keep_best = keep_best
+        self.mode = mode
+        self._vars = list(var_list)
+        self._history = []
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._error = None
+        self._build_writer_graph()
+        self._thread = threading.Thread(target=self._run, name='AsyncCheckpointer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _build_writer_graph(self):
+        """Host-side copies of the variables, saved under their original names."""
+        self._graph = tf.Graph()
+        self._feeds = []
+        saved = {}
+        with self._graph.as_default(), tf.device('/cpu:0'):
+            assigns = []
+            for var in self._vars:
+                name = var.op.name
+                dtype = var.dtype.base_dtype
+                shape = var.get_shape()
+                copy = tf.Variable(tf.zeros(shape, dtype=dtype), trainable=False, name=name)
+                value = tf.placeholder(dtype, shape=shape)
+                assigns.append(tf.assign(copy, value, validate_shape=True))
+                self._feeds.append(value)
+                saved[name] = copy
+            self._assign = tf.group(*assigns)
+            self._saver = tf.train.Saver(saved, max_to_keep=None, save_relative_paths=True)
+            init = tf.variables_initializer(list(saved.values()))
+        self._sess = tf.Session(graph=self._graph, config=tf.ConfigProto(device_count={'GPU': 0}))
+        self._sess.run(init)
+
+    def checkpoint_path(self, iter):
+        return os.path.join(self.output_dir, '{:s}_iter_{:d}.ckpt'.format(self.prefix, iter))
+
+    def save(self, sess, iter, meta=(), metric=None):
+        """Copy the variables to host and queue them to be written.
+
+        `meta` is a sequence of objects pickled in order into the .pkl next to
+        the checkpoint; `metric` ranks the checkpoint for `keep_best`. Blocks
+        while `max_pending` checkpoints are already waiting.
+        """
+        if self._error is not None:
+            raise self._error
+        values = sess.run(self._vars)
+        self._queue.put((iter, values, tuple(meta), metric))
+        return self.checkpoint_path(iter)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            try:
+                self._write(*item)
+            except Exception as e:  # pylint: disable=broad-except
+                if self._error is None:
+                    self._error = e
+            finally:
+                self._queue.task_done()
+
+    def _write(self, iter, values, meta, metric):
+        self._sess.run(self._assign, feed_dict=dict(zip(self._feeds, values)))
+        del values
+
+        filename = self.checkpoint_path(iter)
+        tmp_dir = os.path.join(self.output_dir, '.ckpt_tmp_{:d}'.format(iter))
+        if os.path.exists(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        os.makedirs(tmp_dir)
+        tmp_prefix = os.path.join(tmp_dir, os.path.basename(filename))
+        self._saver.save(self._sess, tmp_prefix, write_meta_graph=False, write_state=False)
+
+        with open(tmp_prefix + '.pkl', 'wb') as fid:
+            for obj in meta:
+                pickle.dump(obj, fid, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_prefix + '.pkl', os.path.splitext(filename)[0] + '.pkl')
+
+        # The .index file marks a checkpoint as complete, so it goes last
+        tmp_files = glob.glob(tmp_prefix + '.*')
+        tmp_files.sort(key=lambda f: f.endswith('.index'))
+        for f in tmp_files:
+            os.replace(f, os.path.join(self.output_dir, os.path.basename(f)))
+        shutil.rmtree(tmp_dir)
+
+        self._history.append((iter, metric))
+        keep = retained(self._history, self.keep_last, self.keep_every, self.keep_best, self.mode)
+        dropped = [it for it, _ in self._history if it not in keep]
+        self._history = [(it, m) for it, m in self._history if it in keep]
+        # Point `checkpoint` at the new files before anything it listed is deleted;
+        # TensorFlow writes it atomically (temporary file + rename)
+        tf.train.update_checkpoint_state(self.output_dir, filename,
+                                         all_model_checkpoint_paths=self.checkpoints)
+        for it in dropped:
+            self._delete(self.checkpoint_path(it))
+        print('Wrote snapshot to: {:s}'.format(filename))
+
+    @staticmethod
+    def _delete(filename):
+        # Drop the .index first so a partly deleted checkpoint is never picked up
+        files = glob.glob(filename + '.*')
+        files.sort(key=lambda f: not f.endswith('.index'))
+        for f in files + [os.path.splitext(filename)[0] + '.pkl']:
+            if os.path.exists(f):
+                os.remove(f)
+
+    @property
+    def checkpoints(self):
+        """Checkpoints written and kept so far, oldest first."""
+        return [self.checkpoint_path(it) for it, _ in self._history]
+
+    def wait(self):
+        """Block until every queued checkpoint is on disk."""
+        self._queue.join()
+        if self._error is not None:
+            raise self._error
+
+    def close(self):
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        self._sess.close()
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,171 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Synchronous data-parallel training on one machine, no cluster services.
+
+launch() starts `num_workers` processes; each one builds its own graph
+replica, reads its own shard of the roidb and computes gradients.
+GradientAllReduce averages a float32 vector (the flattened gradients) over
+the workers through a memory-mapped file in /dev/shm: every worker writes
+its row, reduces its slice of the columns into the mean row, and reads the
+whole mean back. Each worker then applies the same mean update, so the
+replicas stay identical without a parameter server.
+
+accumulate_gradients() builds the graph side: per-image gradients are
+summed into local variables and applied once, either after `iter_size`
+images (gradient accumulation, also without workers) or with the mean
+over all workers fed in by apply_mean().
+
+    launch(run_worker, 4, (settings,))   # run_worker(rank, num_workers, comm, settings)
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+
+class GradientAllReduce(object):
+    """Mean over all workers of a float32 vector of `size` values.
+
+    All workers must call mean() (or broadcast()) the same number of times
+    and in the same order; each call waits for the slowest worker.
+    """
+
+    def __init__(self, rank, num_workers, size, comm):
+        path, self._barrier = comm
+        self.rank = rank
+        self.num_workers = num_workers
+        self.size = size
+        # Rows 0 .. W-1: the workers' inputs, row W: the mean
+        if rank == 0:
+            self._buf = np.memmap(path, dtype=np.float32, mode='w+', shape=(num_workers + 1, size))
+        self._barrier.wait()
+        if rank != 0:
+            self._buf = np.memmap(path, dtype=np.float32, mode='r+', shape=(num_workers + 1, size))
+        bounds = np.linspace(0, size, num_workers + 1).astype(np.int64)
+        self._slice = slice(bounds[rank], bounds[rank + 1])
+
+    def mean(self, values):
+        self._buf[self.rank] = values
+        self._barrier.wait()
+        np.mean(self._buf[:self.num_workers, self._slice], axis=0, out=self._buf[self.num_workers, self._slice])
+        self._barrier.wait()
+        # Nobody writes the mean row again before every worker has passed the next first wait
+        return np.array(self._buf[self.num_workers])
+
+    def broadcast(self, values):
+        """Rank 0's `values` (up to `size` of them) on every worker."""
+        # Everyone is done reading the last mean
+        self._barrier.wait()
+        if self.rank == 0:
+            self._buf[self.num_workers, :len(values)] = values
+        self._barrier.wait()
+        out = np.array(self._buf[self.num_workers, :len(values)])
+        self._barrier.wait()
+        return out
+
+    def close(self):
+        self._buf = None
+
+
+def accumulate_gradients(optimizer, gvs, iter_size):
+    """Ops summing the gradients of `iter_size` images and applying their mean once.
+
+    Returns (accumulate_op, apply_op, mean_gvs, accumulators): accumulate_op adds one
+    image's gradients, apply_op applies the mean and zeroes the sums for the next step.
+    Data-parallel workers feed the mean tensors of mean_gvs with the mean over all
+    workers. The sums are local variables, so snapshots do not carry them.
+    """
+    # Imported here: the shared-memory part runs without TensorFlow
+    import tensorflow as tf
+
+    accumulators, accumulate, mean_gvs = [], [], []
+    with tf.variable_scope('Grad_Accum'):
+        for grad, var in gvs:
+            if grad is None:
+                continue
+            acc = tf.Variable(tf.zeros(var.get_shape(), dtype=var.dtype.base_dtype), trainable=False,
+                              collections=[tf.GraphKeys.LOCAL_VARIABLES])
+            accumulators.append(acc)
+            accumulate.append(tf.assign_add(acc, tf.convert_to_tensor(grad)))
+            mean_gvs.append((acc / float(iter_size), var))
+    apply_op = optimizer.apply_gradients(mean_gvs)
+    with tf.control_dependencies([apply_op]):
+        apply_op = tf.group(*[tf.assign(acc, tf.zeros_like(acc)) for acc in accumulators])
+    return tf.group(*accumulate), apply_op, mean_gvs, accumulators
+
+
+def broadcast_variables(sess, allreduce, variables):
+    """Load rank 0's values of `variables` on every worker."""
+    for var in variables:
+        value = allreduce.broadcast(sess.run(var).ravel())
+        if allreduce.rank != 0:
+            var.load(value.reshape(var.get_shape().as_list()), sess)
+
+
+def apply_mean(sess, allreduce, apply_op, mean_gvs, losses):
+    """Run `apply_op` of accumulate_gradients() with the mean gradients over all workers.
+
+    `losses` (this worker's) are averaged in the same pass and returned.
+    """
+    grads = sess.run([grad for grad, _ in mean_gvs])
+    mean = allreduce.mean(np.concatenate([g.ravel() for g in grads] + [np.ravel(losses)]))
+    feed_dict = {}
+    offset = 0
+    for (tensor, _), grad in zip(mean_gvs, grads):
+        feed_dict[tensor] = mean[offset:offset + grad.size].reshape(grad.shape)
+        offset += grad.size
+    sess.run(apply_op, feed_dict=feed_dict)
+    return mean[offset:]
+
+
+def _shm_dir():
+    # tmpfs where there is one, so the mapped file never touches a disk
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+def _run(target, rank, num_workers, comm, args):
+    target(rank, num_workers, comm, *args)
+
+
+def launch(target, num_workers, args=()):
+    """Run target(rank, num_workers, comm, *args) in `num_workers` processes and wait for them.
+
+    `target` must be importable (a module-level function): the workers are
+    spawned, not forked, so none of them inherits a TensorFlow runtime. If
+    a worker fails the others are stopped and RuntimeError is raised.
+    """
+    ctx = multiprocessing.get_context('spawn')
+    root = tempfile.mkdtemp(prefix='emunet_allreduce_', dir=_shm_dir())
+    barrier = ctx.Barrier(num_workers)
+    comm = (os.path.join(root, 'buffer.f32'), barrier)
+    workers = [ctx.Process(target=_run, args=(target, rank, num_workers, comm, args),
+                           name='worker-{:d}'.format(rank)) for rank in range(num_workers)]
+    try:
+        for worker in workers:
+            worker.start()
+        while any(worker.is_alive() for worker in workers):
+            if any(worker.exitcode not in (None, 0) for worker in workers):
+                # Release the workers waiting for the failed one
+                barrier.abort()
+                break
+            time.sleep(0.5)
+        for worker in workers:
+            worker.join(timeout=60)
+        failed = [worker.name for worker in workers if worker.exitcode != 0]
+        if failed:
+            raise RuntimeError('data-parallel workers failed: {}'.format(', '.join(failed)))
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+        shutil.rmtree(root, ignore_errors=True)
@@ -0,0 +1,613 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Single-pass evaluation engine.
+
+The network is run once per test image and the prediction is handed to a
+list of sinks, each of which produces one kind of output (pixel F1/AUC,
+box AP, visualizations, spreadsheet rows, raw prediction dumps).
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import json
+import os
+
+import cv2
+import numpy as np
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+
+from lib.config import settings as cfg
+from lib.config.settings import get_output_dir
+from lib.utils import instrument
+from lib.utils.image_writer import AsyncImageWriter
+from lib.utils.py_cpu_nms import py_cpu_nms as nms
+from lib.utils.mask_codec import write_mask
+from lib.utils.test_mask import im_detect, im_detect_batch, cal_precision_recall_mae, cal_fmeasure, \
+    cal_f1_auc_quantized
+
+
+def load_mask_gt(path):
+    """Read a ground-truth mask as a {0, 1} float32 array."""
+    mask_gt = cv2.imread(path)
+    mask_gt = cv2.cvtColor(mask_gt, cv2.COLOR_BGR2GRAY)
+    ret, mask_gt = cv2.threshold(mask_gt, 127, 255, cv2.THRESH_BINARY)
+    return (mask_gt / 255.0).astype(np.float32)
+
+
+@instrument.timed('paste')
+def paste_masks(im_shape, mask_boxes, mask_scores, mask_pred):
+    """Paste the per-RoI mask predictions back into an image-sized canvas.
+
+    Overlapping RoIs are max-blended. Only the RoI window of the canvas is
+    touched, so the cost is proportional to the box areas, not to the image.
+    Returns None when no RoI has a positive score.
+    """
+    batch_ind = np.where(mask_scores > 0.)[0]
+    if batch_ind.shape[0] == 0:
+        return None
+    mask_boxes = mask_boxes.astype(int)
+    mask_out = np.zeros(im_shape[:2], dtype=np.float32)
+    for ind in batch_ind:
+        x1, y1, x2, y2 = mask_boxes[ind, 0:4]
+        height = y2 - y1
+        width = x2 - x1
+        if width <= 0 or height <= 0:
+            continue
+        mask_box_pre = cv2.resize(mask_pred[ind, :, :, :], (width, height))
+        region = mask_out[y1:y2, x1:x2]
+        np.maximum(region, mask_box_pre, out=region)
+    return mask_out
+
+
+def top_class(maskcls_inds, mask_scores):
+    """Class of the best scoring mask RoI, background (0) when there is none."""
+    if mask_scores.shape[0] == 0:
+        return 0
+    return int(maskcls_inds[np.argmax(mask_scores), 0])
+
+
+def pixel_scores(pred):
+    """Return (f1, auc) of the pasted mask, computing them once per image.
+
+    F1 and AUC are not defined when the ground truth is a single class (an
+    authentic image); they are then NaN, which the sinks leave out of their
+    means, unless there is no mask at all.
+    """
+    if 'f1' not in pred:
+        positive = np.count_nonzero(pred['mask_gt'] > 0.5)
+        if pred['mask_out'] is None:
+            pred['f1'] = 1e-10
+            pred['auc'] = 1e-10
+        elif positive == 0 or positive == pred['mask_gt'].size:
+            pred['f1'] = np.nan
+            pred['auc'] = np.nan
+        else:
+            with instrument.scope('metrics'):
+                if cfg.FLAGS.pixel_metric_bits > 0:
+                    pred['f1'], pred['auc'] = cal_f1_auc_quantized(pred['mask_out'], pred['mask_gt'],
+                                                                   cfg.FLAGS.pixel_metric_bits)
+                else:
+                    precision, recall, auc_score = cal_precision_recall_mae(pred['mask_out'], pred['mask_gt'])
+                    pred['f1'] = np.max(np.array(cal_fmeasure(precision, recall)))
+                    pred['auc'] = auc_score
+    return pred['f1'], pred['auc']
+
+
+class EvalSink(object):
+    """Base class of the evaluation outputs.
+
+    `needs_gt` asks the engine to load the ground-truth mask of every image.
+    """
+    name = None
+    needs_gt = False
+
+    def start(self, imdb, output_dir):
+        self._imdb = imdb
+        self._output_dir = output_dir
+
+    def process(self, i, pred):
+        raise NotImplementedError
+
+    def finish(self):
+        return {}
+
+
+class PixelMetricSink(EvalSink):
+    """Per-image pixel F1/AUC, averaged per class (former test_mask.py)."""
+    name = 'f1'
+    needs_gt = True
+
+    def __init__(self, log_name='my_log.txt', **kwargs):
+        self._log_name = log_name
+
+    def start(self, imdb, output_dir):
+        EvalSink.start(self, imdb, output_dir)
+        self._all_f1 = np.zeros((imdb.num_images, imdb.num_classes), np.float64)
+        self._all_auc = np.zeros((imdb.num_images, imdb.num_classes), np.float64)
+        self._log = open(os.path.join(output_dir, self._log_name), 'w')
+
+    def process(self, i, pred):
+        f1, auc_score = pixel_scores(pred)
+        self._all_f1[i, pred['cls']] = f1
+        self._all_auc[i, pred['cls']] = auc_score
+        self._log.write('%s' % pred['path'])
+        for j in range(1, self._imdb.num_classes):
+            self._log.write(' cls: %d f1:%.3f' % (j, self._all_f1[i, j]))
+            self._log.write(' auc:%.3f' % (self._all_auc[i, j]))
+        self._log.write('\n')
+
+    def finish(self):
+        class_f1 = np.zeros(self._imdb.num_classes)
+        class_auc = np.zeros(self._imdb.num_classes)
+        for j in range(1, self._imdb.num_classes):
+            cls_f1 = self._all_f1[:, j]
+            class_f1[j] = np.average(cls_f1[np.where(cls_f1 > 0.)[0]])
+            cls_auc = self._all_auc[:, j]
+            class_auc[j] = np.average(cls_auc[np.where(cls_auc > 0)[0]])
+        avg_f1 = np.average(class_f1[1:])
+        avg_auc = np.average(class_auc[1:])
+        self._log.write('Average F1  Score: %.3f\n' % avg_f1)
+        self._log.write('Average AUC Score: %.3f\n' % avg_auc)
+        self._log.close()
+
+        print('~~~~~~~~~~~~~~~~~~~~~~~~~~')
+        print('Test Results:')
+        print('Average F1  Score: %.3f' % avg_f1)
+        print('Average AUC Score: %.3f' % avg_auc)
+        print('~~~~~~~~~~~~~~~~~~~~~~~~~~')
+        return {'f1': avg_f1, 'auc': avg_auc}
+
+
+class BoxAPSink(EvalSink):
+    """Box detections evaluated with voc_eval (former test_mask_ap.py)."""
+    name = 'ap'
+
+    def __init__(self, max_per_image=100, thresh=0.05, nms_thresh=0.2, **kwargs):
+        self._max_per_image = max_per_image
+        self._thresh = thresh
+        self._nms_thresh = nms_thresh
+
+    def start(self, imdb, output_dir):
+        EvalSink.start(self, imdb, output_dir)
+        self._all_boxes = [[[] for _ in range(imdb.num_images)]
+                           for _ in range(imdb.num_classes)]
+
+    def process(self, i, pred):
+        scores = pred['scores']
+        boxes = pred['boxes']
+        all_boxes = self._all_boxes
+        num_classes = self._imdb.num_classes
+        # skip j = 0, because it's the background class
+        for j in range(1, num_classes):
+            inds = np.where(scores[:, j] > self._thresh)[0]
+            cls_scores = scores[inds, j]
+            cls_boxes = boxes[inds, j * 4:(j + 1) * 4]
+            cls_dets = np.hstack((cls_boxes, cls_scores[:, np.newaxis])) \
+                .astype(np.float32, copy=False)
+            keep = nms(cls_dets, self._nms_thresh)
+            all_boxes[j][i] = cls_dets[keep, :]
+
+        # Limit to max_per_image detections *over all classes*
+        if self._max_per_image > 0:
+            image_scores = np.hstack([all_boxes[j][i][:, -1]
+                                      for j in range(1, num_classes)])
+            if len(image_scores) > self._max_per_image:
+                image_thresh = np.sort(image_scores)[-self._max_per_image]
+                for j in range(1, num_classes):
+                    keep = np.where(all_boxes[j][i][:, -1] >= image_thresh)[0]
+                    all_boxes[j][i] = all_boxes[j][i][keep, :]
+
+    def finish(self):
+        det_file = os.path.join(self._output_dir, 'all_boxes.pkl')
+        with open(det_file, 'wb') as f:
+            pickle.dump(self._all_boxes, f, pickle.HIGHEST_PROTOCOL)
+        self._imdb.evaluate_detections(self._all_boxes, self._output_dir)
+        return {'detections': det_file}
+
+
+def compose_panels(image, mask_gt, mask_pred, size):
+    """Build an image | GT | prediction strip in memory.
+
+    The masks are binarized at 0.5 and broadcast from grayscale to BGR while
+    being copied into the strip, so no temporary files are needed.
+    """
+    panels = np.empty((size[1], size[0] * 3, 3), dtype=np.uint8)
+    panels[:, :size[0]] = cv2.resize(image, size)
+    panels[:, size[0]:2 * size[0]] = \
+        np.where(cv2.resize(mask_gt, size) * 255 > 127, 255, 0).astype(np.uint8)[:, :, np.newaxis]
+    panels[:, 2 * size[0]:] = \
+        np.where(cv2.resize(mask_pred, size) * 255 > 127, 255, 0).astype(np.uint8)[:, :, np.newaxis]
+    return panels
+
+
+class VisualizationSink(EvalSink):
+    """Side-by-side image | GT | prediction panels (former test_mask_save.py).
+
+    Panels are composed in memory and encoded/written by a background
+    AsyncImageWriter. `vis_scale` < 1 downscales the panels before encoding.
+    """
+    name = 'vis'
+    needs_gt = True
+
+    def __init__(self, vis_size=512, vis_scale=1.0, vis_format='png', vis_quality=None,
+                 vis_queue=32, **kwargs):
+        self._vis_size = max(1, int(round(vis_size * vis_scale)))
+        self._vis_format = vis_format
+        self._vis_quality = vis_quality
+        self._vis_queue = vis_queue
+
+    def start(self, imdb, output_dir):
+        EvalSink.start(self, imdb, output_dir)
+        self._vis_dir = os.path.join(output_dir, 'vis')
+        if not os.path.exists(self._vis_dir):
+            os.makedirs(self._vis_dir)
+        self._writer = AsyncImageWriter(self._vis_format, self._vis_quality, self._vis_queue)
+
+    def process(self, i, pred):
+        if pred['mask_out'] is None:
+            return
+        size = (self._vis_size, self._vis_size)
+        panels = compose_panels(pred['image'], pred['mask_gt'], pred['mask_out'], size)
+        self._writer.write(os.path.join(self._vis_dir, 'tmp{}'.format(i)), panels)
+
+    def finish(self):
+        self._writer.close()
+        return {'vis': self._vis_dir, 'written': self._writer.written}
+
+
+class SpreadsheetSink(EvalSink):
+    """One spreadsheet row per image (former test_mask_excel.py)."""
+    name = 'excel'
+    needs_gt = True
+
+    header = ('image', 'cls', 'f1', 'auc', 'max_mask_score', 'num_rois')
+
+    def start(self, imdb, output_dir):
+        EvalSink.start(self, imdb, output_dir)
+        self._rows = []
+
+    def process(self, i, pred):
+        f1, auc_score = pixel_scores(pred)
+        self._rows.append((pred['path'], pred['cls'], float(f1), float(auc_score),
+                           float(np.max(pred['mask_scores'])) if pred['mask_scores'].size else 0.,
+                           int(pred['mask_scores'].shape[0])))
+
+    def finish(self):
+        import xlwt
+        workbook = xlwt.Workbook(encoding='utf-8')
+        worksheet = workbook.add_sheet('My Worksheet')
+        for col, label in enumerate(self.header):
+            worksheet.write(0, col, label=label)
+        for row, values in enumerate(self._rows):
+            for col, value in enumerate(values):
+                worksheet.write(row + 1, col, value)
+        xls_file = os.path.join(self._output_dir, self._imdb.name + '.xls')
+        workbook.save(xls_file)
+        return {'spreadsheet': xls_file}
+
+
+class PredictionDumpSink(EvalSink):
+    """Raw network outputs and the pasted mask, one file per image.
+
+    The mask goes to <i>.mask.json in cfg.FLAGS.dump_mask_format (see
+    lib/utils/mask_codec.py), or into the .npz as float32 with 'npz'.
+    """
+    name = 'dump'
+
+    def start(self, imdb, output_dir):
+        EvalSink.start(self, imdb, output_dir)
+        self._dump_dir = os.path.join(output_dir, 'predictions')
+        if not os.path.exists(self._dump_dir):
+            os.makedirs(self._dump_dir)
+
+    def process(self, i, pred):
+        mask_out = pred['mask_out']
+        arrays = dict(scores=pred['scores'], boxes=pred['boxes'], mask_data=pred['mask_data'])
+        if cfg.FLAGS.dump_mask_format == 'npz':
+            arrays['mask_out'] = mask_out if mask_out is not None else np.zeros((0, 0), dtype=np.float32)
+        else:
+            if mask_out is None:
+                mask_out = np.zeros(pred['image'].shape[:2], dtype=np.float32)
+            write_mask(os.path.join(self._dump_dir, '{:06d}.mask.json'.format(i)), mask_out,
+                       fmt=cfg.FLAGS.dump_mask_format)
+        np.savez_compressed(os.path.join(self._dump_dir, '{:06d}.npz'.format(i)), **arrays)
+
+    def finish(self):
+        return {'predictions': self._dump_dir}
+
+
+class CascadeReportSink(EvalSink):
+    """Skip rate and pixel F1/AUC cost of cascade inference (cfg.FLAGS.cascade_thresh) on a labeled set.
+
+    Run with the cascade off: the first stage is the same in both modes, so
+    for every threshold of cfg.FLAGS.cascade_report_thresh an image is
+    skipped iff its top tamper probability is at most the threshold, and a
+    skipped image scores as an empty mask. One full pass gives the skip rate,
+    the mean F1/AUC of the tampered images with and without the cascade, the
+    false-positive pixel rate of the authentic ones (empty ground truth, no
+    F1/AUC) and the skipped images whose ground truth is not empty.
+    """
+    name = 'cascade'
+    needs_gt = True
+
+    def start(self, imdb, output_dir):
+        EvalSink.start(self, imdb, output_dir)
+        self._rows = []
+        if cfg.FLAGS.cascade_thresh > 0:
+            print('cascade sink: cascade_thresh is {:g}, skipped images cannot be compared; '
+                  'run it with cascade_thresh=0'.format(cfg.FLAGS.cascade_thresh))
+
+    def process(self, i, pred):
+        scores = pred['scores']
+        top = float(np.max(scores[:, 1:])) if scores.shape[0] else 0.
+        tampered = bool(np.any(pred['mask_gt'] > 0.5))
+        if tampered:
+            f1, auc_score = pixel_scores(pred)
+            fp_rate = 0.
+        else:
+            # F1/AUC are not defined for an empty ground truth
+            f1 = auc_score = np.nan
+            fp_rate = float(np.mean(pred['mask_out'] > 0.5)) if pred['mask_out'] is not None else 0.
+        self._rows.append((top, float(f1), float(auc_score), fp_rate, tampered))
+
+    def finish(self):
+        if not self._rows:
+            return {}
+        top, f1, auc_score, fp_rate, tampered = [np.array(column) for column in zip(*self._rows)]
+        authentic = ~tampered
+        # pixel_scores of an empty mask
+        empty = 1e-10
+
+        def mean(values, rows):
+            return float(values[rows].mean()) if rows.any() else float('nan')
+
+        report = {'images': len(self._rows), 'tampered': int(tampered.sum()), 'authentic': int(authentic.sum()),
+                  'f1': mean(f1, tampered), 'auc': mean(auc_score, tampered),
+                  'fp_rate': mean(fp_rate, authentic), 'thresholds': []}
+        lines = ['{:>9s} {:>9s} {:>9s} {:>9s} {:>9s} {:>9s} {:>9s}'.format(
+            'thresh', 'skipped', 'f1', 'f1_delta', 'auc_delta', 'fp_rate', 'missed')]
+        for thresh in [float(t) for t in cfg.FLAGS.cascade_report_thresh.split(',') if t.strip()]:
+            skipped = top <= thresh
+            cascade_f1 = mean(np.where(skipped, empty, f1), tampered)
+            cascade_auc = mean(np.where(skipped, empty, auc_score), tampered)
+            row = {'thresh': thresh,
+                   'skip_rate': float(skipped.mean()),
+                   'f1': cascade_f1,
+                   'f1_delta': cascade_f1 - report['f1'],
+                   'auc_delta': cascade_auc - report['auc'],
+                   'fp_rate': mean(np.where(skipped, 0., fp_rate), authentic),
+                   'missed_tampered': int(np.sum(skipped & tampered))}
+            report['thresholds'].append(row)
+            lines.append('{:>9.3f} {:>8.1%} {:>9.4f} {:>+9.4f} {:>+9.4f} {:>9.4f} {:>9d}'.format(
+                thresh, row['skip_rate'], row['f1'], row['f1_delta'], row['auc_delta'], row['fp_rate'],
+                row['missed_tampered']))
+        print('Cascade (without it: mean f1 {1:.4f}, auc {2:.4f} of {0:d} tampered images, false-positive '
+              'pixel rate {4:.4f} of {3:d} authentic images):'.format(report['tampered'], report['f1'], report['auc'],
+                                                                    report['authentic'], report['fp_rate']))
+        print('\n'.join(lines))
+        report_file = os.path.join(self._output_dir, 'cascade.json')
+        with open(report_file, 'w') as f:
+            json.dump(report, f, indent=2)
+        return {'cascade': report_file}
+
+
+SINKS = dict((sink.name, sink) for sink in
+             (PixelMetricSink, BoxAPSink, VisualizationSink, SpreadsheetSink, PredictionDumpSink,
+              CascadeReportSink))
+
+
+def build_sinks(names, **kwargs):
+    """Create the sinks listed in a comma separated string, e.g. 'f1,ap,vis'."""
+    sinks = []
+    for name in names.split(','):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in SINKS:
+            raise KeyError('Unknown sink: {} (available: {})'.format(name, ', '.join(sorted(SINKS))))
+        sinks.append(SINKS[name](**kwargs))
+    return sinks
+
+
+def tile_windows(height, width, tile, overlap):
+    """(x1, y1, x2, y2) windows of at most tile x tile pixels covering the image.
+
+    Neighbours overlap by at least `overlap` pixels; the last row/column of
+    windows is aligned with the image border.
+    """
+    assert 0 <= overlap < tile, 'The tile overlap must be smaller than the tile'
+
+    def starts(size):
+        if size <= tile:
+            return [0]
+        return list(range(0, size - tile, tile - overlap)) + [size - tile]
+
+    return [(x, y, min(x + tile, width), min(y + tile, height))
+            for y in starts(height) for x in starts(width)]
+
+
+def predict_tiled(sess, net, im, tile, overlap, scale=1.0, nms_thresh=0.3):
+    """predict_image for large images: im_detect per overlapping tile at a fixed scale.
+
+    Network memory is bounded by the tile size. Boxes and mask RoIs are
+    shifted to image coordinates, the mask RoIs of all tiles are merged with
+    NMS and the kept ones are max-blended into a full-resolution canvas.
+    Unlike predict_image, the boxes of 'mask_data' are in image pixels.
+    """
+    parts = []
+    for x1, y1, x2, y2 in tile_windows(im.shape[0], im.shape[1], tile, overlap):
+        crop = np.ascontiguousarray(im[y1:y2, x1:x2])
+        with instrument.scope('tile'):
+            scores, boxes, maskcls_inds, mask_boxes, mask_scores, mask_pred, mask_data = \
+                im_detect(sess, net, crop, im_scale=scale)
+        offset = np.array([x1, y1, x1, y1], dtype=np.float32)
+        mask_data = mask_data.copy()
+        mask_data[:, 1:5] = mask_data[:, 1:5] / scale + offset
+        parts.append((scores, boxes + np.tile(offset, boxes.shape[1] // 4), maskcls_inds,
+                      mask_boxes + np.tile(offset, mask_boxes.shape[1] // 4), mask_scores, mask_pred, mask_data))
+    scores, boxes, maskcls_inds, mask_boxes, mask_scores, mask_pred, mask_data = \
+        [np.concatenate(column) for column in zip(*parts)]
+    instrument.count('tiles', len(parts))
+
+    with instrument.scope('tile_nms'):
+        dets = np.hstack((mask_boxes[:, 0:4], mask_scores[:, 0:1])).astype(np.float32)
+        # nms() returns a plain [] when no tile has a mask RoI
+        keep = np.sort(np.asarray(nms(dets, nms_thresh), dtype=np.intp))
+    return {'scores': scores,
+            'boxes': boxes,
+            'mask_scores': mask_scores[keep],
+            'mask_boxes': mask_boxes[keep],
+            'mask_data': mask_data[keep],
+            'cls': top_class(maskcls_inds[keep], mask_scores[keep]),
+            'mask_out': paste_masks(im.shape, mask_boxes[keep], mask_scores[keep], mask_pred[keep])}
+
+
+def predict_image(sess, net, im):
+    """Run the network on one image and paste the mask back.
+
+    Images larger than cfg.FLAGS.test_tile go through predict_tiled.
+    """
+    if 0 < cfg.FLAGS.test_tile < max(im.shape[:2]):
+        return predict_tiled(sess, net, im, cfg.FLAGS.test_tile, cfg.FLAGS.test_tile_overlap,
+                             cfg.FLAGS.test_tile_scale, cfg.FLAGS.test_tile_nms)
+    return _prediction(im, im_detect(sess, net, im))
+
+
+def predict_batch(sess, net, ims, batch_size):
+    """predict_image for a list of images, batched through im_detect_batch.
+
+    Images that predict_image would tile are still run one at a time.
+    """
+    preds = [None] * len(ims)
+    batched = []
+    for i, im in enumerate(ims):
+        if 0 < cfg.FLAGS.test_tile < max(im.shape[:2]):
+            preds[i] = predict_image(sess, net, im)
+        else:
+            batched.append(i)
+    detections = im_detect_batch(sess, net, [ims[i] for i in batched], batch_size)
+    for i, det in zip(batched, detections):
+        preds[i] = _prediction(ims[i], det)
+    return preds
+
+
+def _prediction(im, detections):
+    scores, boxes, maskcls_inds, mask_boxes, mask_scores, mask_pred, mask_data = detections
+    return {'scores': scores,
+            'boxes': boxes,
+            'mask_scores': mask_scores,
+            'mask_boxes': mask_boxes,
+            'mask_data': mask_data,
+            'cls': top_class(maskcls_inds, mask_scores),
+            'mask_out': paste_masks(im.shape, mask_boxes, mask_scores, mask_pred)}
+
+
+class ImageSource(object):
+    """Test images and ground-truth masks of an imdb, decoded on demand."""
+
+    def __init__(self, imdb, with_gt=True):
+        self._imdb = imdb
+        self._with_gt = with_gt
+
+    def __len__(self):
+        return self._imdb.num_images
+
+    def get(self, i):
+        """Return (path, BGR image, GT mask or None) of image i."""
+        path = self._imdb.image_path_at(i)
+        mask_gt = load_mask_gt(self._imdb.mask_path_at(i)) if self._with_gt else None
+        return path, cv2.imread(path), mask_gt
+
+
+class CachedImageSource(ImageSource):
+    """ImageSource that keeps decoded images and GT masks in memory, up to `max_bytes`.
+
+    Used when the same test set is evaluated several times, e.g. once per
+    checkpoint of a sweep. GT masks are kept as bool (a quarter of the
+    float32 load_mask_gt gives). The first images that fit are kept and the
+    rest are decoded on every pass: the passes read the images in the same
+    order, for which an LRU would evict every image before its next use.
+    """
+
+    def __init__(self, imdb, with_gt=True, max_bytes=None):
+        ImageSource.__init__(self, imdb, with_gt)
+        self._cache = {}
+        self._max_bytes = max_bytes
+        self.nbytes = 0
+
+    def get(self, i):
+        entry = self._cache.get(i)
+        if entry is None:
+            path, im, mask_gt = ImageSource.get(self, i)
+            entry = (path, im, mask_gt > 0.5 if mask_gt is not None else None)
+            size = (im.nbytes if im is not None else 0) + (mask_gt.size if mask_gt is not None else 0)
+            if self._max_bytes is None or self.nbytes + size <= self._max_bytes:
+                self._cache[i] = entry
+                self.nbytes += size
+            else:
+                instrument.count('image_cache/misses')
+        path, im, mask_gt = entry
+        return path, im, mask_gt.astype(np.float32) if mask_gt is not None else None
+
+
+def test_net_sinks(sess, net, imdb, weights_filename, sinks, images=None, batch_size=1):
+    """Evaluate a network on an imdb with a single inference pass per image.
+
+    With batch_size > 1 the network must have been built with batch_size=None;
+    images are then read and predicted in windows of 4 * batch_size so that
+    im_detect_batch can group them by size.
+    """
+    assert cfg.FLAGS.USE_MASK is True, 'The evaluation engine needs the mask branch'
+    np.random.seed(cfg.FLAGS.rng_seed)
+    num_images = len(imdb.image_index)
+    output_dir = get_output_dir(imdb, weights_filename)
+    if images is None:
+        images = ImageSource(imdb, with_gt=any(sink.needs_gt for sink in sinks))
+    for sink in sinks:
+        sink.start(imdb, output_dir)
+
+    window = 1 if batch_size <= 1 else 4 * batch_size
+    detect_s = sinks_s = 0.
+    skipped = 0
+    for first in range(0, num_images, window):
+        inds = range(first, min(first + window, num_images))
+        with instrument.scope('load'):
+            loaded = [images.get(i) for i in inds]
+
+        with instrument.scope('predict') as t:
+            if batch_size <= 1:
+                preds = [predict_image(sess, net, loaded[0][1])]
+            else:
+                preds = predict_batch(sess, net, [im for _, im, _ in loaded], batch_size)
+        detect_s += t.elapsed / 1e9
+
+        for i, (path, im, mask_gt), pred in zip(inds, loaded, preds):
+            with instrument.scope('sinks') as t:
+                pred['path'] = path
+                pred['image'] = im
+                pred['mask_gt'] = mask_gt
+                for sink in sinks:
+                    with instrument.scope(sink.name):
+                        sink.process(i, pred)
+            sinks_s += t.elapsed / 1e9
+            instrument.count('test/images')
+            skipped += pred['mask_scores'].shape[0] == 0
+
+        done = inds[-1] + 1
+        print('im_detect: {:d}/{:d} {:.3f}s {:.3f}s remaining time: {:.3f}m'
+              .format(done, num_images, detect_s / done, sinks_s / done,
+                      ((num_images - done) * (detect_s + sinks_s) / done) / 60),
+              end='\r')
+    print('\n')
+    if cfg.FLAGS.cascade_thresh > 0:
+        print('cascade: mask branch skipped for {:d}/{:d} images ({:.1%}), threshold {:g}'.format(
+            skipped, num_images, skipped / max(num_images, 1), cfg.FLAGS.cascade_thresh))
+
+    return dict((sink.name, sink.finish()) for sink in sinks)
@@ -0,0 +1,115 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""float16 cache of backbone feature maps for head-only fine-tuning.
+
+With the backbone frozen (both ResNet streams and the CBAM fusion), the
+fused `net_conv4` map of an image only depends on the image, its flip and
+the scale it was resized to. FeatureCache keeps one such map per key in an
+append-only float16 data file, memory-mapped for reads, with a JSON-lines
+index next to it. An index line is written after its data, so a run that
+was killed leaves at most one unindexed map behind, which the next run
+drops before it carries on filling the cache.
+
+The cache directory is named after the checkpoint and the preprocessing
+settings (cache_dir()), so another checkpoint or scale gets a fresh cache.
+A 600x1000 input gives a 38x63x1024 map, ~4.7MB in float16.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+from lib.config import settings as cfg
+
+
+def feature_key(entry, target_size):
+    """Cache key of a roidb entry resized to `target_size`."""
+    return '{}|{:d}|{:d}'.format(entry['image'], int(bool(entry['flipped'])), int(target_size))
+
+
+def cache_dir(checkpoint_signature):
+    """<data_dir>/cache/features/<hash of the checkpoint and preprocessing settings>."""
+    key = json.dumps([checkpoint_signature, list(cfg.FLAGS2["scales"]), cfg.FLAGS.max_size,
+                      np.asarray(cfg.FLAGS2["pixel_means"]).ravel().tolist()])
+    return os.path.join(cfg.FLAGS2["data_dir"], 'cache', 'features',
+                        hashlib.sha1(key.encode('utf-8')).hexdigest()[:16])
+
+
+class FeatureCache(object):
+    """Feature maps by key: put() appends, get() reads through a memory map."""
+
+    def __init__(self, path):
+        self.path = path
+        if not os.path.exists(path):
+            os.makedirs(path)
+        self._data_path = os.path.join(path, 'features.f16')
+        self._index_path = os.path.join(path, 'index.jsonl')
+        size = os.path.getsize(self._data_path) if os.path.exists(self._data_path) else 0
+        # key -> (offset, shape), offsets in float16 elements
+        self._index = {}
+        complete = 0
+        if os.path.exists(self._index_path):
+            with open(self._index_path, 'rb') as f:
+                for line in f:
+                    if not line.endswith(b'\n'):
+                        # A line cut short when the run was killed
+                        break
+                    complete += len(line)
+                    entry = json.loads(line.decode('utf-8'))
+                    shape = tuple(entry['shape'])
+                    if (entry['offset'] + int(np.prod(shape))) * 2 <= size:
+                        self._index[entry['key']] = (entry['offset'], shape)
+        # Drop a partial index line and the data written after the last complete one
+        self._size = max([offset + int(np.prod(shape)) for offset, shape in self._index.values()] or [0])
+        self._data = open(self._data_path, 'ab')
+        self._data.truncate(self._size * 2)
+        self._index_file = open(self._index_path, 'ab')
+        self._index_file.truncate(complete)
+        self._map = None
+
+    def __len__(self):
+        return len(self._index)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def nbytes(self):
+        return self._size * 2
+
+    def get(self, key):
+        """float32 copy of the feature map of `key`, None when it is not cached."""
+        entry = self._index.get(key)
+        if entry is None:
+            return None
+        offset, shape = entry
+        end = offset + int(np.prod(shape))
+        if self._map is None or self._map.shape[0] < end:
+            # The file grew since it was mapped
+            self._map = np.memmap(self._data_path, dtype=np.float16, mode='r')
+        return self._map[offset:end].astype(np.float32).reshape(shape)
+
+    def put(self, key, features):
+        """Append `features`; returns them as get() will, i.e. rounded to float16."""
+        features = np.ascontiguousarray(features, dtype=np.float16)
+        offset = self._size
+        self._data.write(features.tobytes())
+        self._data.flush()
+        self._size += features.size
+        line = json.dumps({'key': key, 'offset': offset, 'shape': list(features.shape)}) + '\n'
+        self._index_file.write(line.encode('utf-8'))
+        self._index_file.flush()
+        self._index[key] = (offset, features.shape)
+        return features.astype(np.float32)
+
+    def close(self):
+        self._map = None
+        self._data.close()
+        self._index_file.close()
@@ -0,0 +1,80 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Background image reader/decoder.
+
+The counterpart of image_writer.AsyncImageWriter: `workers` threads read and
+decode images ahead of the inference loop (cv2 releases the GIL while
+decoding). The output queue is bounded so decoding never runs more than
+`max_queue` images ahead. Images come out in completion order, not input
+order.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import cv2
+
+
+class AsyncImageReader(object):
+    """Iterate over (key, path, BGR image or None) for `items`, a list of (key, path).
+
+    An image that cannot be read or decoded comes out as None.
+    """
+
+    def __init__(self, items, workers=2, max_queue=16):
+        self._tasks = queue.Queue()
+        for item in items:
+            self._tasks.put(item)
+        self._workers = max(1, workers)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        for i in range(self._workers):
+            thread = threading.Thread(target=self._run, name='AsyncImageReader-{:d}'.format(i))
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            try:
+                key, path = self._tasks.get_nowait()
+            except queue.Empty:
+                self._queue.put(None)
+                return
+            try:
+                im = cv2.imread(path, cv2.IMREAD_COLOR)
+            except Exception:  # pylint: disable=broad-except
+                im = None
+            self._queue.put((key, path, im))
+
+    def __iter__(self):
+        running = self._workers
+        while running:
+            item = self._queue.get()
+            if item is None:
+                running -= 1
+                continue
+            yield item
+
+    def close(self):
+        """Drop the images not read yet and stop the workers."""
+        while True:
+            try:
+                self._tasks.get_nowait()
+            except queue.Empty:
+                break
+        # Unblock workers waiting on a full output queue
+        while any(thread.is_alive() for thread in self._threads):
+            try:
+                self._queue.get(timeout=0.1)
+            except queue.Empty:
+                pass
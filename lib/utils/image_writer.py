@@ -0,0 +1,100 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Background image encoder/writer.
+
+Encoding and disk writes are moved off the inference loop to a writer
+thread. The queue is bounded so a slow disk throttles the producer instead
+of piling up decoded images in memory.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import threading
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+import cv2
+
+
+def encode_params(ext, quality=None):
+    """OpenCV encoder parameters for a file extension.
+
+    `quality` is the JPEG/WebP quality (0-100) or the PNG compression level
+    (0-9); None keeps the OpenCV default.
+    """
+    if quality is None:
+        return []
+    ext = ext.lower()
+    if ext in ('.jpg', '.jpeg'):
+        return [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+    if ext == '.png':
+        return [cv2.IMWRITE_PNG_COMPRESSION, int(quality)]
+    if ext == '.webp':
+        return [cv2.IMWRITE_WEBP_QUALITY, int(quality)]
+    raise ValueError('No quality setting for {} images'.format(ext))
+
+
+class AsyncImageWriter(object):
+    """Encode and write images from a background thread."""
+
+    def __init__(self, ext='.png', quality=None, max_queue=32):
+        if not ext.startswith('.'):
+            ext = '.' + ext
+        self.ext = ext
+        self._params = encode_params(ext, quality)
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._error = None
+        self.written = 0
+        self._thread = threading.Thread(target=self._run, name='AsyncImageWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+            path, image = item
+            try:
+                ok, buf = cv2.imencode(self.ext, image, self._params)
+                if not ok:
+                    raise IOError('Could not encode {}'.format(path))
+                # Written under a temporary name and renamed, so `path` is either complete or absent
+                with open(path + '.tmp', 'wb') as f:
+                    f.write(buf.tobytes())
+                os.replace(path + '.tmp', path)
+                self.written += 1
+            except Exception as e:  # pylint: disable=broad-except
+                if self._error is None:
+                    self._error = e
+            finally:
+                self._queue.task_done()
+
+    def write(self, path, image):
+        """Queue `image` to be written to `path` (extension is appended if missing).
+
+        Blocks while the queue is full. The caller must not modify `image`
+        afterwards.
+        """
+        if self._error is not None:
+            raise self._error
+        if os.path.splitext(path)[1].lower() != self.ext:
+            path = path + self.ext
+        self._queue.put((path, image))
+        return path
+
+    def close(self):
+        """Wait until every queued image is on disk."""
+        if self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join()
+        if self._error is not None:
+            raise self._error
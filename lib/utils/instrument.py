@@ -0,0 +1,266 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Process-wide registry of named timers and counters.
+
+Scopes nest per thread, so a scope opened inside another one is recorded
+under the joined name ('predict/im_detect/net'). Each name keeps count, total,
+min/max and streaming p50/p95/p99 estimates (P-square algorithm, constant
+memory), so timing every call costs a few microseconds and nothing grows
+with the run length.
+
+    from lib.utils import instrument
+
+    with instrument.scope('im_detect'):
+        ...
+
+    @instrument.timed('py_func/proposal_layer')
+    def proposal_layer(...):
+        ...
+
+    instrument.count('images')
+    instrument.report_at_exit('timings.json')   # table on stdout, JSON file
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import atexit
+import functools
+import json
+import threading
+import time
+
+try:
+    _now_ns = time.perf_counter_ns
+except AttributeError:
+    def _now_ns():
+        return int(time.perf_counter() * 1e9)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+_lock = threading.Lock()
+_local = threading.local()
+_stats = {}
+_counters = {}
+enabled = True
+
+
+class P2Quantile(object):
+    """Streaming estimate of one quantile (Jain & Chlamtac's P-square algorithm)."""
+
+    def __init__(self, p):
+        self.p = p
+        self.count = 0
+        self._q = []
+        self._n = [0, 1, 2, 3, 4]
+        self._desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        self._step = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def add(self, x):
+        self.count += 1
+        q = self._q
+        if self.count <= 5:
+            q.append(x)
+            q.sort()
+            return
+        n = self._n
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = 0
+            while x >= q[k + 1]:
+                k += 1
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self._desired[i] += self._step[i]
+        for i in (1, 2, 3):
+            d = self._desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                # Piecewise-parabolic prediction, linear if it would break monotonicity
+                qp = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i]) / (n[i + 1] - n[i]) +
+                    (n[i + 1] - n[i] - d) * (q[i] - q[i - 1]) / (n[i] - n[i - 1]))
+                if not q[i - 1] < qp < q[i + 1]:
+                    qp = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = qp
+                n[i] += d
+
+    def value(self):
+        if self.count == 0:
+            return float('nan')
+        if self.count <= 5:
+            return self._q[min(int(self.p * self.count), self.count - 1)]
+        return self._q[2]
+
+
+class Stat(object):
+    """Count, total, min, max and quantile estimates of one timer (nanoseconds)."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.quantiles = [P2Quantile(p) for p in QUANTILES]
+
+    def add(self, ns):
+        self.count += 1
+        self.total += ns
+        if self.min is None or ns < self.min:
+            self.min = ns
+        if self.max is None or ns > self.max:
+            self.max = ns
+        for q in self.quantiles:
+            q.add(ns)
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.
+
+    def as_dict(self):
+        """Summary in milliseconds."""
+        d = {'count': self.count, 'total_s': self.total / 1e9, 'mean_ms': self.mean / 1e6,
+             'min_ms': (self.min or 0) / 1e6, 'max_ms': (self.max or 0) / 1e6}
+        for p, q in zip(QUANTILES, self.quantiles):
+            d['p{:d}_ms'.format(int(round(p * 100)))] = q.value() / 1e6
+        return d
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def record(name, ns):
+    """Add one duration (nanoseconds) under `name`."""
+    with _lock:
+        stat = _stats.get(name)
+        if stat is None:
+            stat = _stats[name] = Stat()
+        stat.add(ns)
+
+
+class scope(object):
+    """Time a block under `name`, nested below the scopes already open in this thread.
+
+    `elapsed` (nanoseconds) is set on exit even when recording is disabled.
+    """
+
+    __slots__ = ('name', 'full_name', 'start', 'elapsed', '_recording')
+
+    def __init__(self, name):
+        self.name = name
+        self.elapsed = 0
+
+    def __enter__(self):
+        self._recording = enabled
+        if self._recording:
+            stack = _stack()
+            stack.append(self.name)
+            self.full_name = '/'.join(stack)
+        self.start = _now_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = _now_ns() - self.start
+        if self._recording:
+            _stack().pop()
+            record(self.full_name, self.elapsed)
+        return False
+
+
+def timed(name=None):
+    """Decorator form of scope(); defaults to the function name."""
+    def decorator(func):
+        label = name or func.__name__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with scope(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def count(name, n=1):
+    """Add `n` to counter `name`."""
+    if enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + n
+
+
+def stat(name):
+    """The Stat recorded under the full name `name`, or None."""
+    return _stats.get(name)
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+        _counters.clear()
+
+
+def snapshot():
+    """Every timer (ms summaries) and counter as plain dicts."""
+    with _lock:
+        return {'timers': dict((name, s.as_dict()) for name, s in _stats.items()),
+                'counters': dict(_counters)}
+
+
+def _tree_label(name, timers):
+    """`name` relative to its closest recorded ancestor, indented by the ancestor depth."""
+    parts = name.split('/')
+    depth, start = 0, 0
+    for i in range(1, len(parts)):
+        if '/'.join(parts[:i]) in timers:
+            depth += 1
+            start = i
+    return '  ' * depth + '/'.join(parts[start:])
+
+
+def format_table():
+    """Timers as an indented tree, then the counters."""
+    data = snapshot()
+    timers = data['timers']
+    if not timers and not data['counters']:
+        return ''
+    names = sorted(timers)
+    labels = dict((name, _tree_label(name, timers)) for name in names)
+    width = max([len(label) for label in labels.values()] + [len(n) for n in data['counters']] + [5])
+    cols = ('count', 'total_s', 'mean_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms')
+    lines = [' '.join(['scope'.ljust(width)] + ['{:>10s}'.format(c) for c in cols])]
+    for name in names:
+        row = timers[name]
+        cells = ['{:>10d}'.format(row['count'])] + ['{:>10.3f}'.format(row[c]) for c in cols[1:]]
+        lines.append(' '.join([labels[name].ljust(width)] + cells))
+    for name in sorted(data['counters']):
+        lines.append('{:s} {:>10d}'.format(name.ljust(width), data['counters'][name]))
+    return '\n'.join(lines)
+
+
+def dump_json(path):
+    with open(path, 'w') as f:
+        json.dump(snapshot(), f, indent=2, sort_keys=True)
+    return path
+
+
+def report_at_exit(json_path=None):
+    """Print the table (and write `json_path`) when the process exits."""
+    def report():
+        table = format_table()
+        if table:
+            print(table)
+        if json_path:
+            dump_json(json_path)
+    atexit.register(report)
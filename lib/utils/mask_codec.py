@@ -0,0 +1,208 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Compact storage of predicted and ground-truth masks.
+
+Two formats:
+    rle     binary masks as COCO-style run lengths (column-major, starting
+            with a run of zeros), serialized with the COCO compressed string
+            encoding so pycocotools can read them
+    soft    soft masks quantized to `bits` (1, 2, 4 or 8) per pixel, delta
+            coded along rows, bit-packed and zlib-compressed
+
+A 4000x3000 predicted mask with a few RoIs is 48MB as float32 and ~400KB
+as an 8-bit PNG, ~220KB as 8-bit soft (~290KB base64 in JSON) and ~45KB
+as RLE. Area and IoU of RLE
+masks are computed on the runs, without decoding.
+
+    write_mask('000001.mask.json', mask_out, fmt='soft', bits=8)
+    mask = read_mask('000001.mask.json')        # float32, HxW
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import base64
+import json
+import os
+import zlib
+
+import cv2
+import numpy as np
+
+SOFT_BITS = (1, 2, 4, 8)
+
+
+def rle_encode(mask):
+    """RLE of a binary HxW mask: {'size': [h, w], 'counts': uint32 run lengths}."""
+    mask = np.asarray(mask)
+    height, width = mask.shape[:2]
+    flat = mask.ravel(order='F').astype(bool)
+    if flat.size == 0:
+        return {'size': [height, width], 'counts': np.zeros(1, dtype=np.uint32)}
+    change = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], change, [flat.size])))
+    if flat[0]:
+        # Runs always start with background
+        counts = np.concatenate(([0], counts))
+    return {'size': [height, width], 'counts': counts.astype(np.uint32)}
+
+
+def rle_decode(rle):
+    """Binary HxW mask (bool) of an RLE."""
+    height, width = rle['size']
+    counts = np.asarray(rle['counts'], dtype=np.int64)
+    values = np.arange(counts.size) % 2 == 1
+    return np.repeat(values, counts).reshape((width, height)).T
+
+
+def rle_area(rle):
+    return int(np.sum(np.asarray(rle['counts'], dtype=np.int64)[1::2]))
+
+
+def _is_foreground(ends, positions):
+    # Run r covers [ends[r - 1], ends[r]); odd runs are foreground
+    return np.searchsorted(ends, positions, side='right') % 2 == 1
+
+
+def rle_intersection(a, b):
+    """Foreground pixels shared by two RLEs of the same size, from their runs."""
+    assert list(a['size']) == list(b['size']), 'RLEs of different sizes'
+    ends_a = np.cumsum(np.asarray(a['counts'], dtype=np.int64))
+    ends_b = np.cumsum(np.asarray(b['counts'], dtype=np.int64))
+    total = int(a['size'][0]) * int(a['size'][1])
+    # Both masks are constant between consecutive run boundaries of either one
+    starts = np.union1d(ends_a, ends_b)
+    starts = np.concatenate(([0], starts[starts < total]))
+    lengths = np.diff(np.concatenate((starts, [total])))
+    both = _is_foreground(ends_a, starts) & _is_foreground(ends_b, starts)
+    return int(np.sum(lengths[both]))
+
+
+def rle_iou(a, b):
+    inter = rle_intersection(a, b)
+    union = rle_area(a) + rle_area(b) - inter
+    return inter / union if union > 0 else 0.
+
+
+def rle_to_string(counts):
+    """COCO compressed string of run lengths (pycocotools' rleToString)."""
+    counts = [int(c) for c in counts]
+    chars = []
+    for i, x in enumerate(counts):
+        if i > 2:
+            x -= counts[i - 2]
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = x != -1 if c & 0x10 else x != 0
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return ''.join(chars)
+
+
+def rle_from_string(s):
+    """Run lengths of a COCO compressed string (pycocotools' rleFrString)."""
+    counts = []
+    p = 0
+    while p < len(s):
+        x = 0
+        k = 0
+        more = True
+        while more:
+            c = ord(s[p]) - 48
+            x |= (c & 0x1f) << (5 * k)
+            more = c & 0x20
+            p += 1
+            k += 1
+            if not more and c & 0x10:
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+    return np.array(counts, dtype=np.uint32)
+
+
+def quantize(mask, bits=8):
+    """Soft mask in [0, 1] as integer levels 0 .. 2**bits - 1 (uint8)."""
+    levels = (1 << bits) - 1
+    # Rounds and saturates in one pass, several times faster than numpy on large masks
+    q = cv2.convertScaleAbs(np.asarray(mask, dtype=np.float32), alpha=levels)
+    if bits < 8:
+        np.minimum(q, levels, out=q)
+    return q
+
+
+def pack_soft(mask, bits=4, level=6):
+    """Quantized, bit-packed and compressed soft mask: {'size', 'bits', 'data': bytes}."""
+    if bits not in SOFT_BITS:
+        raise ValueError('bits must be one of {}, got {}'.format(SOFT_BITS, bits))
+    height, width = mask.shape[:2]
+    q = quantize(mask, bits)
+    # Differences of neighbouring levels (mod 2**bits) are mostly 0 on smooth masks
+    q = (np.diff(q, axis=1, prepend=np.uint8(0)) & np.uint8((1 << bits) - 1)).ravel()
+    per_byte = 8 // bits
+    pad = -q.size % per_byte
+    if pad:
+        q = np.concatenate((q, np.zeros(pad, dtype=np.uint8)))
+    q = q.reshape(-1, per_byte)
+    packed = np.zeros(q.shape[0], dtype=np.uint8)
+    for k in range(per_byte):
+        packed |= q[:, k] << np.uint8(bits * (per_byte - 1 - k))
+    return {'size': [height, width], 'bits': bits, 'data': zlib.compress(packed.tobytes(), level)}
+
+
+def unpack_soft(packed, levels=False):
+    """HxW float32 soft mask of pack_soft() output (uint8 levels with `levels`)."""
+    height, width = packed['size']
+    bits = packed['bits']
+    per_byte = 8 // bits
+    data = np.frombuffer(zlib.decompress(packed['data']), dtype=np.uint8)
+    top = np.uint8((1 << bits) - 1)
+    q = np.empty((data.size, per_byte), dtype=np.uint8)
+    for k in range(per_byte):
+        q[:, k] = (data >> np.uint8(bits * (per_byte - 1 - k))) & top
+    q = q.ravel()[:height * width].reshape(height, width)
+    # Undo the row deltas; uint8 wraps mod 256, a multiple of 2**bits
+    q = np.cumsum(q, axis=1, dtype=np.uint8) & top
+    if levels:
+        return q
+    return q.astype(np.float32) / float(top)
+
+
+def to_json(mask, fmt='soft', bits=8, thresh=0.5):
+    """JSON-serializable encoding of an HxW mask; `thresh` binarizes it for 'rle'."""
+    if fmt == 'rle':
+        rle = rle_encode(np.asarray(mask) > thresh)
+        return {'format': 'rle', 'size': rle['size'], 'counts': rle_to_string(rle['counts'])}
+    if fmt == 'soft':
+        packed = pack_soft(mask, bits)
+        return {'format': 'soft', 'size': packed['size'], 'bits': packed['bits'],
+                'data': base64.b64encode(packed['data']).decode('ascii')}
+    raise ValueError('Unknown mask format: {}'.format(fmt))
+
+
+def from_json(d):
+    """float32 HxW mask of a to_json() encoding."""
+    if d['format'] == 'rle':
+        return rle_decode({'size': d['size'], 'counts': rle_from_string(d['counts'])}).astype(np.float32)
+    if d['format'] == 'soft':
+        return unpack_soft({'size': d['size'], 'bits': d['bits'], 'data': base64.b64decode(d['data'])})
+    raise ValueError('Unknown mask format: {}'.format(d['format']))
+
+
+def write_mask(path, mask, fmt='soft', bits=8, thresh=0.5):
+    """Write to_json(mask) to `path` (temporary file and rename)."""
+    with open(path + '.tmp', 'w') as f:
+        json.dump(to_json(mask, fmt, bits, thresh), f)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def read_mask(path):
+    with open(path) as f:
+        return from_json(json.load(f))
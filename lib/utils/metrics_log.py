@@ -0,0 +1,138 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Append-only training metrics log.
+
+Per-iteration values are folded into running window aggregates (mean, min,
+max per field), so memory and time per step stay constant however long the
+run is. Each closed window is appended as one row to a CSV or JSONL file
+(picked by the file extension); the file is flushed per row and fsynced
+every `fsync_every` rows. export_xls turns a log into a spreadsheet on
+demand:
+
+    python -m lib.utils.metrics_log output/.../run_loss.csv [run_loss.xls]
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import csv
+import json
+import os
+import sys
+import time
+
+# xls sheets are limited to 65536 rows, including the header
+XLS_MAX_ROWS = 65535
+
+
+class MetricsLog(object):
+    """Window aggregates of per-step scalars, appended to a CSV/JSONL file."""
+
+    def __init__(self, path, fields, fsync_every=50):
+        self.path = path
+        self.fields = list(fields)
+        self.fsync_every = fsync_every
+        self.jsonl = os.path.splitext(path)[1].lower() in ('.jsonl', '.json')
+        self.columns = ['step', 'steps', 'time'] + \
+            ['{}_{}'.format(field, stat) for field in self.fields for stat in ('mean', 'min', 'max')]
+        new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+        self._file = open(path, 'a')
+        self._writer = None if self.jsonl else csv.writer(self._file)
+        if new_file and not self.jsonl:
+            self._writer.writerow(self.columns)
+            self._file.flush()
+        self._unsynced = 0
+        self._reset()
+
+    def _reset(self):
+        self._count = 0
+        self._sum = dict((field, 0.) for field in self.fields)
+        self._min = dict((field, float('inf')) for field in self.fields)
+        self._max = dict((field, float('-inf')) for field in self.fields)
+
+    def add(self, **values):
+        """Fold one step's values into the current window."""
+        for field in self.fields:
+            value = float(values[field])
+            self._sum[field] += value
+            if value < self._min[field]:
+                self._min[field] = value
+            if value > self._max[field]:
+                self._max[field] = value
+        self._count += 1
+
+    def write(self, step):
+        """Close the current window, append its aggregates and start a new one."""
+        if self._count == 0:
+            return None
+        row = {'step': int(step), 'steps': self._count, 'time': round(time.time(), 3)}
+        for field in self.fields:
+            row[field + '_mean'] = self._sum[field] / self._count
+            row[field + '_min'] = self._min[field]
+            row[field + '_max'] = self._max[field]
+        if self.jsonl:
+            self._file.write(json.dumps(row, sort_keys=True) + '\n')
+        else:
+            self._writer.writerow([row[column] for column in self.columns])
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+        self._reset()
+        return row
+
+    def sync(self):
+        os.fsync(self._file.fileno())
+        self._unsynced = 0
+
+    def close(self, step=None):
+        """Write the partial window (if `step` is given) and sync the file."""
+        if step is not None:
+            self.write(step)
+        if not self._file.closed:
+            self.sync()
+            self._file.close()
+
+
+def read_log(path):
+    """Rows of a CSV/JSONL metrics log as (columns, list of dicts)."""
+    with open(path) as f:
+        if os.path.splitext(path)[1].lower() in ('.jsonl', '.json'):
+            rows = [json.loads(line) for line in f if line.strip()]
+            columns = ['step', 'steps', 'time'] + \
+                sorted(set(k for row in rows for k in row) - {'step', 'steps', 'time'})
+        else:
+            reader = csv.DictReader(f)
+            columns = reader.fieldnames or []
+            rows = [dict((k, float(v)) for k, v in row.items()) for row in reader]
+    return columns, rows
+
+
+def export_xls(log_path, xls_path=None):
+    """Write a metrics log to an .xls workbook (one sheet per 65535 rows)."""
+    import xlwt
+
+    if xls_path is None:
+        xls_path = os.path.splitext(log_path)[0] + '.xls'
+    columns, rows = read_log(log_path)
+    workbook = xlwt.Workbook(encoding='utf-8')
+    for start in range(0, max(len(rows), 1), XLS_MAX_ROWS):
+        sheet = workbook.add_sheet('loss_{:d}'.format(start // XLS_MAX_ROWS))
+        for j, column in enumerate(columns):
+            sheet.write(0, j, label=column)
+        for i, row in enumerate(rows[start:start + XLS_MAX_ROWS]):
+            for j, column in enumerate(columns):
+                if column in row:
+                    sheet.write(i + 1, j, row[column])
+    workbook.save(xls_path)
+    return xls_path
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (2, 3):
+        print('usage: python -m lib.utils.metrics_log <log.csv|log.jsonl> [out.xls]')
+        sys.exit(1)
+    print('wrote {}'.format(export_xls(*sys.argv[1:])))
@@ -13,24 +13,54 @@ from __future__ import print_function
 import cv2
 import numpy as np
 import numpy.random as npr
+import scipy.sparse
 
-from lib.config import config as cfg
-from lib.utils.blob import prep_im_for_blob, im_list_to_blob, mask_list_to_blob
+from lib.config import settings as cfg
+from lib.utils.blob import prep_im_for_blob, im_list_to_blob, mask_list_to_blob, crop_blob
+from lib.utils import augment
+from lib.utils import instrument
+from lib.utils.feature_cache import feature_key
 
 
-def get_minibatch(roidb, num_classes):
-    """Given a roidb, construct a minibatch sampled from it."""
+@instrument.timed('minibatch')
+def get_minibatch(roidb, num_classes, feature_cache=None):
+    """Given a roidb, construct a minibatch sampled from it.
+
+    With a feature_cache (lib/utils/feature_cache.py) an image whose
+    net_conv4 map is cached is not decoded: blobs['net_conv4'] holds the map
+    and blobs['data'] is zeros of the blob shape. Otherwise
+    blobs['feature_key'] is the key to cache its map under.
+
+    With augmentations on (FLAGS.augment), blobs['augment_seeds'] are the
+    seeds the images were augmented with, see lib/utils/augment.py.
+
+    With FLAGS.train_crop the blobs are a random train_crop x train_crop
+    crop of the scaled image, see _random_crop().
+    """
     num_images = len(roidb)
     # Sample random scales to use for each image in this batch
     random_scale_inds = npr.randint(0, high=len(cfg.FLAGS2["scales"]),
                                     size=num_images)
     # assert (cfg.FLAGS.batch_size % num_images == 0), 'num_images ({}) must divide BATCH_SIZE ({})'.format(num_images, cfg.FLAGS.batch_size)
     assert (cfg.FLAGS.batch_size % num_images == 0), 'num_images ({}) must divide BATCH_SIZE ({})'.format(num_images, cfg.FLAGS.batch_size)
+    # One seed per sample, drawn only with augmentations on so the random stream is otherwise unchanged
+    augmenter = augment.from_settings()
+    seeds = npr.randint(0, 2 ** 31 - 1, size=num_images) if augmenter is not None else None
     # Get the input image blob, formatted for caffe
     if cfg.FLAGS.USE_MASK is True:
-        im_blob, im_scales, mask, mask_shape = _get_image_blob(roidb, random_scale_inds)
-
-        blobs = {'data': im_blob}
+        features = None
+        if feature_cache is not None:
+            key = feature_key(roidb[0], cfg.FLAGS2["scales"][random_scale_inds[0]])
+            features = feature_cache.get(key)
+            instrument.count('feature_cache/hits' if features is not None else 'feature_cache/misses')
+        if features is not None:
+            im_blob, im_scales, mask, mask_shape = _get_mask_blob(roidb, random_scale_inds)
+            blobs = {'data': im_blob, 'net_conv4': features}
+        else:
+            im_blob, im_scales, mask, mask_shape = _get_image_blob(roidb, random_scale_inds, augmenter, seeds)
+            blobs = {'data': im_blob}
+            if feature_cache is not None:
+                blobs['feature_key'] = key
         # blobs['noise'] = im_noise
         blobs['mask'] = mask
         assert len(im_scales) == 1, "Single batch only"
@@ -47,10 +77,10 @@ def get_minibatch(roidb, num_classes):
             # For the COCO ground truth boxes, exclude the ones that are ''iscrowd''
             if num_classes <= 2:
                 gt_inds = \
-                np.where(roidb[0]['gt_classes'] != 0 & np.all(roidb[0]['gt_overlaps'].toarray() > -1.0, axis=1))[0]
+                np.where(roidb[0]['gt_classes'] != 0 & np.all(_dense(roidb[0]['gt_overlaps']) > -1.0, axis=1))[0]
             else:
                 gt_inds = \
-                np.where(roidb[0]['gt_classes'] != 0 & np.all(roidb[0]['gt_overlaps'].toarray() > -1.0, axis=1))[0]
+                np.where(roidb[0]['gt_classes'] != 0 & np.all(_dense(roidb[0]['gt_overlaps']) > -1.0, axis=1))[0]
         gt_boxes = np.empty((len(gt_inds), 5), dtype=np.float32)
         gt_boxes[:, 0:4] = roidb[0]['boxes'][gt_inds, :] * im_scales[0]
         gt_boxes[:, 4] = roidb[0]['gt_classes'][gt_inds]
@@ -58,9 +88,13 @@ def get_minibatch(roidb, num_classes):
         blobs['im_info'] = np.array(
             [[im_blob.shape[1], im_blob.shape[2], im_scales[0], mask_shape[0][0], mask_shape[0][1]]],
             dtype=np.float32)
+        if seeds is not None:
+            blobs['augment_seeds'] = seeds
+        if cfg.FLAGS.train_crop:
+            blobs = _random_crop(blobs, cfg.FLAGS.train_crop)
         return blobs
     else:
-        im_blob, im_scales = _get_image_blob(roidb, random_scale_inds)
+        im_blob, im_scales = _get_image_blob(roidb, random_scale_inds, augmenter, seeds)
 
         blobs = {'data': im_blob}
 
@@ -73,7 +107,7 @@ def get_minibatch(roidb, num_classes):
             gt_inds = np.where(roidb[0]['gt_classes'] != 0)[0]
         else:
             # For the COCO ground truth boxes, exclude the ones that are ''iscrowd''
-            gt_inds = np.where(roidb[0]['gt_classes'] != 0 & np.all(roidb[0]['gt_overlaps'].toarray() > -1.0, axis=1))[0]
+            gt_inds = np.where(roidb[0]['gt_classes'] != 0 & np.all(_dense(roidb[0]['gt_overlaps']) > -1.0, axis=1))[0]
         gt_boxes = np.empty((len(gt_inds), 5), dtype=np.float32)
         gt_boxes[:, 0:4] = roidb[0]['boxes'][gt_inds, :] * im_scales[0]
         gt_boxes[:, 4] = roidb[0]['gt_classes'][gt_inds]
@@ -81,13 +115,149 @@ def get_minibatch(roidb, num_classes):
         blobs['im_info'] = np.array(
             [[im_blob.shape[1], im_blob.shape[2], im_scales[0]]],
             dtype=np.float32)
+        if seeds is not None:
+            blobs['augment_seeds'] = seeds
+        if cfg.FLAGS.train_crop:
+            blobs = _random_crop(blobs, cfg.FLAGS.train_crop)
 
         return blobs
 
 
-def _get_image_blob(roidb, scale_inds):
+def _dense(overlaps):
+    """gt_overlaps is sparse in a list roidb and already dense in a ColumnarRoidb."""
+    return overlaps.toarray() if scipy.sparse.issparse(overlaps) else overlaps
+
+
+def _crop_origin(extent, crop_size, lo=None, hi=None):
+    """Random origin of a crop_size window on an axis of `extent` pixels.
+
+    The window covers [lo, hi] when it fits and lies inside it otherwise;
+    without a box it is anywhere. Past the end of a short axis the crop is
+    zero-padded, so its origin is then 0.
+    """
+    room = extent - crop_size
+    if room <= 0:
+        return 0
+    if lo is None:
+        return npr.randint(0, room + 1)
+    if hi - lo + 1 <= crop_size:
+        low, high = int(np.ceil(hi)) + 1 - crop_size, int(lo)
+    else:
+        low, high = int(np.ceil(lo)), int(hi) + 1 - crop_size
+    low, high = min(max(low, 0), room), min(max(high, 0), room)
+    return npr.randint(low, max(low, high) + 1)
+
+
+def _crop_boxes(gt_boxes, y0, x0, crop_size):
+    """gt_boxes shifted to a crop at (y0, x0) and clipped to it, and the visible fraction of each."""
+    boxes = gt_boxes.copy()
+    boxes[:, 0:4] -= np.array([x0, y0, x0, y0], dtype=boxes.dtype)
+    boxes[:, 0:4] = np.clip(boxes[:, 0:4], 0, crop_size - 1)
+    lengths = gt_boxes[:, 2:4] - gt_boxes[:, 0:2] + 1
+    visible = np.maximum(boxes[:, 2:4] - boxes[:, 0:2] + 1, 0)
+    # Per axis, against the crop for a box longer than it
+    visible[(boxes[:, 2:4] <= boxes[:, 0:2])] = 0
+    fraction = np.prod(visible / np.minimum(lengths, crop_size), axis=1)
+    return boxes, fraction
+
+
+@instrument.timed('random_crop')
+def _random_crop(blobs, crop_size, tries=10):
+    """Crop the blobs of get_minibatch to crop_size x crop_size, for a static input shape.
+
+    With probability FLAGS.train_crop_fg the crop is placed around a random
+    gt box, otherwise anywhere. The anchor and proposal target layers need
+    at least one gt box, so a crop anywhere is drawn again until it keeps
+    one, and after `tries` misses it is placed around a box after all. Gt
+    boxes are clipped to the crop and dropped when less than
+    FLAGS.train_crop_min_visible of them is inside. Images (and masks)
+    shorter than the crop are zero-padded.
+    """
+    gt_boxes = blobs['gt_boxes']
+    height, width = blobs['data'].shape[1:3]
+    min_visible = cfg.FLAGS.train_crop_min_visible
+    keep = None
+    if len(gt_boxes) and npr.rand() >= cfg.FLAGS.train_crop_fg:
+        for _ in range(tries):
+            y0, x0 = _crop_origin(height, crop_size), _crop_origin(width, crop_size)
+            boxes, fraction = _crop_boxes(gt_boxes, y0, x0, crop_size)
+            keep = fraction >= min_visible
+            if keep.any():
+                break
+            keep = None
+        else:
+            instrument.count('train_crop/fallbacks')
+    if keep is None:
+        if len(gt_boxes):
+            target = npr.randint(len(gt_boxes))
+            x1, y1, x2, y2 = gt_boxes[target, 0:4]
+            y0, x0 = _crop_origin(height, crop_size, y1, y2), _crop_origin(width, crop_size, x1, x2)
+        else:
+            y0, x0 = _crop_origin(height, crop_size), _crop_origin(width, crop_size)
+        boxes, fraction = _crop_boxes(gt_boxes, y0, x0, crop_size)
+        keep = fraction >= min_visible
+        if len(gt_boxes):
+            # Rounding aside, the target box is whole or fills the crop
+            keep[target] = True
+    blobs['data'] = crop_blob(blobs['data'], y0, x0, crop_size)
+    if 'mask' in blobs:
+        blobs['mask'] = crop_blob(blobs['mask'], y0, x0, crop_size)
+    blobs['gt_boxes'] = boxes[keep]
+    blobs['im_info'] = blobs['im_info'].copy()
+    blobs['im_info'][0, 0:2] = crop_size
+    if blobs['im_info'].shape[1] > 3:
+        # proposal_mask_layer clips the mask RoIs to this extent, in unscaled pixels
+        blobs['im_info'][0, 3:5] = np.minimum(crop_size, [height, width]) / blobs['im_info'][0, 2]
+    return blobs
+
+
+def _read_mask(entry):
+    mask = cv2.imread(entry['mask'])
+    mask = cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY)
+    ret, mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)
+    mask = np.expand_dims(mask, 2)
+    if entry['flipped']:
+        mask = mask[:, ::-1, :]
+    return mask
+
+
+@instrument.timed('mask_blob')
+def _get_mask_blob(roidb, scale_inds):
+    """_get_image_blob without decoding the images, whose features are cached.
+
+    The mask has the size of its image, so it gives the scale and the blob
+    shape; the image blob is zeros of that shape, only read for the anchors.
+    """
+    processed_mask = []
+    im_scales = []
+    mask_shapes = []
+    for i in range(len(roidb)):
+        mask = _read_mask(roidb[i])
+        mask_shapes.append(mask.shape[0:2])
+        target_size = cfg.FLAGS2["scales"][scale_inds[i]]
+        im_size_min = np.min(mask.shape[0:2])
+        im_size_max = np.max(mask.shape[0:2])
+        # Same scale as prep_im_for_blob
+        im_scale = float(target_size) / float(im_size_min)
+        if np.round(im_scale * im_size_max) > cfg.FLAGS.max_size:
+            im_scale = float(cfg.FLAGS.max_size) / float(im_size_max)
+        mask = cv2.resize(mask, None, None, fx=im_scale, fy=im_scale, interpolation=cv2.INTER_LINEAR)
+        im_scales.append(im_scale)
+        processed_mask.append(np.expand_dims(mask, 2))
+    mask_blob = mask_list_to_blob(processed_mask)
+    blob = np.zeros(mask_blob.shape[:3] + (3,), dtype=np.float32)
+    return blob, im_scales, mask_blob, mask_shapes
+
+
+@instrument.timed('augment')
+def _augment(augmenter, im, boxes, seed):
+    return augmenter(im, boxes, seed)
+
+
+@instrument.timed('image_blob')
+def _get_image_blob(roidb, scale_inds, augmenter=None, seeds=None):
     """Builds an input blob from the images in the roidb at the specified
-    scales.
+    scales, augmented by `augmenter` with `seeds` if given.
     """
     num_images = len(roidb)
     processed_ims = []
@@ -97,32 +267,13 @@ def _get_image_blob(roidb, scale_inds):
     if cfg.FLAGS.USE_MASK is True:
         for i in range(num_images):
             im = cv2.imread(roidb[i]['image'])
-            mask = cv2.imread(roidb[i]['mask'])
-            mask = cv2.cvtColor(mask, cv2.COLOR_BGR2GRAY)
-            ret, mask = cv2.threshold(mask, 127, 255, cv2.THRESH_BINARY)
+            mask = _read_mask(roidb[i])
             mask_shape = im.shape[0:2]
-            mask = np.expand_dims(mask, 2)
             if roidb[i]['flipped']:
                 im = im[:, ::-1, :]
-                mask = mask[:, ::-1, :]
-            # if roidb[i]['noised']:
-            #     row, col, ch = im.shape
-            #     for bb in roidb[i]['boxes']:
-            #         bcol = bb[2] - bb[0]
-            #         brow = bb[3] - bb[1]
-            #         mean = 0
-            #         var = 5
-            #         sigma = var ** 0.5
-            #         gauss = np.random.normal(mean, sigma, (brow, bcol, ch))
-            #         gauss = gauss.reshape(brow, bcol, ch)
-            #         im = im.astype(np.float32, copy=False)
-            #         im[bb[1]:bb[3], bb[0]:bb[2], :] = im[bb[1]:bb[3], bb[0]:bb[2], :] + gauss
-            #
-            # if roidb[i]['JPGed']:
-            #     for bb in roidb[i]['boxes']:
-            #         cv2.imwrite('JPGed.jpg', im[bb[1]:bb[3], bb[0]:bb[2], :], [cv2.IMWRITE_JPEG_QUALITY, 70])
-            #         bb_jpged = cv2.imread('JPGed.jpg')
-            #         im[bb[1]:bb[3], bb[0]:bb[2], :] = bb_jpged
+            if augmenter is not None:
+                # Boxes of a flipped entry are flipped already
+                im = _augment(augmenter, im, roidb[i]['boxes'], seeds[i])
 
             target_size = cfg.FLAGS2["scales"][scale_inds[i]]
             im, im_scale, mask = prep_im_for_blob(im, cfg.FLAGS2["pixel_means"], target_size, cfg.FLAGS.max_size, mask)
@@ -145,11 +296,8 @@ def _get_image_blob(roidb, scale_inds):
             im = cv2.imread(roidb[i]['image'])
             if roidb[i]['flipped']:
                 im = im[:, ::-1, :]
-            # if roidb[i]['JPGed']:
-            #     for bb in roidb[i]['boxes']:
-            #         cv2.imwrite('JPGed.jpg', im[bb[1]:bb[3], bb[0]:bb[2], :], [cv2.IMWRITE_JPEG_QUALITY, 70])
-            #         bb_jpged = cv2.imread('JPGed.jpg')
-            #         im[bb[1]:bb[3], bb[0]:bb[2], :] = bb_jpged
+            if augmenter is not None:
+                im = _augment(augmenter, im, roidb[i]['boxes'], seeds[i])
             target_size = cfg.FLAGS2["scales"][scale_inds[i]]
             im, im_scale = prep_im_for_blob(im, cfg.FLAGS2["pixel_means"], target_size, cfg.FLAGS.max_size)
             im_scales.append(im_scale)
@@ -0,0 +1,163 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Opt-in per-phase profiler for the training loop.
+
+Every step, the Python side of the loop is split into named phases (data
+layer, run, logging, snapshot) and kept in a rolling window. Every `every`
+steps the session run is traced with tf.RunMetadata (FULL_TRACE); the TF
+timeline and the Python phases of that step are merged into one Chrome
+trace (chrome://tracing, or ui.perfetto.dev) under `<output_dir>/profile`.
+Host-to-device feed copies show up in the trace as MEMCPYHtoD, the py_func
+layers as PyFunc ops. The traced op time of sampled steps is also summed
+per top-level scope (RGB stream, `noise` stream, heads, gradients, optimizer).
+
+With `every=0` every method returns right away, so the loop can call the
+profiler unconditionally.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import collections
+import json
+import os
+import time
+
+
+class _NullPhase(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.wall = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler._record(self.name, self.wall, time.perf_counter() - self.start)
+        return False
+
+
+def scope_of(node_name):
+    """Coarse group of a traced op: top-level scope, marking backward, optimizer and py_func ops."""
+    parts = node_name.split(':')[0].split('/')
+    if parts[0] == 'gradients' and len(parts) > 1:
+        return 'grad/' + parts[1]
+    if parts[0] in ('Momentum', 'Gradient_Mult', 'Grad_Accum'):
+        return 'optimizer'
+    if 'PyFunc' in parts[-1]:
+        return 'py_func/' + parts[0]
+    return parts[0]
+
+
+class StepProfiler(object):
+    """Rolling per-phase timings plus a full trace every `every` steps."""
+
+    def __init__(self, output_dir, every=0, window=100):
+        self.every = every
+        self.enabled = every > 0
+        self.trace_dir = os.path.join(output_dir, 'profile') if self.enabled else None
+        self._phases = collections.OrderedDict()
+        self._window = window
+        self._scope_time = collections.Counter()
+        self._traced_steps = 0
+        self._step = None
+        self._events = []
+        self._options = None
+        self._run_metadata = None
+        if self.enabled and not os.path.exists(self.trace_dir):
+            os.makedirs(self.trace_dir)
+
+    def begin(self, step):
+        """Start a step; the next run() of a sampled step is traced."""
+        if not self.enabled:
+            return
+        self._step = step
+        self._events = []
+        self._run_metadata = None
+        if step % self.every == 0:
+            import tensorflow as tf
+            self._options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+            self._run_metadata = tf.RunMetadata()
+
+    def phase(self, name):
+        """Context manager timing one Python phase of the current step."""
+        if not self.enabled:
+            return _NULL_PHASE
+        return _Phase(self, name)
+
+    def run_kwargs(self):
+        """`options`/`run_metadata` to pass to sess.run for this step (empty unless sampled)."""
+        if self._run_metadata is None:
+            return {}
+        return {'options': self._options, 'run_metadata': self._run_metadata}
+
+    def _record(self, name, wall, seconds):
+        if name not in self._phases:
+            self._phases[name] = collections.deque(maxlen=self._window)
+        self._phases[name].append(seconds)
+        if self._run_metadata is not None:
+            self._events.append((name, wall, seconds))
+
+    def end(self):
+        """Finish a step; writes the Chrome trace of a sampled step."""
+        if self._run_metadata is None:
+            return None
+        step_stats = self._run_metadata.step_stats
+        for dev_stats in step_stats.dev_stats:
+            for node in dev_stats.node_stats:
+                self._scope_time[scope_of(node.node_name)] += node.op_end_rel_micros - node.op_start_rel_micros
+        self._traced_steps += 1
+        path = os.path.join(self.trace_dir, 'step_{:d}.trace.json'.format(self._step))
+        with open(path, 'w') as f:
+            json.dump(self._chrome_trace(step_stats), f)
+        self._run_metadata = None
+        return path
+
+    def _chrome_trace(self, step_stats):
+        from tensorflow.python.client import timeline
+
+        trace = json.loads(timeline.Timeline(step_stats).generate_chrome_trace_format())
+        events = trace['traceEvents']
+        # TF timestamps are wall-clock microseconds, so Python phases line up with them
+        pid = 1 + max([e.get('pid', 0) for e in events if isinstance(e.get('pid'), int)] or [0])
+        events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'args': {'name': 'python phases'}})
+        for name, wall, seconds in self._events:
+            events.append({'name': name, 'cat': 'python', 'ph': 'X', 'pid': pid, 'tid': 0,
+                           'ts': int(wall * 1e6), 'dur': int(seconds * 1e6),
+                           'args': {'step': self._step}})
+        return trace
+
+    def breakdown(self):
+        """Mean seconds per phase over the rolling window."""
+        return collections.OrderedDict((name, sum(times) / len(times))
+                                       for name, times in self._phases.items() if times)
+
+    def summary(self, top=6):
+        """One-line phase breakdown (and traced op time per scope) for the loss display."""
+        if not self.enabled:
+            return ''
+        phases = self.breakdown()
+        total = sum(phases.values()) or 1.
+        line = 'phases (last {:d}): '.format(self._window) + ', '.join(
+            '{:s} {:.1f}ms ({:.0%})'.format(name, 1000 * t, t / total) for name, t in phases.items())
+        if self._traced_steps:
+            scopes = self._scope_time.most_common(top)
+            line += '\n traced ops per step: ' + ', '.join(
+                '{:s} {:.1f}ms'.format(name, us / 1000. / self._traced_steps) for name, us in scopes)
+        return line
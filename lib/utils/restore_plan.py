@@ -0,0 +1,176 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Single-pass restore of pretrained weights.
+
+A restore plan maps every graph variable to the checkpoint tensor it is
+loaded from, in one pass over the checkpoint index and the graph
+variables: renamed prefixes, excluded variables (e.g. the class-specific
+heads) and per-variable transforms (e.g. reversing the input channels of
+conv1 to go from RGB to BGR) are all resolved up front. The plan is then
+applied with a single RestoreV2 op and one grouped assign.
+
+Plans are cached as JSON under <data_dir>/cache/restore_plans, keyed by the
+checkpoint (path, size and mtime of its .index) and a signature of the
+graph variables and rules, so later runs do not open the checkpoint index
+at all.
+
+Rules are a dict of
+    exclude:    regexes on variable names that are never restored
+    renames:    (graph prefix, checkpoint prefix) pairs
+    transforms: {variable name: transform name}, see TRANSFORMS
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import hashlib
+import json
+import os
+import re
+
+import tensorflow as tf
+from tensorflow.python.ops import io_ops
+
+from lib.config import settings as cfg
+
+PLAN_VERSION = 1
+
+# name -> function applied to the checkpoint tensor before it is assigned
+TRANSFORMS = {
+    'reverse_channels': lambda t: tf.reverse(t, [2]),
+}
+
+
+def _var_name(var):
+    return var.op.name
+
+
+def graph_signature(variables, rules):
+    sha = hashlib.sha1()
+    for var in sorted(variables, key=_var_name):
+        sha.update('{}|{}|{}\n'.format(_var_name(var), var.get_shape().as_list(),
+                                       var.dtype.base_dtype.name).encode('utf-8'))
+    sha.update(json.dumps(rules, sort_keys=True).encode('utf-8'))
+    return sha.hexdigest()
+
+
+def checkpoint_signature(checkpoint):
+    checkpoint = os.path.abspath(checkpoint)
+    stat = os.stat(checkpoint + '.index')
+    key = '{}|{}|{}'.format(checkpoint, stat.st_size, int(stat.st_mtime))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class RestorePlan(object):
+    """Variable -> checkpoint tensor mapping, plus what was left out and why."""
+
+    def __init__(self, checkpoint, entries, excluded=(), missing=(), mismatched=()):
+        self.checkpoint = checkpoint
+        # (variable name, checkpoint tensor name, transform or None)
+        self.entries = [tuple(e) for e in entries]
+        self.excluded = list(excluded)
+        self.missing = list(missing)
+        # (variable name, graph shape, checkpoint shape)
+        self.mismatched = [tuple(m) for m in mismatched]
+
+    @classmethod
+    def build(cls, checkpoint, variables, rules):
+        """One pass over the checkpoint index and the graph variables."""
+        reader = tf.train.NewCheckpointReader(checkpoint)
+        shapes = reader.get_variable_to_shape_map()
+        exclude = [re.compile(pattern) for pattern in rules.get('exclude', ())]
+        renames = rules.get('renames', ())
+        transforms = rules.get('transforms', {})
+        entries, excluded, missing, mismatched = [], [], [], []
+        for var in variables:
+            name = _var_name(var)
+            if any(pattern.search(name) for pattern in exclude):
+                excluded.append(name)
+                continue
+            source = name
+            for graph_prefix, ckpt_prefix in renames:
+                if name.startswith(graph_prefix):
+                    source = ckpt_prefix + name[len(graph_prefix):]
+                    break
+            if source not in shapes:
+                missing.append(name)
+                continue
+            shape = var.get_shape().as_list()
+            if list(shapes[source]) != shape:
+                mismatched.append((name, shape, list(shapes[source])))
+                continue
+            entries.append((name, source, transforms.get(name)))
+        return cls(checkpoint, entries, excluded, missing, mismatched)
+
+    def to_dict(self):
+        return {'version': PLAN_VERSION, 'checkpoint': self.checkpoint, 'entries': self.entries,
+                'excluded': self.excluded, 'missing': self.missing, 'mismatched': self.mismatched}
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(d['checkpoint'], d['entries'], d['excluded'], d['missing'], d['mismatched'])
+
+    def apply(self, sess, variables, checkpoint=None):
+        """Restore every entry with a single RestoreV2 op and one grouped assign."""
+        if not self.entries:
+            return
+        by_name = dict((_var_name(var), var) for var in variables)
+        targets = [by_name[name] for name, _, _ in self.entries]
+        with tf.name_scope('restore_plan'):
+            with tf.device('/cpu:0'):
+                tensors = io_ops.restore_v2(checkpoint or self.checkpoint,
+                                            [source for _, source, _ in self.entries],
+                                            [''] * len(self.entries),
+                                            [var.dtype.base_dtype for var in targets])
+            assigns = []
+            for (_, _, transform), var, tensor in zip(self.entries, targets, tensors):
+                if transform is not None:
+                    tensor = TRANSFORMS[transform](tensor)
+                assigns.append(tf.assign(var, tensor))
+            sess.run(tf.group(*assigns))
+
+    def summary(self):
+        transformed = sum(1 for _, _, transform in self.entries if transform is not None)
+        renamed = sum(1 for name, source, _ in self.entries if name != source)
+        lines = ['Restore plan for {:s}: {:d} restored ({:d} renamed, {:d} transformed), '
+                 '{:d} excluded, {:d} not in checkpoint, {:d} shape mismatches'
+                 .format(self.checkpoint, len(self.entries), renamed, transformed,
+                         len(self.excluded), len(self.missing), len(self.mismatched))]
+        for name, shape, ckpt_shape in self.mismatched:
+            lines.append('  shape mismatch: {:s} {} in graph, {} in checkpoint'.format(name, shape, ckpt_shape))
+        return '\n'.join(lines)
+
+
+def _cache_dir():
+    return os.path.join(cfg.FLAGS2['data_dir'], 'cache', 'restore_plans')
+
+
+def load_plan(checkpoint, variables, rules, cache_dir=None):
+    """Cached plan for this checkpoint and graph, built (and cached) on a miss."""
+    cache_dir = cache_dir or _cache_dir()
+    key = checkpoint_signature(checkpoint)[:16] + '_' + graph_signature(variables, rules)[:16]
+    cache_file = os.path.join(cache_dir, 'plan_{:s}.json'.format(key))
+    if os.path.exists(cache_file):
+        with open(cache_file) as f:
+            d = json.load(f)
+        if d.get('version') == PLAN_VERSION:
+            return RestorePlan.from_dict(d)
+    plan = RestorePlan.build(checkpoint, variables, rules)
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    tmp_file = cache_file + '.tmp'
+    with open(tmp_file, 'w') as f:
+        json.dump(plan.to_dict(), f)
+    os.replace(tmp_file, cache_file)
+    return plan
+
+
+def restore(sess, checkpoint, variables, rules, cache_dir=None):
+    """Plan (cached) and apply the restore of `variables` from `checkpoint`; returns the plan."""
+    plan = load_plan(checkpoint, variables, rules, cache_dir)
+    plan.apply(sess, variables, checkpoint)
+    print(plan.summary())
+    return plan
@@ -0,0 +1,149 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+
+"""Evaluate every checkpoint of a training run with a single graph build.
+
+The TEST graph is built once per process and each checkpoint is restored
+into the same session in turn. Decoded test images and GT masks are kept in
+memory across checkpoints, up to FLAGS.sweep_cache_mb shared by all
+workers (a 4000x3000 image and its mask take ~48MB); images past it are
+decoded again for every checkpoint. With several workers, the checkpoints
+are split between processes that each hold one graph and its own cache.
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import glob
+import multiprocessing
+import os
+import re
+
+from lib.config import settings as cfg
+from lib.config.settings import get_output_dir
+from lib.utils.timer import Timer
+
+
+def find_checkpoints(path):
+    """List the checkpoint prefixes under a directory, ordered by iteration."""
+    if os.path.isfile(path + '.index'):
+        return [path]
+    prefixes = [p[:-len('.index')] for p in glob.glob(os.path.join(path, '*.ckpt.index'))]
+    return sorted(prefixes, key=checkpoint_iter)
+
+
+def checkpoint_iter(prefix):
+    m = re.search(r'_iter_(\d+)', os.path.basename(prefix))
+    return int(m.group(1)) if m else -1
+
+
+def _metric_row(prefix, results):
+    row = {'checkpoint': os.path.basename(prefix), 'iter': checkpoint_iter(prefix)}
+    for sink_name, summary in results.items():
+        for key, value in summary.items():
+            if isinstance(value, (int, float)) or hasattr(value, 'dtype'):
+                row[key] = float(value)
+    return row
+
+
+def sweep_checkpoints(sess, net, imdb, checkpoints, tag, sink_names, sink_kwargs, cache_bytes=None,
+                      batch_size=1):
+    """Restore each checkpoint into `sess` and evaluate it; returns one row per checkpoint.
+
+    At most `cache_bytes` of decoded images are kept between checkpoints.
+    With batch_size > 1 `net` must have been built with batch_size=None.
+    """
+    import tensorflow as tf
+    from lib.utils.eval_engine import CachedImageSource, build_sinks, test_net_sinks
+
+    saver = tf.train.Saver()
+    sinks = build_sinks(sink_names, **sink_kwargs)
+    images = CachedImageSource(imdb, with_gt=any(sink.needs_gt for sink in sinks), max_bytes=cache_bytes)
+    rows = []
+    timer = Timer()
+    for n, prefix in enumerate(checkpoints):
+        timer.tic()
+        print('Restoring {:s} ({:d}/{:d})'.format(prefix, n + 1, len(checkpoints)))
+        saver.restore(sess, prefix)
+        if n > 0:
+            sinks = build_sinks(sink_names, **sink_kwargs)
+        weights_filename = tag + '/' + os.path.basename(prefix)
+        results = test_net_sinks(sess, net, imdb, weights_filename, sinks, images=images, batch_size=batch_size)
+        rows.append(_metric_row(prefix, results))
+        timer.toc()
+        print('checkpoint {:s} done in {:.1f}s'.format(os.path.basename(prefix), timer.diff))
+    return rows
+
+
+def _sweep_worker(job):
+    """Entry point of a sweep worker process: build the graph once, evaluate its checkpoints.
+
+    The graph is the rfcn net of test_mask.py (resnetv3).
+    """
+    import tensorflow as tf
+    from lib.datasets.factory import get_imdb
+    from lib.nets.b1_fuse_1cbam_mask_1 import resnetv3
+
+    imdb_name, checkpoints, tag, sink_names, sink_kwargs, num_threads, cache_bytes, batch_size = job
+    imdb = get_imdb(imdb_name)
+    tfconfig = tf.ConfigProto(allow_soft_placement=True,
+                              intra_op_parallelism_threads=num_threads,
+                              inter_op_parallelism_threads=num_threads)
+    tfconfig.gpu_options.allow_growth = True
+    with tf.Session(config=tfconfig) as sess:
+        net = resnetv3(batch_size=None if batch_size > 1 else 1, num_layers=101)
+        net.create_architecture(sess, "TEST", imdb.num_classes, tag='default')
+        return sweep_checkpoints(sess, net, imdb, checkpoints, tag, sink_names, sink_kwargs, cache_bytes,
+                                 batch_size)
+
+
+def parallel_sweep(imdb_name, checkpoints, tag, sink_names, sink_kwargs, workers=1, batch_size=1):
+    """Split the checkpoints round-robin over `workers` processes."""
+    workers = max(1, min(workers, len(checkpoints)))
+    num_threads = max(1, multiprocessing.cpu_count() // workers)
+    # Every worker decodes and caches the whole test set for itself
+    cache_bytes = cfg.FLAGS.sweep_cache_mb * (1 << 20) // workers
+    jobs = [(imdb_name, checkpoints[w::workers], tag, sink_names, sink_kwargs, num_threads, cache_bytes, batch_size)
+            for w in range(workers)]
+    if workers == 1:
+        rows = _sweep_worker(jobs[0])
+    else:
+        pool = multiprocessing.get_context('spawn').Pool(workers)
+        try:
+            rows = [row for result in pool.map(_sweep_worker, jobs) for row in result]
+        finally:
+            pool.close()
+            pool.join()
+    return sorted(rows, key=lambda row: row['iter'])
+
+
+def format_table(rows):
+    """Render the per-checkpoint metrics as a fixed-width table."""
+    if not rows:
+        return ''
+    keys = ['checkpoint', 'iter'] + sorted(set(k for row in rows for k in row) - {'checkpoint', 'iter'})
+    width = max(len(row['checkpoint']) for row in rows)
+    lines = [' '.join([keys[0].ljust(width)] + ['{:>10s}'.format(k) for k in keys[1:]])]
+    for row in rows:
+        cells = [row['checkpoint'].ljust(width), '{:>10d}'.format(row['iter'])]
+        cells += ['{:>10.4f}'.format(row[k]) if k in row else '{:>10s}'.format('-') for k in keys[2:]]
+        lines.append(' '.join(cells))
+    return '\n'.join(lines)
+
+
+def write_table(imdb, tag, rows):
+    """Print the sweep table and store it next to the per-checkpoint outputs."""
+    table = format_table(rows)
+    print(table)
+    table_file = os.path.join(get_output_dir(imdb, tag), 'sweep.txt')
+    with open(table_file, 'w') as f:
+        f.write(table + '\n')
+    if not rows:
+        print('No checkpoint was evaluated')
+        return table_file
+    best = max(rows, key=lambda row: row.get('f1', float('-inf')))
+    if 'f1' in best:
+        print('Best F1: {:.4f} at {:s}'.format(best['f1'], best['checkpoint']))
+    return table_file
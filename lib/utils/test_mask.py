@@ -18,20 +18,24 @@ except ImportError:
 import os
 
 from lib.utils.timer import Timer
+from lib.utils import instrument
+from lib.utils.mask_codec import quantize
 # from utils.cython_nms import nms, nms_new
 from lib.utils.py_cpu_nms import py_cpu_nms as nms
 from lib.utils.blob import im_list_to_blob
 
 # from model.config import cfg, get_output_dir
-from lib.config.config import get_output_dir
-from lib.config import config as cfg
+from lib.config.settings import get_output_dir
+from lib.config import settings as cfg
 from lib.utils.bbox_transform import bbox_transform_inv
 
 
-def _get_image_blob(im):
+def _get_image_blob(im, im_scale=None):
     """Converts an image into a network input.
     Arguments:
       im (ndarray): a color image in BGR order
+      im_scale (float): use this scale instead of the test_scales/test_max_size
+        rule (e.g. 1.0 for tiles at native resolution)
     Returns:
       blob (ndarray): a data blob holding an image pyramid
       im_scale_factors (list): list of image scales (relative to im) used
@@ -47,12 +51,22 @@ def _get_image_blob(im):
     processed_ims = []
     im_scale_factors = []
 
-    for target_size in cfg.FLAGS2["test_scales"]:
-        im_scale = float(target_size) / float(im_size_min)
-        # Prevent the biggest axis from being more than MAX_SIZE
-        if np.round(im_scale * im_size_max) > cfg.FLAGS.test_max_size:
-            im_scale = float(cfg.FLAGS.test_max_size) / float(im_size_max)
-        im = cv2.resize(im_orig, None, None, fx=im_scale, fy=im_scale, interpolation=cv2.INTER_LINEAR)
+    if im_scale is not None:
+        scales = [im_scale]
+    else:
+        scales = []
+        for target_size in cfg.FLAGS2["test_scales"]:
+            scale = float(target_size) / float(im_size_min)
+            # Prevent the biggest axis from being more than MAX_SIZE
+            if np.round(scale * im_size_max) > cfg.FLAGS.test_max_size:
+                scale = float(cfg.FLAGS.test_max_size) / float(im_size_max)
+            scales.append(scale)
+
+    for im_scale in scales:
+        if im_scale == 1.0:
+            im = im_orig
+        else:
+            im = cv2.resize(im_orig, None, None, fx=im_scale, fy=im_scale, interpolation=cv2.INTER_LINEAR)
         im_scale_factors.append(im_scale)
         processed_ims.append(im)
 
@@ -62,10 +76,10 @@ def _get_image_blob(im):
     return blob, np.array(im_scale_factors)
 
 
-def _get_blobs(im):
+def _get_blobs(im, im_scale=None):
     """Convert an image and RoIs within that image into network inputs."""
     blobs = {}
-    blobs['data'], im_scale_factors = _get_image_blob(im)
+    blobs['data'], im_scale_factors = _get_image_blob(im, im_scale)
 
     return blobs, im_scale_factors
 
@@ -91,8 +105,38 @@ def _rescale_boxes(boxes, inds, scales):
     return boxes
 
 
-def im_detect(sess, net, im):
-    blobs, im_scales = _get_blobs(im)
+def _mask_detections(im_shape, im_scale, scores, bbox_pred, rois, y_preds, mask_data):
+    """Boxes and mask RoIs of one image in its original pixel coordinates."""
+    # Found and solved some bugs, I need a drink.
+    boxes = rois[:, 1:5] / im_scale
+    mask_boxes = mask_data[:, 1:5] / im_scale
+    scores = np.reshape(scores, [scores.shape[0], -1])
+    bbox_pred = np.reshape(bbox_pred, [bbox_pred.shape[0], -1])
+    # print(scores.shape, bbox_pred.shape, rois.shape, boxes.shape)
+    mask_scores = np.reshape(mask_data[:, 5], [mask_data[:, 5].shape[0], -1])
+    mask_boxes = np.reshape(mask_boxes, [mask_boxes.shape[0], -1])
+    maskcls_ind = np.reshape(mask_data[:, -1], [mask_data[:, -1].shape[0], -1])
+
+    if cfg.FLAGS.test_bbox_reg:
+        # Apply bounding-box regression deltas
+        box_deltas = bbox_pred
+        pred_boxes = bbox_transform_inv(boxes, box_deltas)
+
+        pred_boxes = _clip_boxes(pred_boxes, im_shape)
+        pred_mask_boxes = mask_boxes
+        # pred_boxes = _clip_boxes(boxes, im.shape)
+
+    else:
+        # Simply repeat the boxes, once for each class
+        pred_boxes = np.tile(boxes, (1, scores.shape[1]))
+        pred_mask_boxes = np.tile(mask_boxes, (1, mask_scores.shape[1]))
+    return scores, pred_boxes, maskcls_ind, pred_mask_boxes, mask_scores, y_preds, mask_data
+
+
+@instrument.timed('im_detect')
+def im_detect(sess, net, im, im_scale=None):
+    with instrument.scope('blobs'):
+        blobs, im_scales = _get_blobs(im, im_scale)
     assert len(im_scales) == 1, "Only single-image batch implemented"
 
     im_blob = blobs['data']
@@ -102,33 +146,20 @@ def im_detect(sess, net, im):
     if cfg.FLAGS.USE_MASK is True:
         blobs['im_info'] = np.array([[im_blob.shape[1], im_blob.shape[2], im_scales[0], im.shape[0], im.shape[1]]],
                                     dtype=np.float32)
-        scores1, scores, bbox_pred, rois, y_preds, mask_data = net.test_image(sess, blobs['data'],
-                                                                               blobs['im_info'])
-
-        # Found and solved some bugs, I need a drink.
-        boxes = rois[:, 1:5] / im_scales[0]
-        mask_boxes = mask_data[:, 1:5] / im_scales[0]
-        scores = np.reshape(scores, [scores.shape[0], -1])
-        bbox_pred = np.reshape(bbox_pred, [bbox_pred.shape[0], -1])
-        # print(scores.shape, bbox_pred.shape, rois.shape, boxes.shape)
-        mask_scores = np.reshape(mask_data[:, 5], [mask_data[:, 5].shape[0], -1])
-        mask_boxes = np.reshape(mask_boxes, [mask_boxes.shape[0], -1])
-        maskcls_ind = np.reshape(mask_data[:, -1], [mask_data[:, -1].shape[0], -1])
-
-        if cfg.FLAGS.test_bbox_reg:
-            # Apply bounding-box regression deltas
-            box_deltas = bbox_pred
-            pred_boxes = bbox_transform_inv(boxes, box_deltas)
-
-            pred_boxes = _clip_boxes(pred_boxes, im.shape)
-            pred_mask_boxes = mask_boxes
-            # pred_boxes = _clip_boxes(boxes, im.shape)
-
-        else:
-            # Simply repeat the boxes, once for each class
-            pred_boxes = np.tile(boxes, (1, scores.shape[1]))
-            pred_mask_boxes = np.tile(mask_boxes, (1, mask_scores.shape[1]))
-        return scores, pred_boxes, maskcls_ind, pred_mask_boxes, mask_scores, y_preds, mask_data
+        with instrument.scope('net'):
+            if cfg.FLAGS.cascade_thresh > 0:
+                scores1, scores, bbox_pred, rois, y_preds, mask_data = net.test_image_cascade(
+                    sess, blobs['data'], blobs['im_info'], cfg.FLAGS.cascade_thresh)
+            else:
+                scores1, scores, bbox_pred, rois, y_preds, mask_data = net.test_image(sess, blobs['data'],
+                                                                                       blobs['im_info'])
+        if mask_data is None:
+            # Skipped by the cascade: no mask RoIs, so an empty mask
+            instrument.count('im_detect/cascade_skipped')
+            y_preds = np.zeros((0, 1, 1, 1), dtype=np.float32)
+            mask_data = np.zeros((0, 7), dtype=np.float32)
+
+        return _mask_detections(im.shape, im_scales[0], scores, bbox_pred, rois, y_preds, mask_data)
     else:
 
         blobs['im_info'] = np.array([[im_blob.shape[1], im_blob.shape[2], im_scales[0]]], dtype=np.float32)
@@ -151,6 +182,54 @@ def im_detect(sess, net, im):
     return scores, pred_boxes
 
 
+
+def bucket_images(shapes, batch_size, bucket=64):
+    """Group image indices into batches of similar blob size.
+
+    `shapes` are the (height, width) of the scaled images. Images whose
+    sizes round up to the same multiple of `bucket` pixels share a bucket,
+    so a batch pads each image by less than `bucket` pixels per side.
+    """
+    buckets = {}
+    for i, (height, width) in enumerate(shapes):
+        key = (-(-int(height) // bucket), -(-int(width) // bucket))
+        buckets.setdefault(key, []).append(i)
+    batches = []
+    for key in sorted(buckets):
+        inds = buckets[key]
+        batches.extend(inds[j:j + batch_size] for j in range(0, len(inds), batch_size))
+    return batches
+
+
+@instrument.timed('im_detect_batch')
+def im_detect_batch(sess, net, images, batch_size=8, bucket=64):
+    """im_detect for a list of images, run `batch_size` at a time.
+
+    The network must have been built with batch_size=None. Images are
+    scaled as in im_detect, grouped by size (see bucket_images), zero-padded
+    to a common blob and carry their own im_info row; the RoIs and mask RoIs
+    of the batch are split back per image by their batch index. Returns one
+    im_detect result per image, in input order.
+    """
+    assert cfg.FLAGS.USE_MASK is True, 'Batched inference needs the mask branch'
+    with instrument.scope('blobs'):
+        prepared = [_get_image_blob(im) for im in images]
+    shapes = [blob.shape[1:3] for blob, _ in prepared]
+    results = [None] * len(images)
+    for inds in bucket_images(shapes, batch_size, bucket):
+        blob = im_list_to_blob([prepared[i][0][0] for i in inds])
+        im_info = np.array([[shapes[i][0], shapes[i][1], prepared[i][1][0], images[i].shape[0], images[i].shape[1]]
+                            for i in inds], dtype=np.float32)
+        with instrument.scope('net'):
+            _, scores, bbox_pred, rois, y_preds, mask_data = net.test_image(sess, blob, im_info)
+        instrument.count('im_detect_batch/images', len(inds))
+        for b, i in enumerate(inds):
+            roi_rows = rois[:, 0] == b
+            mask_rows = mask_data[:, 0] == b
+            results[i] = _mask_detections(images[i].shape, prepared[i][1][0], scores[roi_rows], bbox_pred[roi_rows],
+                                          rois[roi_rows], y_preds[mask_rows], mask_data[mask_rows])
+    return results
+
 def apply_nms(all_boxes, thresh):
     """Apply non-maximum suppression to all predicted boxes output by the
     test_net method.
@@ -193,6 +272,33 @@ def cal_precision_recall_mae(prediction, gt):
     return precision, recall,auc_score
 
 
+def cal_f1_auc_quantized(prediction, gt, bits=8):
+    """Max pixel F1 and ROC AUC of a soft mask over its 2**bits quantized thresholds.
+
+    Same quantities as cal_precision_recall_mae + cal_fmeasure, computed from
+    per-level pixel histograms instead of sorting every pixel score, so the
+    cost is two bincounts of the image. Thresholds are the quantization
+    levels (steps of 1/255 with 8 bits).
+    """
+    assert prediction.shape == gt.shape
+    levels = quantize(prediction, bits).ravel()
+    positive = gt.ravel() > 0.5
+    hist_all = np.bincount(levels, minlength=1 << bits)
+    hist_pos = np.bincount(levels[positive], minlength=1 << bits)
+    # Pixels at or above each threshold, from the highest level down
+    tp = np.cumsum(hist_pos[::-1]).astype(np.float64)
+    fp = np.cumsum((hist_all - hist_pos)[::-1]).astype(np.float64)
+    if tp[-1] == 0 or fp[-1] == 0:
+        raise ValueError('Only one class present in the ground truth mask, AUC is not defined')
+    precision = tp / np.maximum(tp + fp, 1)
+    recall = tp / tp[-1]
+    f1 = np.max((2 * precision * recall) / (precision + recall + 1e-10))
+    tpr = np.concatenate(([0.], recall))
+    fpr = np.concatenate(([0.], fp / fp[-1]))
+    auc_score = np.sum(np.diff(fpr) * (tpr[1:] + tpr[:-1]) / 2)
+    return f1, auc_score
+
+
 def cal_fmeasure(precision, recall):
 
     max_fmeasure = max([(2 * p * r) / (p + r+1e-10) for p, r in zip(precision, recall)])
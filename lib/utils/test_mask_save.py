@@ -26,6 +26,8 @@ from lib.utils.blob import im_list_to_blob
 from lib.config.config import get_output_dir
 from lib.config import config as cfg
 from lib.utils.bbox_transform import bbox_transform_inv
+from lib.utils.eval_engine import compose_panels
+from lib.utils.image_writer import AsyncImageWriter
 import tensorflow as tf
 
 
@@ -237,6 +239,7 @@ def test_net(sess, net, imdb, weights_filename, max_per_image=100, thresh=0.05):
         if cfg.FLAGS.USE_MASK is True:
             _t = {'im_detect': Timer(), 'mask': Timer()}
             # with open(os.path.join(output_dir,'my_log.txt'), 'w') as f:
+            writer = AsyncImageWriter('.png')
             with open('./save_result/my_log.txt', 'w') as f:
                 for i in range(num_images):
                     # print(output_dir)
@@ -293,24 +296,13 @@ def test_net(sess, net, imdb, weights_filename, max_per_image=100, thresh=0.05):
                         precision, recall,auc_score = cal_precision_recall_mae(mask_out, mask_gt)
                         f1 = cal_fmeasure(precision, recall)
                         f1=np.max(np.array(f1))
-                        m_pre = cv2.resize(mask_out, (512, 512))
-                        m_gt = cv2.resize(mask_gt, (512, 512))
-                        img_gt = cv2.resize(im, (512, 512))
-                        _, m_pre = cv2.threshold(m_pre * 255, 127, 255, cv2.THRESH_BINARY)
-                        _, m_gt = cv2.threshold(m_gt * 255, 127, 255, cv2.THRESH_BINARY)
-                        cv2.imwrite('./save_result/tmp_m_pre.png'.format(i), m_pre)
-                        cv2.imwrite('./save_result/tmp_m_gt.png'.format(i), m_gt)
-                        tmp_m_pre = cv2.imread('./save_result/tmp_m_pre.png')
-                        tmp_m_gt = cv2.imread('./save_result/tmp_m_gt.png')
-
-                        # mask_vis = _mask_vis(mask_out,mask_gt)
-
-                        image = np.concatenate(( img_gt, tmp_m_gt,tmp_m_pre), 1)
+                        # image | GT | prediction composed in memory, written in the background
+                        image = compose_panels(im, mask_gt, mask_out, (512, 512))
                         # image = np.concatenate(( m_pre, m_gt), 1)
                         # image = np.concatenate((img_gt, m_pre, m_gt), 1)
                         # cv2.imwrite('./save_result/tmp{}_f1_{}_auc_{}.png'.format(i,f1,auc_score), image)
                         # cv2.imwrite('./save_result/tmp{}_f1_{}_auc_{}_img.png'.format(i,f1,auc_score), img_gt)
-                        cv2.imwrite('./save_result/tmp{}.png'.format(i), image)
+                        writer.write('./save_result/tmp{}.png'.format(i), image)
                         # cv2.imwrite('./save_result/tmp{}_1.png'.format(i), img_gt)
                     print('F1 score per image：',f1)
                     print('AUV score per image：', auc_score)
@@ -351,6 +343,7 @@ def test_net(sess, net, imdb, weights_filename, max_per_image=100, thresh=0.05):
                 # det_file = os.path.join(output_dir, 'detections_{:f}.pkl'.format(10))
                 # with open(det_file, 'wb') as f:
                 #     pickle.dump(all_boxes, f, pickle.HIGHEST_PROTOCOL)
+            writer.close()
         else:
             _t = {'im_detect': Timer(), 'compute': Timer()}
             for i in range(num_images):
@@ -0,0 +1,260 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+"""
+Bulk scoring of unlabeled images, resumable and shardable.
+
+Images come from a directory (walked recursively) or a manifest file (one
+path per line). They are decoded ahead of the session by
+lib/utils/image_reader.py and run through the network, --batch at a time.
+Every image gets <output>/<relative path>.json (RoIs, scores, class; the
+extension stays in the name, a.jpg -> a.jpg.json) and its pasted mask, by
+default as <relative path>.mask.json in the 8-bit soft format of
+lib/utils/mask_codec.py (--mask_format rle binarizes it, png writes
+<relative path>_mask.png, 0-255).
+
+Finished images are appended to a progress manifest in the output
+directory, so a job that was killed is started again with the same
+command and skips them. --shard i/N scores the images whose path hashes to
+i (0 <= i < N), so N processes can split a folder without coordination:
+
+  python score.py --model .../resnet101_faster_rcnn_iter_4000.ckpt --input /data/unlabeled --output scores
+  python score.py ... --shard 0/4 & python score.py ... --shard 1/4 & ...
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import time
+import zlib
+
+import numpy as np
+import tensorflow as tf
+
+from lib.nets.b1_fuse_1cbam_mask_1 import resnetv3
+from lib.utils import instrument
+from lib.utils.eval_engine import predict_batch, predict_image
+from lib.utils.image_reader import AsyncImageReader
+from lib.utils.image_writer import AsyncImageWriter
+from lib.utils.mask_codec import quantize, write_mask
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff', '.bmp', '.webp')
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(description='Score a folder of unlabeled images')
+  parser.add_argument('--model', required=True, help='checkpoint to score with')
+  parser.add_argument('--input', required=True, help='image directory, or a text file with one image path per line')
+  parser.add_argument('--output', required=True, help='output tree of masks, RoI JSON and progress manifests')
+  parser.add_argument('--num_classes', default=2, type=int,
+                      help='number of classes of the checkpoint, background included')
+  parser.add_argument('--shard', default='0/1', help='i/N: score only the i-th of N shards (0-based)')
+  parser.add_argument('--batch', default=1, type=int, help='images per session run, grouped by size')
+  parser.add_argument('--mask_format', default='soft', choices=['soft', 'rle', 'png'],
+                      help='mask encoding: soft (8-bit packed), rle (binarized at 0.5) or png')
+  parser.add_argument('--readers', default=2, type=int, help='image decoding threads')
+  parser.add_argument('--prefetch', default=16, type=int, help='decoded images kept ahead of the session')
+  parser.add_argument('--retry_errors', action='store_true',
+                      help='score again the images that failed in an earlier run')
+  parser.add_argument('--cpu', action='store_true', help='hide the GPUs from TensorFlow')
+  args, _ = parser.parse_known_args()
+  return args
+
+
+def parse_shard(shard):
+  index, count = (int(v) for v in shard.split('/'))
+  if count < 1 or not 0 <= index < count:
+    raise ValueError('--shard must be i/N with 0 <= i < N, got {:s}'.format(shard))
+  return index, count
+
+
+def in_shard(key, index, count):
+  # crc32 of the relative path: stable across runs, machines and Python versions
+  return zlib.crc32(key.encode('utf-8')) % count == index
+
+
+def list_images(input):
+  """(key, path) of every image; the key is the path relative to the input (a manifest line for
+  a manifest, see manifest_key), with '/' separators."""
+  if os.path.isdir(input):
+    for root, dirs, files in os.walk(input):
+      dirs.sort()
+      for name in sorted(files):
+        if os.path.splitext(name)[1].lower() in IMAGE_EXTS:
+          path = os.path.join(root, name)
+          yield os.path.relpath(path, input).replace(os.sep, '/'), path
+  else:
+    base = os.path.dirname(os.path.abspath(input))
+    with open(input) as f:
+      for line in f:
+        line = line.strip()
+        if not line or line.startswith('#'):
+          continue
+        path = line if os.path.isabs(line) else os.path.join(base, line)
+        yield manifest_key(line), path
+
+
+def manifest_key(line):
+  """Key of a manifest path that stays inside the output tree.
+
+  A drive becomes a plain directory (C:/x/a.jpg -> C/x/a.jpg) and '..'
+  becomes '__', so the outputs of ../a.jpg and a.jpg do not collide.
+  """
+  drive, rest = os.path.splitdrive(os.path.normpath(line))
+  parts = (drive.replace(':', '') + '/' + rest).replace('\\', '/').split('/')
+  return '/'.join('__' if part == '..' else part for part in parts if part not in ('', '.'))
+
+
+class ProgressManifest(object):
+  """Append-only JSON lines, one per finished image, flushed as they are written."""
+
+  def __init__(self, path):
+    self.path = path
+    self.records = {}
+    if os.path.exists(path):
+      with open(path) as f:
+        for line in f:
+          try:
+            record = json.loads(line)
+          except ValueError:
+            # A line cut short when the job was killed
+            continue
+          self.records[record['key']] = record
+    self._file = open(path, 'a')
+
+  def add(self, record):
+    self.records[record['key']] = record
+    self._file.write(json.dumps(record) + '\n')
+    self._file.flush()
+
+  def close(self):
+    self._file.close()
+
+
+def output_paths(output_dir, key, mask_format):
+  # The extension stays in the name: a.jpg and a.png of one folder get their own files
+  stem = os.path.join(output_dir, *key.split('/'))
+  assert os.path.abspath(stem).startswith(os.path.join(os.path.abspath(output_dir), '')), \
+    'output of {} outside {}'.format(key, output_dir)
+  return stem + ('_mask.png' if mask_format == 'png' else '.mask.json'), stem + '.json'
+
+
+def is_done(record, output_dir, mask_format, retry_errors):
+  if record is None:
+    return False
+  if record['status'] == 'error':
+    return not retry_errors
+  # The mask may be written in the background; without it the image is scored again
+  return os.path.exists(output_paths(output_dir, record['key'], mask_format)[0])
+
+
+def write_json(path, data):
+  with open(path + '.tmp', 'w') as f:
+    json.dump(data, f)
+  os.replace(path + '.tmp', path)
+
+
+def predict(sess, net, ims, batch_size):
+  """Predictions for `ims`; an image that fails alone gets its exception instead."""
+  try:
+    if batch_size > 1:
+      return predict_batch(sess, net, ims, batch_size)
+    return [predict_image(sess, net, ims[0])]
+  except Exception:  # pylint: disable=broad-except
+    if len(ims) == 1:
+      raise
+  preds = []
+  for im in ims:
+    try:
+      preds.append(predict_image(sess, net, im))
+    except Exception as e:  # pylint: disable=broad-except
+      preds.append(e)
+  return preds
+
+
+def score_batch(sess, net, batch, args, writer, manifest):
+  with instrument.scope('predict'):
+    try:
+      preds = predict(sess, net, [im for _, _, im in batch], args.batch)
+    except Exception as e:  # pylint: disable=broad-except
+      preds = [e]
+  for (key, path, im), pred in zip(batch, preds):
+    if isinstance(pred, Exception):
+      manifest.add({'key': key, 'path': path, 'status': 'error', 'error': str(pred)})
+      continue
+    with instrument.scope('write'):
+      mask_path, json_path = output_paths(args.output, key, args.mask_format)
+      if not os.path.exists(os.path.dirname(mask_path)):
+        os.makedirs(os.path.dirname(mask_path))
+      mask_out = pred['mask_out'] if pred['mask_out'] is not None else np.zeros(im.shape[:2], dtype=np.float32)
+      if args.mask_format == 'png':
+        writer.write(mask_path, quantize(mask_out, 8))
+      else:
+        write_mask(mask_path, mask_out, fmt=args.mask_format)
+      scores = pred['mask_scores'].ravel()
+      write_json(json_path, {'path': path, 'width': int(im.shape[1]), 'height': int(im.shape[0]),
+                             'cls': pred['cls'], 'rois': pred['mask_boxes'].tolist(), 'scores': scores.tolist()})
+      manifest.add({'key': key, 'path': path, 'status': 'ok', 'cls': pred['cls'],
+                    'top_score': float(scores.max()) if scores.size else 0., 'num_rois': int(scores.size)})
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  index, count = parse_shard(args.shard)
+  if not os.path.exists(args.output):
+    os.makedirs(args.output)
+  manifest_name = 'progress.jsonl' if count == 1 else 'progress_shard{:d}of{:d}.jsonl'.format(index, count)
+  manifest = ProgressManifest(os.path.join(args.output, manifest_name))
+
+  shard = [(key, path) for key, path in list_images(args.input) if in_shard(key, index, count)]
+  todo = [(key, path) for key, path in shard
+          if not is_done(manifest.records.get(key), args.output, args.mask_format, args.retry_errors)]
+  print('Shard {:d}/{:d}: {:d} images, {:d} already scored, {:d} to go'.format(
+    index, count, len(shard), len(shard) - len(todo), len(todo)))
+
+  tfconfig = tf.ConfigProto(allow_soft_placement=True)
+  tfconfig.gpu_options.allow_growth = True
+  if args.cpu:
+    tfconfig.device_count['GPU'] = 0
+  sess = tf.Session(config=tfconfig)
+  net = resnetv3(batch_size=None if args.batch > 1 else 1, num_layers=101)
+  net.create_architecture(sess, 'TEST', args.num_classes, tag='default')
+  print('Loading model check point from {:s}'.format(args.model))
+  tf.train.Saver().restore(sess, args.model)
+
+  # Enough images per window for im_detect_batch to group them by size
+  window = 1 if args.batch <= 1 else 4 * args.batch
+  reader = AsyncImageReader(todo, workers=args.readers, max_queue=max(args.prefetch, window))
+  writer = AsyncImageWriter('.png')
+  start = time.perf_counter()
+  done = 0
+  batch = []
+  try:
+    for key, path, im in reader:
+      if im is None:
+        manifest.add({'key': key, 'path': path, 'status': 'error', 'error': 'could not read the image'})
+        done += 1
+      else:
+        batch.append((key, path, im))
+      if len(batch) >= window:
+        score_batch(sess, net, batch, args, writer, manifest)
+        done += len(batch)
+        batch = []
+        elapsed = time.perf_counter() - start
+        print('score: {:d}/{:d} {:.2f} img/s remaining time: {:.1f}m'.format(
+          done, len(todo), done / elapsed, (len(todo) - done) * elapsed / done / 60), end='\r')
+    if batch:
+      score_batch(sess, net, batch, args, writer, manifest)
+  finally:
+    reader.close()
+    writer.close()
+    manifest.close()
+    sess.close()
+
+  errors = sum(1 for key, _ in shard if manifest.records.get(key, {}).get('status') == 'error')
+  print('\nScored {:d} images in {:.1f}s, {:d} errors (see {:s})'.format(
+    len(todo), time.perf_counter() - start, errors, manifest.path))
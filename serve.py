@@ -0,0 +1,255 @@
+# --------------------------------------------------------
+# Tensorflow Faster R-CNN
+# Licensed under The MIT License [see LICENSE for details]
+# --------------------------------------------------------
+"""
+Long-running tamper localization server on localhost.
+
+The graph is built and the checkpoint restored once. Concurrent requests
+are grouped into micro-batches (lib/utils/batcher.py) and run through
+im_detect_batch; when more than --max_queue requests are waiting the server
+answers 503 instead of queueing more.
+
+  python serve.py --model output/.../resnet101_faster_rcnn_iter_4000.ckpt --port 8500 --max_batch 4
+
+  POST /detect   body: an encoded image (PNG, JPEG, ...)
+                 -> {"width", "height", "cls", "rois": [[x1, y1, x2, y2], ...], "scores": [...],
+                     "mask": base64 PNG of the pasted mask (0-255)}
+                 ?mask=soft or ?mask=rle returns the mask in lib/utils/mask_codec.py's JSON
+                 encodings instead, ?mask=0 leaves it out
+  GET  /health   -> {"status": "ok", "model": ...}
+  GET  /metrics  -> queue depth, batch size histogram, latency percentiles
+
+Local client, a few images posted concurrently:
+
+  python serve.py --client image1.jpg image2.jpg --url http://127.0.0.1:8500
+"""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import base64
+import json
+import os
+import threading
+import time
+try:
+  import queue
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+  from socketserver import ThreadingMixIn
+  from urllib.parse import urlparse, parse_qs
+  from urllib.request import Request, urlopen
+  from urllib.error import HTTPError
+except ImportError:
+  import Queue as queue
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+  from SocketServer import ThreadingMixIn
+  from urlparse import urlparse, parse_qs
+  from urllib2 import Request, urlopen, HTTPError
+
+import cv2
+import numpy as np
+
+from lib.utils.mask_codec import quantize, to_json
+
+
+def parse_args():
+  parser = argparse.ArgumentParser(description='Tamper localization inference server')
+  parser.add_argument('--model', default=None, help='checkpoint to serve')
+  parser.add_argument('--num_classes', default=2, type=int,
+                      help='number of classes of the checkpoint, background included')
+  parser.add_argument('--host', default='127.0.0.1', help='address to bind, localhost only by default')
+  parser.add_argument('--port', default=8500, type=int)
+  parser.add_argument('--max_batch', default=4, type=int, help='images per session run')
+  parser.add_argument('--max_wait_ms', default=10., type=float,
+                      help='how long the oldest request waits for others to join its batch')
+  parser.add_argument('--max_queue', default=32, type=int,
+                      help='requests waiting before the server answers 503')
+  parser.add_argument('--max_image_mb', default=32., type=float, help='largest accepted request body')
+  parser.add_argument('--timeout', default=120., type=float, help='seconds a request may wait for its result')
+  parser.add_argument('--cpu', action='store_true', help='hide the GPUs from TensorFlow')
+  parser.add_argument('--client', nargs='+', default=None,
+                      help='post these images to --url concurrently and print the responses')
+  parser.add_argument('--url', default='http://127.0.0.1:8500')
+  args, _ = parser.parse_known_args()
+  return args
+
+
+def load_model(args):
+  """Build the TEST graph and restore the checkpoint; returns (sess, net)."""
+  import tensorflow as tf
+  from lib.nets.b1_fuse_1cbam_mask_1 import resnetv3
+
+  tfconfig = tf.ConfigProto(allow_soft_placement=True)
+  tfconfig.gpu_options.allow_growth = True
+  if args.cpu:
+    tfconfig.device_count['GPU'] = 0
+  sess = tf.Session(config=tfconfig)
+  net = resnetv3(batch_size=None if args.max_batch > 1 else 1, num_layers=101)
+  net.create_architecture(sess, 'TEST', args.num_classes, tag='default')
+  if args.model:
+    print('Loading model check point from {:s}'.format(args.model))
+    tf.train.Saver().restore(sess, args.model)
+  else:
+    print('No --model given, serving random weights')
+    sess.run(tf.global_variables_initializer())
+  return sess, net
+
+
+def make_predict_fn(sess, net, max_batch):
+  from lib.utils.eval_engine import predict_batch, predict_image
+
+  def predict(ims):
+    if max_batch > 1:
+      return predict_batch(sess, net, ims, max_batch)
+    return [predict_image(sess, net, im) for im in ims]
+  return predict
+
+
+def encode_response(im, pred, mask_format='png'):
+  response = {'width': int(im.shape[1]),
+              'height': int(im.shape[0]),
+              'cls': pred['cls'],
+              'rois': pred['mask_boxes'].tolist(),
+              'scores': pred['mask_scores'].ravel().tolist()}
+  if mask_format == '0':
+    return response
+  # No RoI with a positive score: an empty mask
+  mask_out = pred['mask_out'] if pred['mask_out'] is not None else np.zeros(im.shape[:2], dtype=np.float32)
+  if mask_format == 'png':
+    _, png = cv2.imencode('.png', quantize(mask_out, 8))
+    response['mask'] = base64.b64encode(png.tobytes()).decode('ascii')
+  else:
+    response['mask'] = to_json(mask_out, fmt=mask_format)
+  return response
+
+
+class InferenceServer(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+  def __init__(self, address, batcher, model, max_body, timeout):
+    HTTPServer.__init__(self, address, InferenceHandler)
+    self.batcher = batcher
+    self.model = model
+    self.max_body = max_body
+    self.request_timeout = timeout
+    self.started = time.time()
+
+
+class InferenceHandler(BaseHTTPRequestHandler):
+  server_version = 'EMUNetServer/1.0'
+
+  def _send_json(self, code, body, headers=()):
+    data = json.dumps(body).encode('utf-8')
+    self.send_response(code)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(data)))
+    for key, value in headers:
+      self.send_header(key, value)
+    self.end_headers()
+    self.wfile.write(data)
+
+  def do_GET(self):
+    path = urlparse(self.path).path
+    if path == '/health':
+      self._send_json(200, {'status': 'ok', 'model': self.server.model,
+                            'uptime_s': time.time() - self.server.started})
+    elif path == '/metrics':
+      self._send_json(200, self.server.batcher.metrics())
+    else:
+      self._send_json(404, {'error': 'unknown path {:s}'.format(path)})
+
+  def do_POST(self):
+    url = urlparse(self.path)
+    if url.path != '/detect':
+      self._send_json(404, {'error': 'unknown path {:s}'.format(url.path)})
+      return
+    mask_format = parse_qs(url.query).get('mask', ['png'])[0]
+    if mask_format not in ('png', 'soft', 'rle', '0'):
+      self._send_json(400, {'error': 'mask must be png, soft, rle or 0'})
+      return
+    length = int(self.headers.get('Content-Length') or 0)
+    if length <= 0:
+      self._send_json(400, {'error': 'empty body, expected an encoded image'})
+      return
+    if length > self.server.max_body:
+      self._send_json(413, {'error': 'body larger than {:d} bytes'.format(self.server.max_body)})
+      return
+    im = cv2.imdecode(np.frombuffer(self.rfile.read(length), dtype=np.uint8), cv2.IMREAD_COLOR)
+    if im is None:
+      self._send_json(400, {'error': 'body is not a decodable image'})
+      return
+    try:
+      request = self.server.batcher.submit(im)
+    except queue.Full:
+      self._send_json(503, {'error': 'queue full'}, headers=[('Retry-After', '1')])
+      return
+    try:
+      pred = request.wait(self.server.request_timeout)
+    except Exception as e:  # pylint: disable=broad-except
+      self._send_json(500, {'error': str(e)})
+      return
+    self._send_json(200, encode_response(im, pred, mask_format))
+
+  def log_request(self, code='-', size='-'):
+    # One line per request is too much at serving rates; errors still go through log_error
+    pass
+
+
+def post_image(url, path, timeout=300):
+  """POST one image file to `url`/detect; returns (status, decoded JSON)."""
+  with open(path, 'rb') as f:
+    body = f.read()
+  request = Request(url.rstrip('/') + '/detect', data=body, headers={'Content-Type': 'application/octet-stream'})
+  try:
+    response = urlopen(request, timeout=timeout)
+    return response.getcode(), json.loads(response.read().decode('utf-8'))
+  except HTTPError as e:
+    return e.code, json.loads(e.read().decode('utf-8'))
+
+
+def run_client(url, paths):
+  results = [None] * len(paths)
+
+  def post(i):
+    start = time.perf_counter()
+    status, body = post_image(url, paths[i])
+    results[i] = (status, body, time.perf_counter() - start)
+
+  threads = [threading.Thread(target=post, args=(i,)) for i in range(len(paths))]
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+  for path, (status, body, seconds) in zip(paths, results):
+    if status == 200:
+      print('{:s}: {:d} {:.0f}ms cls {:d}, {:d} rois, top score {:.3f}'.format(
+        path, status, seconds * 1000, body['cls'], len(body['rois']), max(body['scores'] or [0.])))
+    else:
+      print('{:s}: {:d} {:s}'.format(path, status, body.get('error', '')))
+  print(json.dumps(json.loads(urlopen(url.rstrip('/') + '/metrics').read().decode('utf-8')), indent=2))
+
+
+if __name__ == '__main__':
+  args = parse_args()
+  if args.client:
+    run_client(args.url, args.client)
+  else:
+    from lib.utils.batcher import MicroBatcher
+
+    sess, net = load_model(args)
+    batcher = MicroBatcher(make_predict_fn(sess, net, args.max_batch), max_batch=args.max_batch,
+                           max_wait=args.max_wait_ms / 1000., max_queue=args.max_queue)
+    server = InferenceServer((args.host, args.port), batcher, os.path.basename(args.model or 'random'),
+                             int(args.max_image_mb * 1024 * 1024), args.timeout)
+    print('Serving on http://{:s}:{:d} (max_batch {:d}, max_wait {:.0f}ms, max_queue {:d})'.format(
+      args.host, args.port, args.max_batch, args.max_wait_ms, args.max_queue))
+    try:
+      server.serve_forever()
+    except KeyboardInterrupt:
+      pass
+    finally:
+      server.server_close()
+      batcher.close()
+      sess.close()
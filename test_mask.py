@@ -8,7 +8,9 @@ from __future__ import division
 from __future__ import print_function
 
 # import _init_paths
-from lib.utils.test_mask import test_net
+from lib.utils.eval_engine import test_net_sinks, build_sinks
+from lib.utils.sweep import find_checkpoints, parallel_sweep, write_table
+from lib.utils import instrument
 from lib.config import config as cfg
 from lib.datasets.factory import get_imdb
 import argparse
@@ -78,6 +80,30 @@ def parse_args():
   parser.add_argument('--tag', dest='tag',
                         help='tag of the model',
                         default='', type=str)
+  parser.add_argument('--sinks', dest='sinks',
+                      help='comma separated outputs of the single inference pass: ' +
+                           'f1 (pixel F1/AUC), ap (box AP), vis (visualizations), ' +
+                           'excel (spreadsheet rows), dump (raw predictions), ' +
+                           'cascade (skip rate and accuracy cost of --cascade_thresh)',
+                      default='f1', type=str)
+  parser.add_argument('--vis_format', dest='vis_format',
+                      help='image format of the vis sink (png, jpg, webp)',
+                      default='png', type=str)
+  parser.add_argument('--vis_quality', dest='vis_quality',
+                      help='jpg/webp quality or png compression level of the vis sink',
+                      default=None, type=int)
+  parser.add_argument('--vis_scale', dest='vis_scale',
+                      help='downscale factor of the vis panels',
+                      default=1.0, type=float)
+  parser.add_argument('--sweep', dest='sweep',
+                      help='evaluate every checkpoint in this directory with one graph build',
+                      default=None, type=str)
+  parser.add_argument('--workers', dest='workers',
+                      help='number of processes sharing the checkpoints of a sweep',
+                      default=1, type=int)
+  parser.add_argument('--batch', dest='batch',
+                      help='images per session run, grouped by size (rfcn only)',
+                      default=1, type=int)
   parser.add_argument('--net', dest='net',
                       help='vgg16, res50, res101, res152',
                       # default='res101', type=str)
@@ -90,11 +116,14 @@ def parse_args():
   #   parser.print_help()
   #   sys.exit(1)
 
-  args = parser.parse_args()
+  # --name=value settings (lib/config/settings.py) are parsed by the settings module
+  args, _ = parser.parse_known_args()
   return args
 
 if __name__ == '__main__':
   args = parse_args()
+  if args.batch > 1 and args.net != 'rfcn':
+    sys.exit('--batch {:d} needs --net rfcn (the only net built with a variable batch size)'.format(args.batch))
   # print(444)
   print('Called with args:')
   print(args)
@@ -121,6 +150,21 @@ if __name__ == '__main__':
   imdb = get_imdb(args.imdb_name)
   imdb.competition_mode(args.comp_mode)
 
+  sink_kwargs = dict(max_per_image=args.max_per_image, thresh=0,
+                     vis_format=args.vis_format, vis_quality=args.vis_quality, vis_scale=args.vis_scale)
+
+  if args.sweep:
+    if args.net != 'rfcn':
+      sys.exit('--sweep builds the rfcn net only, not {:s}'.format(args.net))
+    checkpoints = find_checkpoints(args.sweep)
+    if not checkpoints:
+      sys.exit('No checkpoints (*.ckpt.index) found under {:s}'.format(args.sweep))
+    print('Sweeping {:d} checkpoints with {:d} worker(s)'.format(len(checkpoints), args.workers))
+    rows = parallel_sweep(args.imdb_name, checkpoints, tag, args.sinks, sink_kwargs, workers=args.workers,
+                          batch_size=args.batch)
+    write_table(imdb, tag, rows)
+    sys.exit(0)
+
   tfconfig = tf.ConfigProto(allow_soft_placement=True)
   tfconfig.gpu_options.allow_growth=True
 
@@ -134,7 +178,7 @@ if __name__ == '__main__':
   elif args.net == 'res101':
     net = resnetv1(batch_size=1, num_layers=101)
   elif args.net == 'rfcn':
-    net = resnetv3(batch_size=1, num_layers=101)
+    net = resnetv3(batch_size=None if args.batch > 1 else 1, num_layers=101)
   else:
     raise NotImplementedError
 
@@ -159,6 +203,10 @@ if __name__ == '__main__':
     sess.run(tf.global_variables_initializer())
     print('Loaded.')
 
-  test_net(sess, net, imdb, filename, max_per_image=args.max_per_image,thresh=0)
+  instrument.enabled = cfg.FLAGS.instrument
+  if instrument.enabled:
+    instrument.report_at_exit(os.path.join(cfg.get_output_dir(imdb, filename), 'instrument.json'))
+  sinks = build_sinks(args.sinks, **sink_kwargs)
+  test_net_sinks(sess, net, imdb, filename, sinks, batch_size=args.batch)
 
   sess.close()
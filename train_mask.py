@@ -11,13 +11,21 @@ from lib.datasets.imdb import imdb as imdb2
 from lib.layer_utils.roi_data_layer import RoIDataLayer
 from lib.nets.b1_fuse_1cbam_mask_1 import resnetv3
 from lib.utils.timer import Timer
-import xlwt,xlrd,os
-from xlutils.copy import copy
+from lib.utils.metrics_log import MetricsLog
+from lib.utils.checkpoint import AsyncCheckpointer
+from lib.utils.profiler import StepProfiler
+from lib.utils import instrument
+from lib.utils import restore_plan
+from lib.utils import feature_cache
+from lib.utils.feature_cache import FeatureCache
+from lib.utils.data_parallel import GradientAllReduce, accumulate_gradients, apply_mean, broadcast_variables, launch
 try:
     import cPickle as pickle
 except ImportError:
     import pickle
+import multiprocessing
 import os
+import re
 
 
 def get_training_roidb(imdb):
@@ -59,8 +67,24 @@ def combined_roidb(imdb_names):
     return imdb, roidb
 
 
+def run_worker(rank, num_workers, comm, settings):
+    """One data-parallel training process (lib/utils/data_parallel.py)."""
+    cfg.settings.update(settings)
+    # Same graph seed, so the same initial weights; different sampling per worker
+    np.random.seed(cfg.FLAGS.rng_seed + rank)
+    train = Train(rank, num_workers, comm)
+    train.train()
+
+
 class Train:
-    def __init__(self):
+    def __init__(self, rank=0, num_workers=1, comm=None):
+        # Data-parallel training: rank 0 of num_workers processes is the one that logs,
+        # snapshots and writes the output directory
+        self.rank = rank
+        self.num_workers = num_workers
+        self.comm = comm
+        self.chief = rank == 0
+        self.allreduce = None
 
         # Create network
         if cfg.FLAGS.network == 'vgg16':
@@ -82,17 +106,46 @@ class Train:
         # self.imdb, self.roidb = combined_roidb("Nist16_train_all_single")
 
 
-        self.data_layer = RoIDataLayer(self.roidb, self.imdb.num_classes)
+        # Head-only fine-tuning: the frozen backbone's net_conv4 maps are computed once per
+        # (image, flip, scale) and read back from a float16 cache (lib/utils/feature_cache.py)
+        self.feature_cache = None
+        if cfg.FLAGS.head_only:
+            assert cfg.FLAGS.USE_MASK is True, 'head_only trains the mask network'
+            assert num_workers == 1, 'head_only fills the feature cache from a single process'
+            assert not cfg.FLAGS.augment, 'cached features are those of the images as read, without augmentation'
+            assert not cfg.FLAGS.train_crop, 'cached features are those of whole images'
+            self.feature_cache = FeatureCache(feature_cache.cache_dir(restore_plan.checkpoint_signature(self.tfmodel)))
+            print('Feature cache {:s}: {:d} maps, {:.1f}GB'.format(
+                self.feature_cache.path, len(self.feature_cache), self.feature_cache.nbytes() / 1024. ** 3))
+        shard = (rank, num_workers) if num_workers > 1 else None
+        self.data_layer = RoIDataLayer(self.roidb, self.imdb.num_classes, feature_cache=self.feature_cache,
+                                       shard=shard, seed=cfg.FLAGS.rng_seed)
+        self.minloss = 100
+        self.output_dir = None
+        if not self.chief:
+            instrument.enabled = False
+            return
         # self.output_dir = cfg.get_output_dir(self.imdb, 'v12_0.3_momentum_0.001_40k_7')
         # output_dir = 'res_align_rpnsam_b1_3_c_xin7'
         self.output_dir = cfg.get_output_dir(self.imdb, output_dir)
-        self.minloss = 100
-        self.loss_excel_path = os.path.join(self.output_dir, output_dir+'.xls')
+        # Frozen copy of the settings this run was started with, next to its checkpoints
+        cfg.settings.save(os.path.join(self.output_dir, 'settings.json'))
+        # Loss mean/min/max per display window; `python -m lib.utils.metrics_log <csv>` exports an .xls
+        self.loss_log_path = os.path.join(self.output_dir, output_dir + '_loss.csv')
+        # Data layer / py_func timings (lib/utils/instrument.py), printed and saved at exit
+        instrument.enabled = cfg.FLAGS.instrument
+        if instrument.enabled:
+            instrument.report_at_exit(os.path.join(self.output_dir, 'instrument.json'))
     def train(self):
 
         # Create session
         tfconfig = tf.ConfigProto(allow_soft_placement=True)  # allow_soft_placement = true : select GPU automatically
         tfconfig.gpu_options.allow_growth = True
+        if self.num_workers > 1:
+            # Share the cores between the workers instead of every session sizing its pools to all of them
+            threads = max(1, multiprocessing.cpu_count() // self.num_workers)
+            tfconfig.intra_op_parallelism_threads = threads
+            tfconfig.inter_op_parallelism_threads = threads
         # tfconfig.gpu_options.per_process_gpu_memory_fraction = 0.10
         sess = tf.Session(config=tfconfig)
 
@@ -109,7 +162,14 @@ class Train:
             momentum = cfg.FLAGS.momentum
             optimizer = tf.train.MomentumOptimizer(lr, momentum)
 
-            gvs = optimizer.compute_gradients(loss)
+            var_list = None
+            if self.feature_cache is not None:
+                # The RPN, RCNN and mask heads only; gradients never reach the fed net_conv4
+                backbone = [re.compile(pattern) for pattern in self.net.backbone_patterns()]
+                trainable = tf.trainable_variables()
+                var_list = [v for v in trainable if not any(pattern.search(v.op.name) for pattern in backbone)]
+                print('Head-only training: {:d} of {:d} trainable variables'.format(len(var_list), len(trainable)))
+            gvs = optimizer.compute_gradients(loss, var_list=var_list)
 
             # Double bias
             # Double the gradient of the bias if set
@@ -126,12 +186,27 @@ class Train:
                 for i, (g, v) in enumerate(final_gvs):
                     if g is not None:
                         final_gvs[i] = (tf.clip_by_norm(g, 10), v)
-                train_op = optimizer.apply_gradients(final_gvs)
             else:
-                train_op = optimizer.apply_gradients(gvs)
+                final_gvs = gvs
+            # With iter_size > 1 or several workers train_op only accumulates; apply_op updates
+            # once per iter_size images (per worker)
+            self.accumulators = []
+            if cfg.FLAGS.iter_size > 1 or self.num_workers > 1:
+                train_op, self.apply_op, self.mean_gvs, self.accumulators = accumulate_gradients(
+                    optimizer, final_gvs, cfg.FLAGS.iter_size)
+            else:
+                train_op = optimizer.apply_gradients(final_gvs)
 
             # We will handle the snapshots ourselves
             self.saver = tf.train.Saver(max_to_keep=100000)
+            # Regular snapshots are copied to host and written by a background thread,
+            # pruned by the snapshot_keep_* settings
+            self.checkpointer = None
+            if cfg.FLAGS.snapshot_async and self.chief:
+                self.checkpointer = AsyncCheckpointer(
+                    tf.global_variables(), self.output_dir,
+                    keep_last=cfg.FLAGS.snapshot_keep_last, keep_every=cfg.FLAGS.snapshot_keep_every,
+                    keep_best=cfg.FLAGS.snapshot_keep_best)
             # Write the train and validation information to tensorboard
             # writer = tf.summary.FileWriter('default/', sess.graph)
             # valwriter = tf.summary.FileWriter(self.tbvaldir)
@@ -142,24 +217,14 @@ class Train:
         print('Loading initial model weights from {:s}'.format(self.tfmodel))
         variables = tf.global_variables()
         # Initialize all variables first
-        sess.run(tf.variables_initializer(variables, name='init'))
+        sess.run(tf.variables_initializer(variables + self.accumulators, name='init'))
         # var_keep_dic = self.get_variables_in_checkpoint_file(cfg.FLAGS.pretrained_model)
 
 
-        var_keep_dic = self.get_variables_in_checkpoint_file(self.tfmodel)
-        # Get the variables to restore, ignorizing the variables to fix
-        variables_to_restore = self.net.get_variables_to_restore(variables, var_keep_dic)
-
-        restorer = tf.train.Saver(variables_to_restore)
-        # restorer.restore(sess, cfg.FLAGS.pretrained_model)
-        restorer.restore(sess, self.tfmodel)
+        # Restore everything the checkpoint has in one pass (the RGB->BGR swap of conv1
+        # included, see net.restore_rules); the plan is cached per checkpoint and graph
+        restore_plan.restore(sess, self.tfmodel, variables, self.net.restore_rules())
         print('Loaded.')
-        # Need to fix the variables before loading, so that the RGB weights are changed to BGR
-        # For VGG16 it also changes the convolutional weights fc6 and fc7 to
-        # fully connected weights
-        # self.net.fix_variables(sess, cfg.FLAGS.pretrained_model)
-        self.net.fix_variables(sess, self.tfmodel)
-        print('Fixed.')
 
         
         sess.run(tf.assign(lr, cfg.FLAGS.learning_rate))
@@ -174,12 +239,19 @@ class Train:
         # decay_rate = 0.96
         # global_step = tf.Variable(tf.constant(0))
         # lr = tf.train.exponential_decay(cfg.FLAGS .learning_rate,global_step,decay_steps,decay_rate, staircase=True)
-        loss_total = 0
-        loss_rpnbox = 0
-        loss_rpncls = 0
-        loss_box1 = 0
-        loss_cls1 = 0
-        loss_mask = 0
+        loss_fields = ['rpn_loss_cls', 'rpn_loss_box', 'loss_cls', 'loss_box', 'total_loss']
+        if cfg.FLAGS.USE_MASK is True:
+            loss_fields.insert(4, 'loss_mask')
+        if self.num_workers > 1:
+            # The mean gradients and losses of every worker go through one buffer
+            size = sum(int(np.prod(v.get_shape().as_list())) for _, v in self.mean_gvs) + len(loss_fields)
+            self.allreduce = GradientAllReduce(self.rank, self.num_workers, size, self.comm)
+            # Every worker starts from rank 0's weights
+            broadcast_variables(sess, self.allreduce, [v for _, v in self.mean_gvs])
+        metrics = MetricsLog(self.loss_log_path, loss_fields) if self.chief else None
+        window = None
+        profiler = StepProfiler(self.output_dir, every=cfg.FLAGS.profile_every if self.chief else 0,
+                                window=cfg.FLAGS.display)
         print('START TRAINING: ...')
         while iter < cfg.FLAGS.max_iters + 1:
             # Learning rate
@@ -209,24 +281,19 @@ class Train:
             #     sess.run(tf.assign(lr, cfg.FLAGS.learning_rate * 0.1))
             # learing_rate1 = tf.train.exponential_decay(
             #     learning_rate=0.5, global_step=num_epoch, decay_steps=10, decay_rate=0.9, staircase=True)
-            if iter == 1:
-                # 创建一个workbook 设置编码
-                workbook = xlwt.Workbook(encoding = 'utf-8')
-                # 创建一个worksheet
-                worksheet = workbook.add_sheet('My Worksheet')
-                worksheet.write(0,0, label = 'loss_rpncls')
-                worksheet.write(0,1, label = 'loss_rpnbox')
-                worksheet.write(0,2, label = 'loss_cls')
-                worksheet.write(0,3, label = 'loss_box')
-                worksheet.write(0,4, label = 'loss_mask')
-                worksheet.write(0,5, label = 'loss_total')
-                worksheet.write(0,6, label = 'iteration')
-
-                # 保存
-                workbook.save(self.loss_excel_path)
+            profiler.begin(iter)
             timer.tic()
-            # Get training data, one batch at a time
-            blobs = self.data_layer.forward()
+            # One image per run; iterations, the LR schedule, snapshots and the displayed
+            # losses (means over the images) count updates, i.e. iter_size images each
+            losses = [self.train_image(sess, train_op, profiler, profiler.run_kwargs() if k == 0 else {})
+                      for k in range(cfg.FLAGS.iter_size)]
+            losses = np.mean(losses, axis=0)
+            if self.allreduce is not None:
+                with profiler.phase('allreduce'):
+                    losses = apply_mean(sess, self.allreduce, self.apply_op, self.mean_gvs, losses)
+            elif cfg.FLAGS.iter_size > 1:
+                with profiler.phase('apply'):
+                    sess.run(self.apply_op)
             # print(1,blobs['data'].shape)
             # print(2,blobs['gt_boxes'])
             # print(la)
@@ -245,39 +312,43 @@ class Train:
             #     writer.add_run_metadata(run_metadata, 'step%03d' % iter)
             #     writer.add_summary(summary, iter)
             # else:
+            if not self.chief:
+                # The other workers only compute gradients; rank 0 logs and snapshots
+                continue
             if cfg.FLAGS.USE_MASK is True:
-                rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss_mask, total_loss = \
-                    self.net.train_step_with_mask(sess, blobs, train_op)
+                rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss_mask, total_loss = losses
+                metrics.add(rpn_loss_cls=rpn_loss_cls, rpn_loss_box=rpn_loss_box, loss_cls=loss_cls,
+                            loss_box=loss_box, loss_mask=loss_mask, total_loss=total_loss)
             else:
-                rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, total_loss = self.net.train_step(
-                sess, blobs, train_op)
-            loss_total = loss_total + total_loss
-            loss_rpnbox = loss_rpnbox + rpn_loss_box
-            loss_rpncls = loss_rpncls + rpn_loss_cls
-            loss_cls1 = loss_cls1 + loss_cls
-            loss_box1 = loss_box1 + loss_box
+                rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, total_loss = losses
+                metrics.add(rpn_loss_cls=rpn_loss_cls, rpn_loss_box=rpn_loss_box, loss_cls=loss_cls,
+                            loss_box=loss_box, total_loss=total_loss)
             timer.toc()
 
             # Display training information
             if iter % (cfg.FLAGS.display) == 0:
-                if cfg.FLAGS.USE_MASK is True:
-
-                    print('iter: %d / %d, total loss: %.6f\n >>> rpn_loss_cls: %.6f\n '
-                          '>>> rpn_loss_box: %.6f\n >>> loss_cls: %.6f\n >>> loss_box: %.6f\n >>> loss_mask: %.6f\n ' % \
-                          (iter, cfg.FLAGS.max_iters, total_loss, rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss_mask,
-                           ))
-                    print('speed: {:.3f}s / iter'.format(timer.average_time))
-                    print('remaining time: {:.3f}h\n'.format(((cfg.FLAGS.max_iters - iter) * timer.average_time) / 3600))
-                else:
-                    print('iter: %d / %d, total loss: %.6f\n >>> rpn_loss_cls: %.6f\n '
-                          '>>> rpn_loss_box: %.6f\n >>> loss_cls: %.6f\n >>> loss_box: %.6f\n ' % \
-                          (iter, cfg.FLAGS.max_iters, total_loss, rpn_loss_cls, rpn_loss_box, loss_cls, loss_box))
-                    print('speed: {:.3f}s / iter'.format(timer.average_time))
-                    print('remaining time: {:.3f}h'.format(((cfg.FLAGS.max_iters - iter) * timer.average_time) / 3600))
-                    # print('iter: %d / %d, total loss: %.6f\n >>> rpn_loss_cls: %.6f\n '
-                    #       '>>> rpn_loss_box: %.6f\n >>> loss_cls: %.6f\n >>> loss_box: %.6f\n ' % \
-                    #       (iter, cfg.FLAGS.max_iters, total_loss, rpn_loss_cls, rpn_loss_box, loss_cls, loss_box))
-                    # print('speed: {:.3f}s / iter'.format(timer.average_time))
+                with profiler.phase('log'):
+                    window = metrics.write(iter)
+                    if profiler.enabled:
+                        print(profiler.summary())
+                    if cfg.FLAGS.USE_MASK is True:
+
+                        print('iter: %d / %d, total loss: %.6f\n >>> rpn_loss_cls: %.6f\n '
+                              '>>> rpn_loss_box: %.6f\n >>> loss_cls: %.6f\n >>> loss_box: %.6f\n >>> loss_mask: %.6f\n ' % \
+                              (iter, cfg.FLAGS.max_iters, total_loss, rpn_loss_cls, rpn_loss_box, loss_cls, loss_box, loss_mask,
+                               ))
+                        print('speed: {:.3f}s / iter'.format(timer.average_time))
+                        print('remaining time: {:.3f}h\n'.format(((cfg.FLAGS.max_iters - iter) * timer.average_time) / 3600))
+                    else:
+                        print('iter: %d / %d, total loss: %.6f\n >>> rpn_loss_cls: %.6f\n '
+                              '>>> rpn_loss_box: %.6f\n >>> loss_cls: %.6f\n >>> loss_box: %.6f\n ' % \
+                              (iter, cfg.FLAGS.max_iters, total_loss, rpn_loss_cls, rpn_loss_box, loss_cls, loss_box))
+                        print('speed: {:.3f}s / iter'.format(timer.average_time))
+                        print('remaining time: {:.3f}h'.format(((cfg.FLAGS.max_iters - iter) * timer.average_time) / 3600))
+                        # print('iter: %d / %d, total loss: %.6f\n >>> rpn_loss_cls: %.6f\n '
+                        #       '>>> rpn_loss_box: %.6f\n >>> loss_cls: %.6f\n >>> loss_box: %.6f\n ' % \
+                        #       (iter, cfg.FLAGS.max_iters, total_loss, rpn_loss_cls, rpn_loss_box, loss_cls, loss_box))
+                        # print('speed: {:.3f}s / iter'.format(timer.average_time))
 
 
 
@@ -286,25 +357,33 @@ class Train:
             #     self.snapshot(sess, iter,total_loss,best=True)
 
             if iter % cfg.FLAGS.snapshot_iterations == 0:
-                self.snapshot(sess, iter,total_loss)
-                wb = xlrd.open_workbook(self.loss_excel_path)
-                newb = copy(wb)
-                tabsheet = newb.get_sheet('My Worksheet')
-                k = len(tabsheet.rows)# k表示该sheet的最后一行
-                tabsheet.write(k, 0, loss_rpncls/cfg.FLAGS.snapshot_iterations)
-                tabsheet.write(k, 1, loss_rpnbox/cfg.FLAGS.snapshot_iterations)
-                tabsheet.write(k, 2, loss_cls1/cfg.FLAGS.snapshot_iterations)
-                tabsheet.write(k, 3, loss_box1/cfg.FLAGS.snapshot_iterations)
-                tabsheet.write(k, 4, loss_mask/cfg.FLAGS.snapshot_iterations)
-                tabsheet.write(k, 5, loss_total/cfg.FLAGS.snapshot_iterations)
-                tabsheet.write(k, 6, iter)
-                newb.save(self.loss_excel_path)
-                loss_total = 0
-                loss_rpnbox = 0
-                loss_rpncls = 0
-                loss_box1 = 0
-                loss_cls1 = 0
-                loss_mask = 0
+                # Rank snapshots by the mean loss of the last display window, not a single step
+                with profiler.phase('snapshot'):
+                    self.snapshot(sess, iter, window['total_loss_mean'] if window else total_loss)
+            profiler.end()
+        if metrics is not None:
+            metrics.close(iter)
+        if self.allreduce is not None:
+            self.allreduce.close()
+        if self.checkpointer is not None:
+            self.checkpointer.close()
+        if self.feature_cache is not None:
+            self.feature_cache.close()
+
+    def train_image(self, sess, train_op, profiler, run_kwargs):
+        """Losses of one image run with `train_op`."""
+        # Get training data, one batch at a time
+        with profiler.phase('data'):
+            blobs = self.data_layer.forward()
+        if 'feature_key' in blobs:
+            # Not cached yet: one forward pass of the backbone, then the same step as a cached image
+            with profiler.phase('features'):
+                blobs['net_conv4'] = self.feature_cache.put(
+                    blobs['feature_key'], self.net.extract_features(sess, blobs['data']))
+        with profiler.phase('run'):
+            if cfg.FLAGS.USE_MASK is True:
+                return self.net.train_step_with_mask(sess, blobs, train_op, **run_kwargs)
+            return self.net.train_step(sess, blobs, train_op, **run_kwargs)
 
     def get_variables_in_checkpoint_file(self, file_name):
         try:
@@ -353,6 +432,12 @@ class Train:
                 pickle.dump(perm, fid, pickle.HIGHEST_PROTOCOL)
                 pickle.dump(iter, fid, pickle.HIGHEST_PROTOCOL)
 
+            return filename, nfilename
+        elif self.checkpointer is not None:
+            # Meta info is captured now; the checkpoint and .pkl are written in the background
+            meta = (np.random.get_state(), self.data_layer._cur, np.array(self.data_layer._perm), iter)
+            filename = self.checkpointer.save(sess, iter, meta=meta, metric=total_loss)
+            nfilename = os.path.splitext(filename)[0] + '.pkl'
             return filename, nfilename
         else:
             # Store the model snapshot
@@ -382,5 +467,10 @@ class Train:
 
 
 if __name__ == '__main__':
-    train = Train()
-    train.train()
+    if cfg.FLAGS.workers > 1:
+        # Each worker parses the same command line; the settings are passed along for
+        # values set by the code rather than by arguments
+        launch(run_worker, cfg.FLAGS.workers, (cfg.settings.snapshot(),))
+    else:
+        train = Train()
+        train.train()